@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+
+"""
+Command line interface to the Babel Street Analytics API binding.
+
+Run C{python -m rosette --help} for usage.
+
+Copyright (c) 2014-2024 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import argparse
+import importlib
+import json
+import os
+import sys
+
+from rosette.api import API, RosetteException
+from rosette.batch import BatchRunner, JsonLinesWriter, read_inputs
+from rosette.corpus import Corpus
+from rosette.journal import Journal
+from rosette.load import CONSTANT, POISSON, StubServer, run_load
+from rosette.merge import merge_outputs
+
+
+def _option(text):
+    name, separator, value = text.partition('=')
+    if not name or not separator:
+        raise argparse.ArgumentTypeError('expected NAME=VALUE, got ' + repr(text))
+    try:
+        return name, json.loads(value)
+    except ValueError:
+        return name, value
+
+
+def _function(text):
+    module_name, separator, name = text.partition(':')
+    if not module_name or not separator or not name:
+        raise argparse.ArgumentTypeError('expected MODULE:FUNCTION, got ' + repr(text))
+    try:
+        return getattr(importlib.import_module(module_name), name)
+    except (ImportError, AttributeError) as exception:
+        raise argparse.ArgumentTypeError(str(exception))
+
+
+def _record_range(text):
+    start, separator, stop = text.partition(':')
+    try:
+        if not separator:
+            raise ValueError(text)
+        return int(start or 0), int(stop) if stop else None
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected START:STOP, got ' + repr(text))
+
+
+def _shard(text):
+    shard, separator, shards = text.partition('/')
+    try:
+        if not separator:
+            raise ValueError(text)
+        shard, shards = int(shard), int(shards)
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected I/N, got ' + repr(text))
+    if not 0 <= shard < shards:
+        raise argparse.ArgumentTypeError('the shard I of I/N must be between 0 and N - 1, got ' + repr(text))
+    return shard, shards
+
+
+def _add_connection_arguments(parser):
+    parser.add_argument('-k', '--key', help='Analytics API Key (default: $API_KEY)',
+                        default=os.environ.get('API_KEY'))
+    parser.add_argument('-u', '--url', help='Alternative API URL',
+                        default='https://analytics.babelstreet.com/rest/v1/')
+
+
+def _batch(args):
+    api = API(user_key=args.key, service_url=args.url)
+    for name, value in args.option:
+        api.set_option(name, value)
+
+    journal = Journal(args.journal) if args.journal else None
+    runner = BatchRunner(api, args.endpoint,
+                         max_workers=args.workers,
+                         retries=args.retries,
+                         journal=journal,
+                         facet=args.facet,
+                         failed_only=args.failed_only,
+                         queue_items=args.queue_items,
+                         queue_bytes=args.queue_bytes,
+                         processes=args.processes,
+                         postprocess=args.postprocess,
+                         shard=args.shard[0],
+                         shards=args.shard[1])
+
+    corpus = None
+    if args.records is not None:
+        if len(args.inputs) != 1 or args.inputs[0] == '-':
+            raise RosetteException("badArgument", "--records needs exactly one input file", repr(args.inputs))
+        corpus = Corpus(args.inputs[0], args.format)
+        records = corpus.records(*args.records)
+    else:
+        records = read_inputs(args.inputs, args.format)
+
+    if args.output and args.output != '-':
+        output = open(args.output, 'a' if journal is not None else 'w', encoding='utf-8')
+    else:
+        output = sys.stdout
+    try:
+        counts = runner.run(records, JsonLinesWriter(output))
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        if corpus is not None:
+            corpus.close()
+        if journal is not None:
+            journal.close()
+    sys.stderr.write('succeeded: %(succeeded)d, failed: %(failed)d, skipped: %(skipped)d\n' % counts)
+    return 1 if counts['failed'] else 0
+
+
+def _merge(args):
+    if args.shard_journal and not args.journal:
+        raise RosetteException("badArgument", "--shard-journal needs --journal", repr(args.shard_journal))
+    journal = Journal(args.journal) if args.journal else None
+    if args.output and args.output != '-':
+        output = open(args.output, 'w', encoding='utf-8')
+    else:
+        output = sys.stdout
+    try:
+        report = merge_outputs(args.outputs, read_inputs(args.input, args.format), JsonLinesWriter(output),
+                               args.shard_journal, journal)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        if journal is not None:
+            journal.close()
+    for doc_id in report['missing']:
+        sys.stderr.write('missing: %s\n' % doc_id)
+    for doc_id in report['unexpected']:
+        sys.stderr.write('not in the input: %s\n' % doc_id)
+    sys.stderr.write('succeeded: %d, failed: %d, missing: %d, not in the input: %d\n'
+                     % (report['succeeded'], report['failed'], len(report['missing']), len(report['unexpected'])))
+    return 1 if report['failed'] or report['missing'] else 0
+
+
+def _load(args):
+    stub = StubServer(concurrency=args.stub_concurrency, latency=args.stub_latency) if args.stub else None
+    try:
+        api = API(user_key=args.key, service_url=stub.url if stub else args.url)
+        for name, value in args.option:
+            api.set_option(name, value)
+        records = [record for _, record in read_inputs(args.inputs, args.format)] \
+            if args.endpoint.upper() not in ('PING', 'INFO') else None
+        report = run_load(api, args.endpoint, records,
+                          rate=args.rate,
+                          duration=args.duration,
+                          arrivals=args.arrivals,
+                          max_outstanding=args.max_outstanding,
+                          seed=args.seed)
+    finally:
+        if stub is not None:
+            stub.close()
+    sys.stdout.write(json.dumps(report.to_dict(), indent=2) + '\n')
+    return 0
+
+
+def _parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m rosette',
+        description='Babel Street Analytics API command line tools')
+    commands = parser.add_subparsers(dest='command', metavar='COMMAND')
+    commands.required = True
+
+    batch = commands.add_parser(
+        'batch',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        help='call an endpoint for every document of JSONL or plain text input',
+        description='Calls an endpoint for every input document and writes one JSON '
+                    'line per document as results complete.  JSONL records are '
+                    'parameter fields plus an optional "id"; plain text input is one '
+                    'document per line.')
+    _add_connection_arguments(batch)
+    batch.add_argument('endpoint', help='endpoint, e.g. entities or NAME_SIMILARITY')
+    batch.add_argument('inputs', nargs='*', metavar='INPUT', help='input files; - or none for stdin')
+    batch.add_argument('-f', '--format', choices=('auto', 'jsonl', 'text'), default='auto',
+                       help='input format')
+    batch.add_argument('--records', type=_record_range, metavar='START:STOP',
+                       help='only process these record numbers of a single input file, found '
+                            'through an index of line offsets kept next to the file')
+    batch.add_argument('--shard', type=_shard, metavar='I/N', default=(0, 1),
+                       help='only process shard I, from 0 to N - 1, of N shards split by a hash of '
+                            'the document IDs; see the merge command')
+    batch.add_argument('-o', '--output', help='output file; - for stdout', default='-')
+    batch.add_argument('-w', '--workers', type=int, default=4, help='concurrent requests')
+    batch.add_argument('-r', '--retries', type=int, default=3, help='retries for transient failures')
+    batch.add_argument('-j', '--journal',
+                       help='sqlite journal of progress; a rerun with the same journal resumes the job')
+    batch.add_argument('--failed-only', action='store_true',
+                       help='only resend documents the journal records as failed')
+    batch.add_argument('--queue-items', type=int, default=None,
+                       help='high-water mark in items of the read and write queues (default: 2 x workers)')
+    batch.add_argument('--queue-bytes', type=int, default=64 * 1024 * 1024,
+                       help='high-water mark in bytes of the read and write queues')
+    batch.add_argument('-p', '--processes', type=int, default=0,
+                       help='send requests from this many worker processes instead of threads')
+    batch.add_argument('--postprocess', type=_function, metavar='MODULE:FUNCTION',
+                       help='function applied to each result before it is written')
+    batch.add_argument('--facet', default='', help='morphology facet, e.g. lemmas')
+    batch.add_argument('--option', type=_option, action='append', default=[], metavar='NAME=VALUE',
+                       help='API option, may be repeated')
+    batch.set_defaults(func=_batch)
+
+    merge = commands.add_parser(
+        'merge',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        help='combine the outputs of the shards of a batch job',
+        description='Writes the output lines of the shards of a batch job, run with --shard, '
+                    'in the order of the job input, and lists on stderr the input documents '
+                    'without a result.  Every file must be readable from this machine, '
+                    'e.g. on a shared filesystem.')
+    merge.add_argument('outputs', nargs='+', metavar='OUTPUT', help='output files of the shards')
+    merge.add_argument('-i', '--input', action='append', required=True,
+                       help='input file of the job, may be repeated; - for stdin')
+    merge.add_argument('-f', '--format', choices=('auto', 'jsonl', 'text'), default='auto',
+                       help='input format')
+    merge.add_argument('-o', '--output', help='merged output file; - for stdout', default='-')
+    merge.add_argument('--shard-journal', action='append', default=[], metavar='JOURNAL',
+                       help='journal of a shard, may be repeated; merged into --journal')
+    merge.add_argument('-j', '--journal', help='sqlite journal to merge the shard journals into')
+    merge.set_defaults(func=_merge)
+
+    load = commands.add_parser(
+        'load',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        help='send requests at a fixed rate and report latency percentiles',
+        description='Sends requests to an endpoint at a fixed arrival rate, whether or not '
+                    'earlier requests have completed, and prints a JSON report of latency '
+                    'percentiles, throughput, errors by status and concurrency header values.  '
+                    'Input documents, as for batch, are sent in turn.')
+    _add_connection_arguments(load)
+    load.add_argument('endpoint', help='endpoint, e.g. entities, ping or NAME_SIMILARITY')
+    load.add_argument('inputs', nargs='*', metavar='INPUT', help='input files; - or none for stdin')
+    load.add_argument('-f', '--format', choices=('auto', 'jsonl', 'text'), default='auto',
+                      help='input format')
+    load.add_argument('--rate', type=float, default=10.0, help='requests per second')
+    load.add_argument('--duration', type=float, default=10.0, help='seconds to send requests for')
+    load.add_argument('--arrivals', choices=(POISSON, CONSTANT), default=POISSON,
+                      help='spacing of the requests')
+    load.add_argument('--max-outstanding', type=int, default=256, help='largest number of requests in progress')
+    load.add_argument('--seed', type=int, help='seed of the Poisson arrivals')
+    load.add_argument('--stub', action='store_true', help='run against a local stub server instead of --url')
+    load.add_argument('--stub-concurrency', type=int, default=4, help='concurrency header of the stub server')
+    load.add_argument('--stub-latency', type=float, default=0.0, help='response delay of the stub server')
+    load.add_argument('--option', type=_option, action='append', default=[], metavar='NAME=VALUE',
+                      help='API option, may be repeated')
+    load.set_defaults(func=_load)
+    return parser
+
+
+def main(argv=None):
+    """Entry point of C{python -m rosette}."""
+    args = _parser().parse_args(argv)
+    try:
+        return args.func(args)
+    except RosetteException as exception:
+        sys.stderr.write(str(exception) + '\n')
+        return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
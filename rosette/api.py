@@ -17,8 +17,12 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
+import collections
+import contextlib
 import gzip
+import hashlib
 import json
 import logging
 import sys
@@ -26,6 +30,21 @@ import os
 import re
 import requests
 import platform
+import queue
+import random
+import threading
+import time
+import weakref
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+from urllib3.exceptions import ConnectTimeoutError
+from urllib3.util.retry import Retry
+
+from rosette.results import result_class
 
 _APPLICATION_JSON = 'application/json'
 _BINDING_LANGUAGE = 'python'
@@ -37,9 +56,33 @@ _LEGACY_CUSTOM_HEADER_PREFIX = 'X-RosetteAPI-'
 _CUSTOM_HEADER_PREFIX = "X-BabelStreetAPI-"
 _CUSTOM_HEADER_PATTERN = re.compile('^(:?' + _CUSTOM_HEADER_PREFIX + '|' + _LEGACY_CUSTOM_HEADER_PREFIX + ')')
 _GZIP_BYTEARRAY = bytearray([0x1F, 0x8b, 0x08])
+KEEPALIVE_PING = 'ping'
+KEEPALIVE_REAP = 'reap'
+# Statuses at which the server has not processed the request, so that
+# retrying it cannot run, or bill, it twice
+RETRY_STATUSES = (429, 503)
+# Statuses after which a node is avoided for failover_time
+_NODE_FAILURE_STATUSES = (502, 503, 504)
+# Longest wait, in seconds, honored for a Retry-After header
+_RETRY_AFTER_MAX = 30
+BALANCE_LEAST_OUTSTANDING = 'least-outstanding'
+BALANCE_LATENCY = 'latency'
+PRIORITY_HIGH = 'high'
+PRIORITY_NORMAL = 'normal'
+PRIORITY_LOW = 'low'
+DEFAULT_PRIORITY_WEIGHTS = {PRIORITY_HIGH: 8, PRIORITY_NORMAL: 2, PRIORITY_LOW: 1}
+_NON_DOCUMENT_ENDPOINTS = ('ADDRESS_SIMILARITY', 'INFO', 'NAME_DEDUPLICATION', 'NAME_SIMILARITY',
+                           'NAME_TRANSLATION', 'PING', 'RECORD_SIMILARITY')
 
 _ISPY3 = sys.version_info[0] == 3
 
+
+def _no_auth(request):
+    """Auth hook that leaves the request unchanged.  Passed instead of C{None}
+    so that the session does not look for C{.netrc} credentials again."""
+    return request
+
+
 if _ISPY3:
     _GZIP_SIGNATURE = _GZIP_BYTEARRAY
 else:
@@ -48,11 +91,15 @@ else:
 
 class _ReturnObject(object):
 
-    def __init__(self, js, code):
-        self._json = js
+    def __init__(self, content, response_headers, code):
+        self.content = content
+        self.response_headers = response_headers
         self.status_code = code
+        self._json = None
 
     def json(self):
+        if self._json is None:
+            self._json = _my_loads(self.content, self.response_headers)
         return self._json
 
 
@@ -67,6 +114,372 @@ def _my_loads(obj, response_headers):
         return temp
 
 
+class _Flight(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exception = None
+
+
+def _own_copy(result):
+    return dict(result) if isinstance(result, dict) else result
+
+
+class _SingleFlight(object):
+    """Lets only one of several concurrent calls with the same key run; the
+    others wait for it and share its result or exception.
+
+    Every caller, the one that ran the call included, gets its own shallow
+    copy of a dictionary result, so it may add or remove keys; nested values
+    are shared and must not be modified."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def do(self, key, function):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            flight.done.wait()
+            if flight.exception is not None:
+                raise flight.exception
+            return _own_copy(flight.result)
+        try:
+            # Kept unmodified for the followers, who copy it after done is set
+            flight.result = function()
+            return _own_copy(flight.result)
+        except Exception as exception:
+            flight.exception = exception
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+
+class _Scheduler(object):
+    """Shares the connection slots of an L{API}, one per pooled connection,
+    between priority classes by weighted fair queuing.
+
+    Each waiting request gets a virtual finish tag, the tag of the previous
+    request of its class or the current virtual time, whichever is later, plus
+    the inverse of the class weight.  A free slot goes to the waiting request
+    with the lowest tag, so busy classes share the slots in proportion to
+    their weights and an idle class does not build up credit.  A share of the
+    slots can be reserved for L{PRIORITY_HIGH}.
+    """
+
+    def __init__(self, api, weights, reserved_share):
+        if PRIORITY_NORMAL not in weights or any(weight <= 0 for weight in weights.values()):
+            raise RosetteException("badArgument", "Priority weights must be positive and include normal",
+                                   repr(weights))
+        self.api = api
+        self.weights = dict(weights)
+        self.reserved_share = reserved_share
+        self.condition = threading.Condition()
+        self.waiting = dict((priority, collections.deque()) for priority in self.weights)
+        self.finish = dict((priority, 0.0) for priority in self.weights)
+        self.virtual_time = 0.0
+        self.in_use = 0
+        self.local = threading.local()
+
+    def current(self):
+        """Return the priority set for the calling thread."""
+        return getattr(self.local, 'priority', PRIORITY_NORMAL)
+
+    def __eligible(self, priority, slots):
+        if priority == PRIORITY_HIGH:
+            return self.in_use < slots
+        return self.in_use < slots - int(slots * self.reserved_share)
+
+    def __next(self):
+        """Return the waiting request that gets the next free slot, if any."""
+        slots = max(self.api.get_pool_size(), 1)
+        heads = [queue_[0] for priority, queue_ in self.waiting.items()
+                 if queue_ and self.__eligible(priority, slots)]
+        return min(heads) if heads else None
+
+    def acquire(self):
+        """Wait for a slot for a request at the calling thread's priority."""
+        priority = self.current()
+        with self.condition:
+            tag = max(self.virtual_time, self.finish[priority]) + 1.0 / self.weights[priority]
+            self.finish[priority] = tag
+            entry = (tag, id(threading.current_thread()), priority)
+            self.waiting[priority].append(entry)
+            while self.__next() is not entry:
+                self.condition.wait()
+            self.waiting[priority].popleft()
+            self.virtual_time = tag
+            self.in_use += 1
+            # The next request may be eligible too if several slots are free
+            self.condition.notify_all()
+
+    def release(self):
+        with self.condition:
+            self.in_use -= 1
+            self.condition.notify_all()
+
+    def wake(self):
+        """Let waiting requests recheck the number of slots."""
+        with self.condition:
+            self.condition.notify_all()
+
+
+class _PoolQueue(queue.LifoQueue):
+    """Connection queue of a urllib3 connection pool which can be resized in
+    place.  Idle connections are kept when the pool grows; when it shrinks
+    below the number of connections in use, connections returned to the pool
+    are closed until the pool is back to size."""
+
+    def _init(self, maxsize):
+        queue.LifoQueue._init(self, maxsize)
+        self.excess = 0
+
+    def put(self, item, block=True, timeout=None):
+        with self.mutex:
+            absorbed = self.excess > 0
+            if absorbed:
+                self.excess -= 1
+        if not absorbed:
+            queue.LifoQueue.put(self, item, block, timeout)
+        elif item is not None:
+            item.close()
+
+    def resize(self, maxsize):
+        closing = []
+        with self.mutex:
+            in_use = self.maxsize + self.excess - len(self.queue)
+            free = maxsize - in_use
+            if free >= len(self.queue):
+                added = free - len(self.queue)
+                # Empty slots go to the bottom, so that idle connections are reused first
+                self.queue[:0] = [None] * added
+                self.excess = 0
+                self.not_empty.notify(added)
+            else:
+                surplus = len(self.queue) - max(free, 0)
+                kept = [item for item in self.queue if item is not None]
+                empty = len(self.queue) - len(kept)
+                closing = kept[:max(surplus - empty, 0)]
+                kept = kept[len(closing):]
+                self.queue[:] = [None] * max(empty - surplus, 0) + kept
+                self.excess = max(-free, 0)
+            self.maxsize = maxsize
+        for connection in closing:
+            connection.close()
+
+
+def _resizable_pool_class(base, adapter):
+    class _ResizablePool(base):
+        QueueCls = _PoolQueue
+
+        def __init__(self, host, port=None, *args, **kwargs):
+            # The pool manager's maxsize is part of its pool keys, so the
+            # current size is taken from the adapter instead.
+            kwargs['maxsize'] = adapter._host_maxsize.get((host, port), adapter._pool_maxsize)
+            base.__init__(self, host, port, *args, **kwargs)
+
+    return _ResizablePool
+
+
+class _PoolAdapter(requests.adapters.HTTPAdapter):
+    """HTTP adapter whose connection pools, one per host, can be resized
+    without dropping their connections."""
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        self._host_maxsize = {}
+        super(_PoolAdapter, self).init_poolmanager(connections, maxsize, block, **pool_kwargs)
+        self.__use_resizable_pools(self.poolmanager)
+
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        known = proxy in self.proxy_manager
+        manager = super(_PoolAdapter, self).proxy_manager_for(proxy, **proxy_kwargs)
+        if not known:
+            self.__use_resizable_pools(manager)
+        return manager
+
+    def __use_resizable_pools(self, manager):
+        manager.pool_classes_by_scheme = dict(
+            (scheme, _resizable_pool_class(base, self))
+            for scheme, base in manager.pool_classes_by_scheme.items())
+
+    def resize(self, maxsize, host=None):
+        """Set the number of connections kept per host, in existing and future pools.
+        @param host: (Optional) C{(hostname, port)} of the only pool to resize.
+        """
+        if host is None:
+            self._pool_maxsize = maxsize
+            self._host_maxsize.clear()
+        else:
+            self._host_maxsize[host] = maxsize
+        for manager in [self.poolmanager] + list(self.proxy_manager.values()):
+            for key in list(manager.pools.keys()):
+                pool = manager.pools.get(key)
+                if pool is None or not isinstance(pool.pool, _PoolQueue):
+                    continue
+                if host is None or (pool.host, pool.port) == host:
+                    pool.pool.resize(maxsize)
+
+
+class _Retry(Retry):
+    """urllib3 C{Retry} waiting at most C{_RETRY_AFTER_MAX} seconds for a
+    C{Retry-After} header."""
+
+    def get_retry_after(self, response):
+        retry_after = super(_Retry, self).get_retry_after(response)
+        return None if retry_after is None else min(retry_after, _RETRY_AFTER_MAX)
+
+
+def _is_connect_error(error):
+    """Whether a C{requests} exception means the request could not be sent at all."""
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(error, requests.exceptions.ConnectTimeout) or isinstance(reason, ConnectTimeoutError)
+
+
+def _concurrency(headers):
+    """Return the concurrency advertised in response headers, or C{None}."""
+    value = headers.get(_CONCURRENCY_HEADER, headers.get(_LEGACY_CONCURRENCY_HEADER))
+    try:
+        concurrency = int(value)
+    except (TypeError, ValueError):
+        return None
+    return concurrency if concurrency > 0 else None
+
+
+class _Node(object):
+    """One of several service URLs, with its request statistics."""
+
+    def __init__(self, url):
+        self.url = url
+        parts = urlsplit(url)
+        self.host = (parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80))
+        self.pool_size = 1
+        self.outstanding = 0
+        self.latency = None
+        self.down_until = 0
+
+    def __repr__(self):
+        return '<node ' + self.url + '>'
+
+
+class _Balancer(object):
+    """Spreads the requests of an L{API} over several service URLs and fails
+    over to another node when one cannot be reached or is unavailable."""
+
+    # Weight of the latest request in the average latency of a node
+    LATENCY_WEIGHT = 0.2
+
+    def __init__(self, api, urls, strategy, down_time, statuses):
+        if strategy not in (BALANCE_LEAST_OUTSTANDING, BALANCE_LATENCY):
+            raise RosetteException("badArgument", "Unknown balancing strategy", repr(strategy))
+        self.api = api
+        self.nodes = [_Node(url) for url in urls]
+        self.strategy = strategy
+        self.down_time = down_time
+        self.statuses = tuple(statuses)
+        self.pinned = threading.local()
+        self.lock = threading.Lock()
+        self.turn = 0
+
+    def __score(self, node):
+        if self.strategy == BALANCE_LATENCY:
+            # Nodes without a measurement yet come first
+            return (node.latency or 0.0) * (node.outstanding + 1)
+        return float(node.outstanding) / node.pool_size
+
+    def choose(self, excluded):
+        """Pick a node not in C{excluded}, preferring nodes that are up, and
+        count a request outstanding on it.  Returns C{None} if none is left."""
+        now = time.monotonic()
+        with self.lock:
+            candidates = [node for node in self.nodes if node not in excluded]
+            up = [node for node in candidates if node.down_until <= now] or candidates
+            if not up:
+                return None
+            # Rotate the candidates so that ties do not always go to the first node
+            self.turn = (self.turn + 1) % len(up)
+            node = min(up[self.turn:] + up[:self.turn], key=self.__score)
+            node.outstanding += 1
+            return node
+
+    def finished(self, node, elapsed, failed):
+        with self.lock:
+            node.outstanding -= 1
+            if failed:
+                node.down_until = time.monotonic() + self.down_time
+                return
+            node.down_until = 0
+            if node.latency is None:
+                node.latency = elapsed
+            else:
+                node.latency += self.LATENCY_WEIGHT * (elapsed - node.latency)
+
+    def send(self, request, send):
+        """Send C{request}, addressed to the first service URL, with C{send},
+        to the best node, trying the other nodes in turn on failure."""
+        primary = self.api.service_url
+        if not request.url.startswith(primary):
+            return send(request)
+        path = request.url[len(primary):]
+        pinned = getattr(self.pinned, 'node', None)
+        tried = set(node for node in self.nodes if node is not pinned) if pinned else set()
+        while True:
+            node = self.choose(tried)
+            tried.add(node)
+            request.url = node.url + path
+            start = time.monotonic()
+            try:
+                response = send(request)
+            except requests.exceptions.RequestException as exception:
+                self.finished(node, 0, True)
+                self.api.logger.warning('%s failed: %s', node.url, exception)
+                # A request that may have reached the node is not sent twice
+                if _is_connect_error(exception) and len(tried) < len(self.nodes):
+                    continue
+                raise
+            failed = response.status_code in _NODE_FAILURE_STATUSES
+            self.finished(node, time.monotonic() - start, failed)
+            concurrency = _concurrency(response.headers)
+            if concurrency is not None and concurrency != node.pool_size:
+                self.api._resize_pool(concurrency, node)
+            if response.status_code in self.statuses and len(tried) < len(self.nodes):
+                self.api.logger.warning('%s answered %d, failing over', node.url, response.status_code)
+                response.close()
+                continue
+            return response
+
+
+class _ConnectionKeeper(threading.Thread):
+    """Background thread applying an L{API}'s keep-alive policy whenever its
+    connections have been idle for the keep-alive interval."""
+
+    def __init__(self, api, policy, interval):
+        super(_ConnectionKeeper, self).__init__(name='rosette-keepalive')
+        self.daemon = True
+        self.api = weakref.ref(api)
+        self.policy = policy
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval / 2.0):
+            api = self.api()
+            if api is None:
+                return
+            if time.monotonic() - api._last_activity >= self.interval:
+                if self.policy == KEEPALIVE_PING:
+                    api.warm_up()
+                else:
+                    api._close_idle_connections()
+            del api
+
+
 class RosetteException(Exception):
     """Exception thrown by all Analytics API operations for errors local and remote.
 
@@ -399,6 +812,8 @@ class EndpointCaller(object):
 
     def __finish_result(self, response, ename):
         code = response.status_code
+        if code == 200 and self.api.typed_results:
+            return result_class(self.suburl)(response.content, response.response_headers["responseHeaders"])
         the_json = response.json()
         if code == 200:
             return the_json
@@ -415,7 +830,7 @@ class EndpointCaller(object):
             raise RosetteException(code, complaint_url +
                                    " : failed to communicate with Babel Street Analytics API", msg)
 
-    def __set_headers(self):
+    def __set_headers(self, custom=True):
         headers = {'Accept': _APPLICATION_JSON,
                    _CUSTOM_HEADER_PREFIX + 'Binding': _BINDING_LANGUAGE,
                    _CUSTOM_HEADER_PREFIX + 'Binding-Version': _BINDING_VERSION,
@@ -423,7 +838,7 @@ class EndpointCaller(object):
                    _LEGACY_CUSTOM_HEADER_PREFIX + 'Binding': _BINDING_LANGUAGE,
                    _LEGACY_CUSTOM_HEADER_PREFIX + 'Binding-Version': _BINDING_VERSION}
 
-        custom_headers = self.api.get_custom_headers()
+        custom_headers = self.api.get_custom_headers() if custom else None
         if custom_headers is not None:
             for key in custom_headers.keys():
                 if _CUSTOM_HEADER_PATTERN.match(key) is not None:
@@ -449,7 +864,7 @@ class EndpointCaller(object):
         identifying data."""
         url = self.service_url + self.api.endpoints["INFO"]
         headers = self.__set_headers()
-        self.logger.info('info: ' + url)
+        self.logger.debug('info: %s', url)
         response = self.api.get_http(url, headers=headers)
         return self.__finish_result(response, "info")
 
@@ -461,10 +876,18 @@ class EndpointCaller(object):
 
         url = self.service_url + self.api.endpoints['PING']
         headers = self.__set_headers()
-        self.logger.info('Ping: ' + url)
+        self.logger.debug('Ping: %s', url)
         response = self.api.get_http(url, headers=headers)
         return self.__finish_result(response, "ping")
 
+    def _probe(self, endpoint='PING'):
+        """Internal. Issues a C{ping} or C{info} request on behalf of the L{API}
+        itself, e.g. to warm up connections.  Custom headers set for the next
+        call are neither sent nor cleared."""
+        url = self.service_url + self.api.endpoints[endpoint]
+        response = self.api.get_http(url, headers=self.__set_headers(custom=False))
+        return self.__finish_result(response, endpoint.lower())
+
     def call(self, parameters, paramtype=None):
         """Invokes the endpoint to which this L{EndpointCaller} is bound.
         Passes data and metadata specified by C{parameters} to the server
@@ -506,9 +929,7 @@ class EndpointCaller(object):
         self.use_multipart = parameters.use_multipart
         url = self.service_url + self.suburl
         params_to_serialize = parameters.serialize(self.api.options)
-        headers = {}
-        if self.user_key is not None:
-            headers = self.__set_headers()
+        headers = self._request_headers()
 
         if self.use_multipart:
             payload = None
@@ -531,24 +952,48 @@ class EndpointCaller(object):
                     _APPLICATION_JSON)}
             request = requests.Request(
                 'POST', url, files=files, headers=headers, params=payload)
-            prepared_request = self.api.session.prepare_request(request)
-            settings = self.api.session.merge_environment_settings(prepared_request.url, {}, {}, None, None)
-            response = self.api.session.send(prepared_request, **settings)
+            response = self.api._send(request)
             rdata = response.content
             response_headers = {"responseHeaders": dict(response.headers)}
             status = response.status_code
-            response = _ReturnObject(
-                _my_loads(rdata, response_headers), status)
-        else:
-            if self.debug:
-                headers[_LEGACY_CUSTOM_HEADER_PREFIX + 'Devel'] = 'true'
-            self.logger.info('operate: ' + url)
-            headers['Accept'] = _APPLICATION_JSON
-            headers['Accept-Encoding'] = "gzip"
-            headers['Content-Type'] = _APPLICATION_JSON
-            response = self.api.post_http(url, params_to_serialize, headers)
+            response = _ReturnObject(rdata, response_headers, status)
+            return self.__finish_result(response, "operate")
+        return self._call_serialized(json.dumps(params_to_serialize), headers)
+
+    def _request_headers(self):
+        """Internal. Returns the headers for a call, consuming the L{API}'s custom headers."""
+        if self.user_key is not None:
+            return self.__set_headers()
+        return {}
+
+    def _call_serialized(self, json_data, headers):
+        """Internal. Posts an already serialized JSON request to the bound endpoint.
+        @param json_data: the request body.
+        @param headers: headers from L{_request_headers}; not modified.
+        """
+        url = self.service_url + self.suburl
+        headers = dict(headers)
+        if self.debug:
+            headers[_LEGACY_CUSTOM_HEADER_PREFIX + 'Devel'] = 'true'
+        self.logger.debug('operate: %s', url)
+        headers['Accept'] = _APPLICATION_JSON
+        headers['Accept-Encoding'] = "gzip"
+        headers['Content-Type'] = _APPLICATION_JSON
+        if self.api.coalesce_requests:
+            return self.api._single_flight.do(
+                self.__flight_key(url, json_data, headers),
+                lambda: self.__finish_result(self.api._post_json(url, json_data, headers), "operate"))
+        response = self.api._post_json(url, json_data, headers)
         return self.__finish_result(response, "operate")
 
+    def __flight_key(self, url, json_data, headers):
+        digest = hashlib.sha256()
+        for part in (url, json_data, json.dumps(self.api.url_parameters, sort_keys=True),
+                     json.dumps(headers, sort_keys=True)):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.digest()
+
 
 class API(object):
     """
@@ -561,24 +1006,151 @@ class API(object):
             self,
             user_key=None,
             service_url='https://analytics.babelstreet.com/rest/v1/',
-            retries=5,
+            retries=None,
             refresh_duration=0.5,
-            debug=False):
+            debug=False,
+            typed_results=False,
+            coalesce_requests=False,
+            warm_connections=0,
+            warm_on_resize=False,
+            keepalive_policy=None,
+            keepalive_interval=60,
+            proxies=None,
+            verify=None,
+            cert=None,
+            pool_block=False,
+            balance=BALANCE_LEAST_OUTSTANDING,
+            failover_time=30,
+            priority_weights=None,
+            reserved_share=0,
+            session=None,
+            cassette=None,
+            slow_calls=None,
+            log_sampling=None,
+            retry_statuses=None,
+            submit_workers=32,
+            failover_statuses=RETRY_STATUSES):
         """ Create an L{API} object.
         @param user_key: (Optional; required for servers requiring authentication.)
         An authentication string to be sent as user_key with all requests.  The
         default Analytics server requires authentication to the server.
+        @param service_url: (Optional) the URL of the server, or a list of URLs of
+        equivalent servers, e.g. several on-premise nodes.  Requests are then
+        spread over the nodes according to C{balance}, each node has its own
+        connection pool sized from its own concurrency header, and a request
+        that fails to connect, or is answered with one of C{failover_statuses},
+        is sent to another node.  A node that fails, or answers 502, 503 or
+        504, is avoided for C{failover_time}.
+        @param retries: (Optional) number of times a request is retried after it
+        failed to connect, and so was not sent, or after a response with one of
+        C{retry_statuses}.  By default nothing is retried and the first
+        failure is raised; this argument was ignored before version 1.31.0,
+        when its default was 5.  With several service URLs, a failed request
+        is sent to the next node instead.
+        @param refresh_duration: (Optional) backoff factor, in seconds, between retries;
+        the wait doubles with each retry.
+        @param typed_results: (Optional) return L{rosette.results.Result} objects,
+        which decode the response lazily and keep the response headers separate,
+        instead of dictionaries.
+        @param coalesce_requests: (Optional) when several threads make the same call
+        at the same time, send only one request and give all of them its result
+        or exception.  Calls are the same when endpoint, body, options, URL
+        parameters and headers are identical.
+        @param warm_connections: (Optional) number of connections to open with
+        L{warm_up} before the constructor returns.
+        @param warm_on_resize: (Optional) when the pool size changes, e.g. because the
+        server advertises a new concurrency, open the new number of connections
+        in the background.
+        @param keepalive_policy: (Optional) what to do with connections idle for
+        C{keepalive_interval} seconds: C{KEEPALIVE_PING} keeps them open with
+        pings, C{KEEPALIVE_REAP} closes them so the next call does not find a
+        connection the server or a proxy has dropped.  C{None} does neither.
+        @param keepalive_interval: idle time, in seconds, after which the
+        keep-alive policy applies.
+        @param proxies: (Optional) dictionary of scheme to proxy URL used for all
+        requests instead of the proxies found in the environment; C{{}} means no proxy.
+        @param verify: (Optional) C{True}, C{False} or the path of a CA bundle, used
+        instead of C{REQUESTS_CA_BUNDLE} and C{CURL_CA_BUNDLE}.
+        @param cert: (Optional) client certificate file, or pair of certificate and
+        key files.
+        Proxy, TLS and C{.netrc} settings not pinned here are resolved from the
+        environment once per host; see L{clear_settings_cache}.
+        @param pool_block: (Optional) when all pooled connections to a host are in
+        use, wait for one instead of opening an extra connection that is closed
+        after the request.
+        @param balance: (Optional) with several service URLs, how a node is chosen:
+        C{BALANCE_LEAST_OUTSTANDING} picks the node with the fewest requests in
+        progress relative to its concurrency, C{BALANCE_LATENCY} weighs requests
+        in progress by the node's average response time.
+        @param failover_time: (Optional) seconds during which a failed node only
+        receives requests when all other nodes have failed too, or after
+        L{check_health} finds it up again.
+        @param priority_weights: (Optional) dictionary of priority class to weight,
+        e.g. L{DEFAULT_PRIORITY_WEIGHTS}, which enables scheduling: requests then
+        wait for one of the L{get_pool_size} connection slots, which are shared
+        between the classes of the waiting requests in proportion to their
+        weights.  Set the class of the calls made by a thread with L{priority};
+        the default is C{PRIORITY_NORMAL}.
+        @param reserved_share: (Optional) share of the connection slots only
+        C{PRIORITY_HIGH} requests may use, e.g. C{0.25}; enables scheduling with
+        L{DEFAULT_PRIORITY_WEIGHTS} if no weights are given.
+        @param session: (Optional) a C{requests.Session} shared with other L{API}
+        objects.  Its owner sets up its adapters and closes it; this object then
+        neither resizes its pools, nor applies C{retries} and C{pool_block}, nor
+        closes it.  Enable scheduling to limit this object's requests to its own
+        concurrency.
+        @param cassette: (Optional) a L{rosette.cassette.Cassette} which records the
+        requests and responses of this object, or replays recorded responses
+        instead of sending requests.
+        @param slow_calls: (Optional) a L{rosette.slowlog.SlowCallLog} in which
+        calls slower or larger than its thresholds are recorded.
+        @param log_sampling: (Optional) dictionary of endpoint path, e.g. C{entities}
+        or C{morphology/lemmas}, to the share of its requests logged as events
+        by the C{rosette.api.requests} logger; the key C{*} applies to the other
+        endpoints, which are all logged by default.  Each event is logged at
+        INFO level with the attributes C{endpoint}, C{status}, C{bytes_sent},
+        C{bytes_received} and C{duration} set on the log record, for
+        structured formatters.  Nothing is measured while that logger is
+        disabled.
+        @param retry_statuses: (Optional) HTTP statuses after which a request is
+        retried, waiting as asked by C{Retry-After} for at most 30 seconds,
+        e.g. L{RETRY_STATUSES}.  By default the first response is returned,
+        whatever its status.  A request answered with 502 or 504 may have
+        been processed, and billed, already.
+        @param submit_workers: (Optional) largest number of calls made with
+        L{submit} in progress at once.
+        @param failover_statuses: (Optional) with several service URLs, HTTP
+        statuses after which a request is sent to another node.  Requests
+        that fail after they may have reached a node, e.g. on a read timeout,
+        are not sent again.  Add 502 or 504 only if the endpoints called may
+        be run, and billed, twice.
         """
         # logging.basicConfig(filename="binding.log", filemode="w", level=logging.DEBUG)
+        # Used by close(), which __del__ calls even if the constructor raises
+        self._keeper = None
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._owns_session = False
+        self.submit_workers = submit_workers
         self.user_key = user_key
-        self.service_url = service_url if service_url.endswith(
-            '/') else service_url + '/'
+        if isinstance(service_url, (list, tuple)):
+            if not service_url:
+                raise RosetteException("badArgument", "At least one service URL is required", "service_url")
+            service_urls = list(service_url)
+        else:
+            service_urls = [service_url]
+        self.service_urls = [url if url.endswith('/') else url + '/' for url in service_urls]
+        self.service_url = self.service_urls[0]
         self.logger = logging.getLogger('rosette.api')
-        self.logger.info('Initialized on ' + self.service_url)
+        self.request_logger = logging.getLogger('rosette.api.requests')
+        self.log_sampling = dict(log_sampling or {})
+        self.logger.info('Initialized on %s', self.service_url)
         self.debug = debug
+        self.typed_results = typed_results
+        self.coalesce_requests = coalesce_requests
+        self._single_flight = _SingleFlight()
 
-        if retries < 1:
-            retries = 1
+        retries = max(retries or 0, 0)
         if refresh_duration < 0:
             refresh_duration = 0
 
@@ -587,7 +1159,49 @@ class API(object):
         self.custom_headers = {}
         self.url_parameters = {}
         self.max_pool_size = 1
-        self.session = requests.Session()
+        self.cassette = cassette
+        self.slow_calls = slow_calls
+        self._owns_session = session is None
+        self.session = requests.Session() if session is None else session
+        self.retries = retries
+        self.retry_statuses = tuple(retry_statuses or ())
+        if len(self.service_urls) > 1:
+            # The balancer sends a failed request to the next node at once instead
+            self.retry = _Retry(0, read=False, raise_on_status=False)
+        else:
+            self.retry = _Retry(total=retries, connect=retries, read=0,
+                                status=retries if self.retry_statuses else 0,
+                                backoff_factor=refresh_duration,
+                                status_forcelist=self.retry_statuses,
+                                allowed_methods=frozenset(['GET', 'POST']),
+                                raise_on_status=False)
+        self._adapter = None
+        if self._owns_session:
+            # One pool per node, so that no node's warm connections are evicted
+            self._adapter = _PoolAdapter(pool_connections=max(requests.adapters.DEFAULT_POOLSIZE,
+                                                              len(self.service_urls)),
+                                         pool_maxsize=self.max_pool_size,
+                                         max_retries=self.retry,
+                                         pool_block=pool_block)
+            self.session.mount('https://', self._adapter)
+            self.session.mount('http://', self._adapter) # NOSONAR
+        self._scheduler = None
+        if priority_weights is not None or reserved_share > 0:
+            self._scheduler = _Scheduler(self, priority_weights or DEFAULT_PRIORITY_WEIGHTS, reserved_share)
+        self._balancer = None
+        if len(self.service_urls) > 1:
+            self._balancer = _Balancer(self, self.service_urls, balance, failover_time, failover_statuses)
+            self.max_pool_size = len(self.service_urls)
+        self.balance = balance
+        self.failover_time = failover_time
+        self.failover_statuses = tuple(failover_statuses)
+        self.pool_block = pool_block
+        self.proxies = proxies
+        self.verify = verify
+        self.cert = cert
+        self._settings_cache = {}
+        self.warm_on_resize = warm_on_resize
+        self._last_activity = time.monotonic()
         self.user_agent_string = 'Babel-Street-Analytics-API-Python/' + _BINDING_VERSION + '/' + platform.python_version()
 
         self.morphology_output = {
@@ -623,12 +1237,65 @@ class API(object):
             'RECORD_SIMILARITY': 'record-similarity'
         }
 
+        if warm_connections > 0:
+            self.warm_up(warm_connections)
+        if keepalive_policy is not None:
+            if keepalive_policy not in (KEEPALIVE_PING, KEEPALIVE_REAP):
+                raise RosetteException("badArgument", "Unknown keep-alive policy", repr(keepalive_policy))
+            self._keeper = _ConnectionKeeper(self, keepalive_policy, keepalive_interval)
+            self._keeper.start()
+
     def __del__(self):
         try:
-            self.session.close()
+            self.close()
         except ReferenceError:
             pass
 
+    def close(self):
+        """Stop the keep-alive thread, if any, and close all connections."""
+        if self._keeper is not None:
+            self._keeper.stopped.set()
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        if self._owns_session:
+            self.session.close()
+
+    def _transport_retry(self):
+        """Internal. Returns the C{Retry} applied to this object's requests by
+        its adapter, or C{None} if it is not known, with a shared session."""
+        return self.retry if self._owns_session else None
+
+    def warm_up(self, connections=None):
+        """
+        Open connections ahead of use by sending concurrent pings, so that
+        later calls do not pay for DNS, TCP and TLS setup.  The pool is grown
+        to hold C{connections} if it is smaller.  Failures are logged, not raised.
+        @param connections: number of connections; defaults to the pool size.
+        @return: the number of pings that succeeded.
+        """
+        connections = connections or self.get_pool_size()
+        if connections > self.get_pool_size():
+            self._resize_pool(-(-connections // len(self.service_urls)))
+
+        def ping():
+            try:
+                EndpointCaller(self, None)._probe()
+                return True
+            except RosetteException as exception:
+                self.logger.warning('warm-up ping failed: %s', exception)
+                return False
+
+        with ThreadPoolExecutor(max_workers=connections) as executor:
+            return sum(executor.map(lambda _: ping(), range(connections)))
+
+    def _close_idle_connections(self):
+        if self._owns_session:
+            for adapter in self.session.adapters.values():
+                adapter.close()
+        self._last_activity = time.monotonic()
+
     def get_binding_version(self):
         """ Return the current binding version """
         return _BINDING_VERSION
@@ -638,24 +1305,195 @@ class API(object):
         return self.user_agent_string
 
     def set_pool_size(self, new_pool_size):
-        """Sets the connection pool size.
+        """Sets the connection pool size; with several service URLs, of every node.
         @parameter new_pool_size: pool size to set
         """
-        self.max_pool_size = new_pool_size
-        adapter = requests.adapters.HTTPAdapter(
-            pool_maxsize=new_pool_size)
-        if 'https:' in self.service_url:
-            self.session.mount('https://', adapter)
+        self._resize_pool(new_pool_size)
+        if self.warm_on_resize:
+            warmer = threading.Thread(target=self.warm_up, name='rosette-warm-up')
+            warmer.daemon = True
+            warmer.start()
+
+    def _resize_pool(self, new_pool_size, node=None):
+        new_pool_size = int(new_pool_size)
+        if self._balancer is None:
+            self.max_pool_size = new_pool_size
+            if self._adapter is not None:
+                self._adapter.resize(new_pool_size)
         else:
-            self.session.mount('http://', adapter) # NOSONAR
+            for each in [node] if node is not None else self._balancer.nodes:
+                each.pool_size = new_pool_size
+                if self._adapter is not None:
+                    self._adapter.resize(new_pool_size, each.host)
+            self.max_pool_size = sum(each.pool_size for each in self._balancer.nodes)
+        if self._scheduler is not None:
+            self._scheduler.wake()
 
     def __adjust_concurrency(self, dict_headers):
-        if _CONCURRENCY_HEADER in dict_headers:
-            if dict_headers[_CONCURRENCY_HEADER] != self.max_pool_size:
-                self.set_pool_size(dict_headers[_CONCURRENCY_HEADER])
-        elif _LEGACY_CONCURRENCY_HEADER in dict_headers:
-            if dict_headers[_LEGACY_CONCURRENCY_HEADER] != self.max_pool_size:
-                self.set_pool_size(dict_headers[_LEGACY_CONCURRENCY_HEADER])
+        if self._balancer is not None:
+            # Set per node by the balancer
+            return
+        concurrency = _concurrency(dict_headers)
+        if concurrency is not None and concurrency != self.max_pool_size:
+            self.set_pool_size(concurrency)
+
+    def check_health(self, endpoint='PING'):
+        """
+        Call C{ping} or C{info} on every service URL.  Nodes that answer are
+        used again at once; nodes that do not are avoided for C{failover_time}.
+        @param endpoint: C{PING} or C{INFO}.
+        @return: dictionary of service URL to C{True} if the node answered.
+        """
+        if endpoint not in ('PING', 'INFO'):
+            raise RosetteException("badArgument", "Health is checked with PING or INFO", repr(endpoint))
+        health = {}
+        nodes = self._balancer.nodes if self._balancer is not None else [None]
+        for node in nodes:
+            if node is not None:
+                self._balancer.pinned.node = node
+            try:
+                EndpointCaller(self, None)._probe(endpoint)
+                health[node.url if node is not None else self.service_url] = True
+            except RosetteException as exception:
+                self.logger.warning('health check failed: %s', exception)
+                health[node.url if node is not None else self.service_url] = False
+            finally:
+                if node is not None:
+                    self._balancer.pinned.node = None
+        return health
+
+    @contextlib.contextmanager
+    def priority(self, priority):
+        """
+        Context manager setting the priority class of the calls made by the
+        current thread, including those it makes with L{submit} and L{analyze}.
+        Without scheduling, see C{priority_weights}, it has no effect.
+        @param priority: a key of the priority weights, e.g. C{PRIORITY_HIGH}.
+        """
+        if self._scheduler is None:
+            yield
+            return
+        if priority not in self._scheduler.weights:
+            raise RosetteException("badArgument", "Unknown priority", repr(priority))
+        previous = self._scheduler.current()
+        self._scheduler.local.priority = priority
+        try:
+            yield
+        finally:
+            self._scheduler.local.priority = previous
+
+    def __at_current_priority(self, function):
+        """Wrap C{function} to run, on another thread, at the current thread's priority."""
+        if self._scheduler is None:
+            return function
+        priority = self._scheduler.current()
+
+        def call(*args, **kwargs):
+            with self.priority(priority):
+                return function(*args, **kwargs)
+        return call
+
+    def _send(self, request):
+        """Internal. Sends a C{requests.Request}, to the best node if there are
+        several service URLs."""
+        endpoint = self.__logged_endpoint(request.url)
+        if self.slow_calls is None and endpoint is None:
+            return self.__schedule(request)
+        timings = {'started': time.monotonic()}
+        try:
+            response = self.__schedule(request, timings)
+        except requests.exceptions.RequestException as exception:
+            timings['finished'] = time.monotonic()
+            if self.slow_calls is not None:
+                self.slow_calls.observe(request, None, timings, exception)
+            if endpoint is not None:
+                self.__log_request(endpoint, request, type(exception).__name__, 0, timings)
+            raise
+        timings['finished'] = time.monotonic()
+        if self.slow_calls is not None:
+            self.slow_calls.observe(request, response, timings)
+        if endpoint is not None:
+            self.__log_request(endpoint, request, response.status_code, len(response.content), timings)
+        return response
+
+    def __logged_endpoint(self, url):
+        """Return the endpoint of a request to log, or C{None} if it is not logged."""
+        if not self.request_logger.isEnabledFor(logging.INFO):
+            return None
+        endpoint = url[len(self.service_url):] if url.startswith(self.service_url) else url
+        rate = self.log_sampling.get(endpoint, self.log_sampling.get('*', 1.0))
+        if rate < 1 and random.random() >= rate:
+            return None
+        return endpoint
+
+    def __log_request(self, endpoint, request, status, bytes_received, timings):
+        if request.data:
+            bytes_sent = len(request.data.encode('utf-8') if isinstance(request.data, str) else request.data)
+        elif request.files:
+            bytes_sent = len(request.files['content'][1])
+        else:
+            bytes_sent = 0
+        duration = timings['finished'] - timings['started']
+        self.request_logger.info(
+            'request endpoint=%s status=%s bytes_sent=%d bytes_received=%d duration=%.6f',
+            endpoint, status, bytes_sent, bytes_received, duration,
+            extra={'endpoint': endpoint, 'status': status, 'bytes_sent': bytes_sent,
+                   'bytes_received': bytes_received, 'duration': duration})
+
+    def __schedule(self, request, timings=None):
+        if self._scheduler is not None:
+            self._scheduler.acquire()
+        if timings is not None:
+            timings['scheduled'] = time.monotonic()
+        try:
+            if self._balancer is not None:
+                return self._balancer.send(request, self.__send_to_host)
+            return self.__send_to_host(request)
+        finally:
+            if self._scheduler is not None:
+                self._scheduler.release()
+
+    def __send_to_host(self, request):
+        auth, settings = self._host_settings(request.url)
+        original_auth = request.auth
+        if original_auth is None:
+            # Set for this host only; the request may be sent to another host next
+            request.auth = auth
+        try:
+            prepared_request = self.session.prepare_request(request)
+        finally:
+            request.auth = original_auth
+        self._last_activity = time.monotonic()
+        if self.cassette is not None:
+            return self.cassette.respond(prepared_request,
+                                         lambda: self.session.send(prepared_request, **settings))
+        return self.session.send(prepared_request, **settings)
+
+    def _host_settings(self, url):
+        """Internal. Returns the C{.netrc} auth and the send settings for the host
+        of C{url}, resolving them from the environment on first use only."""
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        cached = self._settings_cache.get(key)
+        if cached is None:
+            # Take into account environment settings, e.g. HTTP_PROXY, HTTPS_PROXY,
+            # NO_PROXY and REQUESTS_CA_BUNDLE, and credentials in .netrc
+            settings = self.session.merge_environment_settings(
+                url, dict(self.proxies or {}), None, self.verify, self.cert)
+            if self.proxies is not None:
+                settings['proxies'] = dict(self.proxies)
+            auth = None
+            if self.session.trust_env and self.session.auth is None:
+                auth = requests.utils.get_netrc_auth(url) or _no_auth
+            cached = (auth, settings)
+            self._settings_cache[key] = cached
+        return cached
+
+    def clear_settings_cache(self):
+        """Forget the proxy, TLS and C{.netrc} settings resolved from the
+        environment, e.g. after changing C{HTTPS_PROXY}; the next request to each
+        host resolves them again.  Settings pinned at construction are kept."""
+        self._settings_cache = {}
 
     def _make_request(self, operation, url, data, headers):
         """
@@ -677,12 +1515,9 @@ class API(object):
 
         request = requests.Request(
             operation, url, data=data, headers=headers, params=payload)
-        prepared_request = self.session.prepare_request(request)
-        # Take into account environment settings, e.g. HTTP_PROXY and HTTPS_PROXY
-        settings = self.session.merge_environment_settings(prepared_request.url, {}, {}, None, None)
 
         try:
-            response = self.session.send(prepared_request, **settings)
+            response = self._send(request)
             status = response.status_code
             rdata = response.content
             dict_headers = dict(response.headers)
@@ -725,7 +1560,7 @@ class API(object):
         """
         (rdata, status, response_headers) = self._make_request(
             "GET", url, None, headers)
-        return _ReturnObject(_my_loads(rdata, response_headers), status)
+        return _ReturnObject(rdata, response_headers, status)
 
     def post_http(self, url, data, headers):
         """
@@ -739,7 +1574,16 @@ class API(object):
             json_data = ""
         else:
             json_data = json.dumps(data)
+        return self._post_json(url, json_data, headers)
+
+    def _post_json(self, url, json_data, headers):
+        """
+        POST an already serialized request body
 
+        @param url: endpoint URL
+        @param json_data: request body
+        @param headers: request headers
+        """
         (rdata, status, response_headers) = self._make_request(
             "POST", url, json_data, headers)
 
@@ -747,11 +1591,12 @@ class API(object):
             buf = BytesIO(rdata)
             rdata = gzip.GzipFile(fileobj=buf).read()
 
-        return _ReturnObject(_my_loads(rdata, response_headers), status)
+        return _ReturnObject(rdata, response_headers, status)
 
     def get_pool_size(self):
         """
-        Returns the maximum pool size, which is the returned x-rosetteapi-concurrency value
+        Returns the maximum pool size, which is the returned x-rosetteapi-concurrency value;
+        with several service URLs, the sum of the pool sizes of the nodes
         """
         return int(self.max_pool_size)
 
@@ -1064,3 +1909,99 @@ class API(object):
         @return: A python dictionary containing the results of event extraction.
         """
         return EndpointCaller(self, self.endpoints['EVENTS']).call(parameters)
+
+    def _document_suburl(self, name):
+        """Internal. Resolves an endpoint key, method name or path, e.g. C{ENTITIES},
+        C{entities}, C{syntax/dependencies} or C{morphology/lemmas}, to the path of an
+        endpoint taking L{DocumentParameters}."""
+        key = name.upper().replace('-', '_')
+        if key in self.endpoints:
+            suburl = self.endpoints[key]
+        else:
+            suburl = name
+        if suburl == self.endpoints['MORPHOLOGY']:
+            suburl += '/' + self.morphology_output['COMPLETE']
+        document_paths = [path for key, path in self.endpoints.items() if key not in _NON_DOCUMENT_ENDPOINTS]
+        document_paths.extend(self.endpoints['MORPHOLOGY'] + '/' + facet for facet in self.morphology_output.values())
+        if suburl not in document_paths:
+            raise RosetteException(
+                "badArgument",
+                "Not an endpoint taking DocumentParameters",
+                repr(name))
+        return suburl
+
+    def submit(self, name, *args, **kwargs):
+        """
+        Call an endpoint without waiting for the result.  The call runs on a
+        thread pool owned by the L{API}, of C{submit_workers} threads, so many
+        calls can be in progress at once and collected with
+        C{concurrent.futures.as_completed} or C{wait}.  Enable scheduling, see
+        C{priority_weights}, to keep the calls in progress within
+        L{get_pool_size}, the concurrency the server advertises.
+        @param name: endpoint name, e.g. C{entities}, C{name-similarity} or C{NAME_SIMILARITY}.
+        @param args: the arguments of the endpoint method, e.g. its parameters
+        object, and C{facet} for C{morphology}.
+        @return: a C{concurrent.futures.Future} of the endpoint method's result
+        or L{RosetteException}.
+        """
+        key = name.upper().replace('-', '_')
+        if key not in self.endpoints:
+            key = next((candidate for candidate, path in self.endpoints.items() if path == name), key)
+        if key not in self.endpoints:
+            raise RosetteException("badArgument", "Unknown endpoint", repr(name))
+        return self.__submit_executor().submit(self.__at_current_priority(getattr(self, key.lower())),
+                                               *args, **kwargs)
+
+    def __submit_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=max(self.submit_workers, 1),
+                                                    thread_name_prefix='rosette-submit')
+            return self._executor
+
+    def analyze(self, parameters, endpoints, options=None):
+        """
+        Call several document endpoints on the same document at once.
+        The document is serialized once and the calls run concurrently, so the
+        elapsed time is that of the slowest call rather than the sum of all.
+        A failing endpoint does not affect the others.
+        @param parameters: An object specifying the data,
+        and possible metadata, to be processed by every endpoint.
+        @type parameters: L{DocumentParameters} or L{str}
+        @param endpoints: endpoint names, e.g. C{["language", "entities", "sentiment"]};
+        API.endpoints keys and paths such as C{"morphology/lemmas"} are accepted too.
+        @param options: (Optional) options to send instead of those set with L{set_option}.
+        @return: A python dictionary keyed by the given endpoint names, whose values
+        are the result of each call, or the L{RosetteException} it raised."""
+        if isinstance(parameters, str):
+            text = parameters
+            parameters = DocumentParameters()
+            parameters['content'] = text
+        if not isinstance(parameters, DocumentParameters):
+            raise RosetteException(
+                "incompatible",
+                "The parameters must be string or DocumentParameters",
+                "analyze")
+        if parameters.use_multipart:
+            raise RosetteException(
+                "incompatible",
+                "Documents loaded from a file cannot be sent to several endpoints at once",
+                parameters.file_name)
+
+        callers = dict((name, EndpointCaller(self, self._document_suburl(name))) for name in endpoints)
+        if not callers:
+            return {}
+        json_data = json.dumps(parameters.serialize(self.options if options is None else options))
+        headers = next(iter(callers.values()))._request_headers()
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=len(callers)) as executor:
+            futures = dict((name, executor.submit(self.__at_current_priority(caller._call_serialized),
+                                                  json_data, headers))
+                           for name, caller in callers.items())
+            for name, future in futures.items():
+                try:
+                    results[name] = future.result()
+                except RosetteException as exception:
+                    results[name] = exception
+        return results
@@ -0,0 +1,542 @@
+#!/usr/bin/env python
+
+"""
+Streaming batch runner for Babel Street Analytics endpoints.
+
+Copyright (c) 2014-2024 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import collections
+from concurrent.futures import ProcessPoolExecutor
+import json
+import logging
+import sys
+import threading
+import time
+import zlib
+
+import requests
+from urllib3.exceptions import ConnectTimeoutError
+
+from rosette.api import (API,
+                         AddressSimilarityParameters,
+                         DocumentParameters,
+                         NameDeduplicationParameters,
+                         NameSimilarityParameters,
+                         NameTranslationParameters,
+                         RecordSimilarityParameters,
+                         RosetteException)
+from rosette.journal import FAILED, SUCCEEDED
+from rosette.results import Result
+
+_PARAMETER_TYPES = {
+    'ADDRESS_SIMILARITY': AddressSimilarityParameters,
+    'NAME_DEDUPLICATION': NameDeduplicationParameters,
+    'NAME_SIMILARITY': NameSimilarityParameters,
+    'NAME_TRANSLATION': NameTranslationParameters,
+    'RECORD_SIMILARITY': RecordSimilarityParameters,
+}
+_NO_INPUT_ENDPOINTS = ('INFO', 'PING')
+_RETRYABLE_STATUSES = (429, 500, 502, 503, 504, 'tooManyRequests', 'overCapacity')
+
+
+def endpoint_key(api, name):
+    """Resolve an endpoint name to its L{API.endpoints} key.
+    Accepts the key itself (C{ENTITIES}), the method name (C{entities}) or the
+    endpoint path (C{name-similarity}).
+    """
+    key = name.upper().replace('-', '_')
+    if key not in api.endpoints:
+        for candidate, path in api.endpoints.items():
+            if path == name:
+                key = candidate
+                break
+    if key not in api.endpoints or key in _NO_INPUT_ENDPOINTS:
+        raise RosetteException(
+            "badArgument",
+            "Not a batch endpoint; use a key of API.endpoints other than INFO and PING",
+            repr(name))
+    return key
+
+
+def shard_of(doc_id, shards):
+    """Return the shard, from 0 to C{shards - 1}, of a document ID.
+    The shard depends only on the ID, through its CRC-32, so every worker of a
+    sharded job assigns each document to the same shard whatever the order or
+    split of its input.
+    """
+    return zlib.crc32(str(doc_id).encode('utf-8')) % shards
+
+
+def make_parameters(key, record):
+    """Build the parameters object for endpoint C{key} from an input record.
+    Every field of the record except C{id} is set on the parameters object.
+    """
+    params = _PARAMETER_TYPES.get(key, DocumentParameters)()
+    for field, value in record.items():
+        if field != 'id':
+            params[field] = value
+    return params
+
+
+def read_records(stream, input_format='auto', first_id=0):
+    """Yield C{(doc_id, record)} pairs from a line-oriented stream.
+    @param stream: text stream of JSON objects, one per line, or of plain text
+    documents, one per line.
+    @param input_format: C{jsonl}, C{text} or C{auto}, which treats lines
+    starting with C{{} as JSON.
+    @param first_id: ordinal given to the first line, for records without an C{id}.
+    """
+    ordinal = first_id
+    for line in stream:
+        line = line.rstrip('\r\n')
+        if not line.strip():
+            continue
+        if input_format == 'jsonl' or (input_format == 'auto' and line.lstrip().startswith('{')):
+            record = json.loads(line)
+            doc_id = record.get('id', ordinal)
+        else:
+            record = {'content': line}
+            doc_id = ordinal
+        ordinal += 1
+        yield str(doc_id), record
+
+
+def read_inputs(paths, input_format='auto'):
+    """Yield C{(doc_id, record)} pairs from files; C{-} or no paths reads standard input."""
+    if not paths:
+        paths = ['-']
+    ordinal = 0
+    for path in paths:
+        if path == '-':
+            stream = sys.stdin
+        else:
+            stream = open(path, encoding='utf-8')
+        try:
+            for doc_id, record in read_records(stream, input_format, ordinal):
+                ordinal += 1
+                yield doc_id, record
+        finally:
+            if path != '-':
+                stream.close()
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _record_size(record):
+    """Approximate size in bytes of an input record, for queue accounting."""
+    return sum(len(value) for value in record.values() if isinstance(value, str)) + 64
+
+
+class OutputLine(dict):
+    """An output line of L{BatchRunner}; a dictionary which also carries its
+    JSON serialization, made once by the worker that produced it.
+
+    A sink whose C{serialized} attribute is true, like L{JsonLinesWriter},
+    declares that it only reads C{id}, C{error} and the JSON text.  With
+    worker processes, the lines it receives then lack C{result}, which is
+    not decoded in the calling process at all.
+    """
+
+    __slots__ = ('json',)
+
+    def __init__(self, json_text=None, **fields):
+        super(OutputLine, self).__init__(**fields)
+        self.json = json_text if json_text is not None else _dumps(self)
+
+
+# BatchRunner of the current worker process, see BatchRunner(processes=...).
+_process_runner = None
+
+
+def _api_settings(api):
+    """Return what worker processes need to rebuild C{api}, or raise a
+    L{RosetteException} if part of its configuration cannot be copied."""
+    if not api._owns_session:
+        raise RosetteException("incompatible", "Worker processes cannot use a shared session", "processes")
+    for name in ('cassette', 'slow_calls'):
+        if getattr(api, name) is not None:
+            raise RosetteException("incompatible", "Worker processes cannot use the API's " + name, "processes")
+    arguments = {'user_key': api.user_key,
+                 'service_url': api.service_urls,
+                 'retries': api.retries,
+                 'refresh_duration': api.connection_refresh_duration,
+                 'retry_statuses': api.retry_statuses,
+                 'debug': api.debug,
+                 'proxies': api.proxies,
+                 'verify': api.verify,
+                 'cert': api.cert,
+                 'pool_block': api.pool_block,
+                 'balance': api.balance,
+                 'failover_time': api.failover_time,
+                 'failover_statuses': api.failover_statuses,
+                 'log_sampling': api.log_sampling}
+    return {'arguments': arguments,
+            'options': dict(api.options),
+            'url_parameters': dict(api.url_parameters),
+            'custom_headers': dict(api.custom_headers)}
+
+
+def _init_process(settings, endpoint, retries, backoff, facet, postprocess):
+    global _process_runner
+    api = API(**settings['arguments'])
+    api.options.update(settings['options'])
+    api.url_parameters.update(settings['url_parameters'])
+    api.custom_headers.update(settings['custom_headers'])
+    _process_runner = BatchRunner(api, endpoint, max_workers=1, retries=retries, backoff=backoff,
+                                  facet=facet, postprocess=postprocess)
+
+
+def _process_in_worker(doc_id, record):
+    """Runs in a worker process; returns only the compact, picklable parts of the line."""
+    line = _process_runner._process(doc_id, record)
+    return line.json, line.get('error')
+
+
+class BoundedQueue(object):
+    """FIFO queue bounded both in items and in bytes.
+    L{BoundedQueue.put} blocks while the queue is at either high-water mark.
+    An item larger than the byte limit is still accepted when the queue is
+    empty, so a single large item cannot stall the pipeline.
+    """
+
+    CLOSED = object()
+
+    def __init__(self, max_items, max_bytes=None):
+        """
+        @param max_items: most items held at once.
+        @param max_bytes: (Optional) most bytes held at once, as declared to L{put}.
+        """
+        self.max_items = max(1, max_items)
+        self.max_bytes = max_bytes
+        self._items = collections.deque()
+        self._bytes = 0
+        self._closed = False
+        self._aborted = False
+        self._condition = threading.Condition()
+
+    def _full(self, size):
+        if not self._items:
+            return False
+        if len(self._items) >= self.max_items:
+            return True
+        return self.max_bytes is not None and self._bytes + size > self.max_bytes
+
+    def put(self, item, size=0):
+        """Add an item, waiting for room.
+        @param size: the item's size in bytes.
+        @return: C{False} if the queue was aborted and the item was dropped.
+        """
+        with self._condition:
+            while self._full(size) and not self._aborted:
+                self._condition.wait()
+            if self._aborted:
+                return False
+            self._items.append((item, size))
+            self._bytes += size
+            self._condition.notify_all()
+            return True
+
+    def get(self):
+        """Remove and return the oldest item, waiting for one.
+        @return: the item, or L{BoundedQueue.CLOSED} once the queue is closed
+        and empty, or aborted.
+        """
+        with self._condition:
+            while not self._items and not self._closed and not self._aborted:
+                self._condition.wait()
+            if self._aborted or not self._items:
+                return BoundedQueue.CLOSED
+            item, size = self._items.popleft()
+            self._bytes -= size
+            self._condition.notify_all()
+            return item
+
+    def close(self):
+        """Accept no more items; L{get} drains the remaining ones."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def abort(self):
+        """Drop all items and release every waiting thread."""
+        with self._condition:
+            self._aborted = True
+            self._items.clear()
+            self._bytes = 0
+            self._condition.notify_all()
+
+
+def _is_retryable(exception, transport):
+    """Whether L{BatchRunner} retries a failed call.  Failures that C{transport},
+    the C{Retry} of the L{API}, retries already are not retried again."""
+    status = exception.status
+    if isinstance(status, Exception):
+        reason = getattr(status.args[0], 'reason', None) if status.args else None
+        connect_error = isinstance(status, requests.exceptions.ConnectTimeout) or \
+            isinstance(reason, ConnectTimeoutError)
+        return not (connect_error and transport is not None and transport.connect)
+    if transport is not None and transport.status and status in transport.status_forcelist:
+        return False
+    return status in _RETRYABLE_STATUSES
+
+
+class BatchRunner(object):
+    """Calls one endpoint for a stream of documents with bounded concurrency.
+
+    Documents waiting to be sent and results waiting for the sink are held in
+    bounded queues, and each result is handed to the sink as soon as it
+    completes, so memory use does not grow with the size of the input.  Failed calls are retried with
+    exponential backoff when the failure is transient, unless the L{API}
+    retries that failure itself: connection failures, by default, and its
+    C{retry_statuses}.
+
+    With a L{rosette.journal.Journal}, a document is journaled as submitted
+    before its request is sent and as succeeded only after its result has been
+    handed to the sink, so a run restarted with the same journal and input
+    skips every document already delivered and resends only failed documents
+    and those that were in flight when the previous run stopped.
+    """
+
+    def __init__(self, api, endpoint, max_workers=4, retries=3, backoff=0.5,
+                 journal=None, facet="", failed_only=False, queue_items=None,
+                 queue_bytes=64 * 1024 * 1024, processes=0, postprocess=None, shard=0, shards=1):
+        """
+        @param api: the L{API} to call.
+        @param endpoint: an endpoint name accepted by L{endpoint_key}.
+        @param max_workers: number of concurrent calls.
+        @param retries: attempts after the first for transient failures.
+        @param backoff: seconds before the first retry; doubled for each retry.
+        @param journal: (Optional) a L{rosette.journal.Journal} to record progress in
+        and resume from.
+        @param facet: morphology facet, see L{API.morphology}.
+        @param failed_only: process only documents the journal records as failed.
+        @param queue_items: high-water mark, in items, of the queues between reading,
+        submission and writing; defaults to twice C{max_workers}.
+        @param queue_bytes: high-water mark, in bytes, of each of those queues.
+        @param processes: if positive, send requests from this many worker
+        processes, each with its own L{API} and session, instead of from threads.
+        Response decoding, C{postprocess} and serialization of the output line
+        then run outside the calling process, and only the serialized line is
+        passed back, so throughput scales with cores rather than being bound
+        by the GIL.  Each process has one request in flight, so C{processes}
+        replaces C{max_workers}.  The connection settings, options, URL
+        parameters and custom headers of C{api} are copied to the workers
+        when L{run} starts; an C{api} with a shared session, a cassette or a
+        slow call log cannot be copied and is refused.
+        @param postprocess: (Optional) callable applied to each result before it is
+        written; it must be picklable, i.e. a module-level function, when
+        C{processes} is used.
+        @param shard: with C{shards}, process only the documents for which
+        L{shard_of} is C{shard}, so that C{shards} workers, e.g. on different
+        machines, each read the whole input and together process it once.
+        See L{rosette.merge.merge_outputs} to combine their outputs.
+        @param shards: number of shards the job is split into.
+        """
+        if failed_only and journal is None:
+            raise RosetteException("badArgument", "failed_only requires a journal", "journal")
+        if not 0 <= shard < shards:
+            raise RosetteException("badArgument", "The shard must be between 0 and shards - 1",
+                                   '%d/%d' % (shard, shards))
+        self.api = api
+        self.key = endpoint_key(api, endpoint)
+        self.max_workers = max(1, max_workers)
+        self.retries = max(0, retries)
+        self.backoff = backoff
+        self.journal = journal
+        self.facet = facet
+        self.failed_only = failed_only
+        self.processes = max(0, processes)
+        self.postprocess = postprocess
+        self.shard = shard
+        self.shards = shards
+        if self.processes:
+            self.max_workers = self.processes
+            _api_settings(api)
+        self.queue_items = queue_items or self.max_workers * 2
+        self.queue_bytes = queue_bytes
+        self.logger = logging.getLogger('rosette.batch')
+
+    def call(self, record):
+        """Call the endpoint for one record, retrying transient failures."""
+        params = make_parameters(self.key, record)
+        method = getattr(self.api, self.key.lower())
+        attempt = 0
+        while True:
+            try:
+                if self.key == 'MORPHOLOGY':
+                    result = method(params, self.facet)
+                else:
+                    result = method(params)
+                if isinstance(result, Result):
+                    # Typed results keep the response headers apart already
+                    result = result.to_dict()
+                else:
+                    result.pop('responseHeaders', None)
+                if self.postprocess is not None:
+                    result = self.postprocess(result)
+                return result
+            except RosetteException as exception:
+                if attempt >= self.retries or not _is_retryable(exception, self.api._transport_retry()):
+                    raise
+                time.sleep(self.backoff * (2 ** attempt))
+                attempt += 1
+
+    def run(self, records, sink):
+        """Process C{records} and pass each output line to C{sink}.
+
+        Reading, submission and writing run as separate stages joined by
+        L{BoundedQueue}s.  When the sink falls behind, the result queue fills,
+        the workers stop taking documents, the submission queue fills and the
+        reader stops reading, so memory stays within the queue limits however
+        fast results arrive.
+        @param records: iterable of C{(doc_id, record)} pairs, see L{read_records}.
+        @param sink: callable receiving one dictionary per document, either
+        C{{"id": ..., "result": ...}} or C{{"id": ..., "error": ...}}.
+        @return: a dictionary of counts: C{succeeded}, C{failed} and C{skipped}.
+        """
+        counts = {'succeeded': 0, 'failed': 0, 'skipped': 0}
+        serialized = getattr(sink, 'serialized', False)
+        pending = BoundedQueue(self.queue_items, self.queue_bytes)
+        results = BoundedQueue(self.queue_items, self.queue_bytes)
+        failures = []
+        running = [self.max_workers]
+        running_lock = threading.Lock()
+
+        def read():
+            try:
+                for doc_id, record in records:
+                    if self.shards > 1 and shard_of(doc_id, self.shards) != self.shard:
+                        continue
+                    if self._skip(doc_id):
+                        counts['skipped'] += 1
+                    elif not pending.put((doc_id, record), _record_size(record)):
+                        return
+            except Exception as exception:  # pylint: disable=broad-except
+                failures.append(exception)
+            finally:
+                pending.close()
+
+        def work():
+            try:
+                while True:
+                    item = pending.get()
+                    if item is BoundedQueue.CLOSED:
+                        return
+                    if pool is None:
+                        line = self._process(*item)
+                    else:
+                        if self.journal is not None:
+                            self.journal.submitted(item[0])
+                        json_text, error = pool.submit(_process_in_worker, *item).result()
+                        if serialized:
+                            line = OutputLine(json_text, id=item[0])
+                            if error is not None:
+                                line['error'] = error
+                        else:
+                            line = OutputLine(json_text, **json.loads(json_text))
+                    if not results.put(line, len(line.json)):
+                        return
+            except Exception as exception:  # pylint: disable=broad-except
+                failures.append(exception)
+                pending.abort()
+                results.abort()
+            finally:
+                with running_lock:
+                    running[0] -= 1
+                    if not running[0]:
+                        results.close()
+
+        pool = None
+        if self.processes:
+            pool = ProcessPoolExecutor(
+                max_workers=self.processes,
+                initializer=_init_process,
+                initargs=(_api_settings(self.api), self.key, self.retries, self.backoff,
+                          self.facet, self.postprocess))
+
+        threads = [threading.Thread(target=read, name='rosette-batch-reader')]
+        threads.extend(threading.Thread(target=work, name='rosette-batch-worker-' + str(index))
+                       for index in range(self.max_workers))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            while True:
+                line = results.get()
+                if line is BoundedQueue.CLOSED:
+                    break
+                self._deliver(line, sink, counts)
+        except BaseException:
+            pending.abort()
+            results.abort()
+            raise
+        finally:
+            for thread in threads:
+                thread.join()
+            if pool is not None:
+                pool.shutdown()
+        if failures:
+            raise failures[0]
+        return counts
+
+    def _process(self, doc_id, record):
+        """Worker stage: call the endpoint for one document and serialize its output line."""
+        if self.journal is not None:
+            self.journal.submitted(doc_id)
+        try:
+            return OutputLine(id=doc_id, result=self.call(record))
+        except RosetteException as exception:
+            self.logger.warning('%s failed: %s', doc_id, exception)
+            status = exception.status
+            return OutputLine(id=doc_id,
+                              error={'status': status if isinstance(status, (int, str)) else repr(status),
+                                     'message': str(exception.message)})
+
+    def _skip(self, doc_id):
+        if self.journal is None:
+            return self.failed_only
+        state = self.journal.state(doc_id)
+        if self.failed_only:
+            return state != FAILED
+        return state == SUCCEEDED
+
+    def _deliver(self, line, sink, counts):
+        """Writer stage: hand one output line to the sink, then journal it."""
+        sink(line)
+        if 'error' in line:
+            counts['failed'] += 1
+            if self.journal is not None:
+                self.journal.failed(line['id'], line['error']['status'], line['error']['message'])
+        else:
+            counts['succeeded'] += 1
+            if self.journal is not None:
+                self.journal.succeeded(line['id'])
+
+
+class JsonLinesWriter(object):
+    """Sink writing one JSON object per line, flushed as each line is written."""
+
+    # Only the JSON text of an OutputLine is written
+    serialized = True
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def __call__(self, line):
+        text = line.json if isinstance(line, OutputLine) else _dumps(line)
+        self.stream.write(text + '\n')
+        self.stream.flush()
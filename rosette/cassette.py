@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+"""
+Recording of the requests and responses of an L{API}, and their replay.
+
+Copyright (c) 2014-2024 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import base64
+import collections
+import datetime
+import gzip
+import hashlib
+import json
+import threading
+import time
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+import requests
+
+from rosette.api import RosetteException, _CUSTOM_HEADER_PATTERN
+
+RECORD = 'record'
+REPLAY = 'replay'
+REDACTED = 'REDACTED'
+
+
+def _path(url):
+    parts = urlsplit(url)
+    return parts.path + ('?' + parts.query if parts.query else '')
+
+
+def _body_bytes(body):
+    if body is None:
+        return b''
+    return body.encode('utf-8') if isinstance(body, str) else body
+
+
+class Cassette(object):
+    """A gzip-compressed JSON lines file of HTTP exchanges, for L{API}'s
+    C{cassette} argument.
+
+    In C{RECORD} mode, every request is sent and the exchange is appended to
+    the file with its latency.  Each distinct body is stored once, under its
+    SHA-256, and exchanges refer to bodies by hash.  The values of the user key
+    header, of custom headers and of C{Authorization} are replaced by
+    C{REDACTED}.
+
+    In C{REPLAY} mode, nothing is sent: a request gets the next recorded
+    response for the same method, path and body, at wire speed or, with
+    C{recorded_latency}, after the recorded latency.  Multipart requests are
+    matched without their body, whose boundary is random.  Requests repeated
+    more often than recorded get the recorded responses again in turn.
+    """
+
+    def __init__(self, path, mode=REPLAY, recorded_latency=False):
+        """
+        @param path: the cassette file.
+        @param mode: C{RECORD} to create the file, C{REPLAY} to read it.
+        @param recorded_latency: in C{REPLAY} mode, wait as long as the recorded
+        request took before returning its response.
+        """
+        if mode not in (RECORD, REPLAY):
+            raise RosetteException("badArgument", "Cassette mode is record or replay", repr(mode))
+        self.path = path
+        self.mode = mode
+        self.recorded_latency = recorded_latency
+        self._lock = threading.Lock()
+        if mode == RECORD:
+            self._file = gzip.open(path, 'wt', encoding='utf-8')
+            self._stored = set()
+        else:
+            self._file = None
+            self._exchanges = self.__load()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Finish writing a recording."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    @staticmethod
+    def _request_key(request):
+        content_type = request.headers.get('Content-Type') or ''
+        if content_type.startswith('multipart/'):
+            body_hash = None
+        else:
+            body_hash = hashlib.sha256(_body_bytes(request.body)).hexdigest()
+        return request.method, _path(request.url), body_hash
+
+    def respond(self, request, send):
+        """Return the response to a prepared request.
+        @param send: function sending the request, called in C{RECORD} mode only.
+        """
+        if self.mode == REPLAY:
+            return self.__replay(request)
+        start = time.monotonic()
+        response = send()
+        self.__record(request, response, time.monotonic() - start)
+        return response
+
+    def __store(self, body):
+        """Write C{body} unless already written; return its hash."""
+        digest = hashlib.sha256(body).hexdigest()
+        if digest not in self._stored:
+            self._stored.add(digest)
+            try:
+                entry = {'body': digest, 'text': body.decode('utf-8')}
+            except UnicodeDecodeError:
+                entry = {'body': digest, 'base64': base64.b64encode(body).decode('ascii')}
+            self._file.write(json.dumps(entry) + '\n')
+        return digest
+
+    def __record(self, request, response, elapsed):
+        headers = dict((name, REDACTED if _CUSTOM_HEADER_PATTERN.match(name) or name == 'Authorization' else value)
+                       for name, value in request.headers.items())
+        method, path, body_hash = self._request_key(request)
+        with self._lock:
+            if self._file is None:
+                raise RosetteException("badArgument", "The cassette is closed", self.path)
+            request_body = self.__store(_body_bytes(request.body)) if body_hash is not None else None
+            exchange = {'method': method,
+                        'path': path,
+                        'request': request_body,
+                        'requestHeaders': headers,
+                        'status': response.status_code,
+                        'headers': dict(response.headers),
+                        'response': self.__store(response.content),
+                        'elapsed': round(elapsed, 6)}
+            self._file.write(json.dumps(exchange) + '\n')
+
+    def __load(self):
+        bodies = {}
+        exchanges = collections.defaultdict(list)
+        with gzip.open(self.path, 'rt', encoding='utf-8') as recording:
+            for line in recording:
+                entry = json.loads(line)
+                if 'body' in entry:
+                    bodies[entry['body']] = entry['text'].encode('utf-8') if 'text' in entry \
+                        else base64.b64decode(entry['base64'])
+                    continue
+                entry['response'] = bodies[entry['response']]
+                exchanges[(entry['method'], entry['path'], entry['request'])].append(entry)
+        return dict((key, [entries, 0]) for key, entries in exchanges.items())
+
+    def __replay(self, request):
+        key = self._request_key(request)
+        with self._lock:
+            recorded = self._exchanges.get(key)
+            if recorded is None:
+                raise RosetteException("notRecorded", "No recorded response for the request",
+                                       request.method + ' ' + key[1])
+            entries, turn = recorded
+            exchange = entries[turn % len(entries)]
+            recorded[1] = turn + 1
+        if self.recorded_latency:
+            time.sleep(exchange['elapsed'])
+        response = requests.models.Response()
+        response.status_code = exchange['status']
+        response.headers = requests.structures.CaseInsensitiveDict(exchange['headers'])
+        response._content = exchange['response']
+        response.url = request.url
+        response.request = request
+        response.elapsed = datetime.timedelta(seconds=exchange['elapsed'])
+        return response
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+
+"""
+Columnar (Apache Arrow and Parquet) export of Babel Street Analytics results.
+
+Copyright (c) 2014-2024 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from rosette.api import RosetteException
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
+DOC_ID_COLUMN = 'doc_id'
+
+
+def _require_pyarrow():
+    if pyarrow is None:
+        raise RosetteException(
+            "missingDependency",
+            "The rosette.columnar module requires pyarrow",
+            "pip install rosette_api[columnar]")
+
+
+def _arrow_type(name):
+    if name == 'string':
+        return pyarrow.string()
+    if name == 'int32':
+        return pyarrow.int32()
+    if name == 'float64':
+        return pyarrow.float64()
+    if name == 'list<int32>':
+        return pyarrow.list_(pyarrow.int32())
+    if name == 'list<string>':
+        return pyarrow.list_(pyarrow.string())
+    raise ValueError(name)
+
+
+def _flatten_entities(doc_id, response, columns):
+    for index, entity in enumerate(response.get('entities', [])):
+        offsets = entity.get('mentionOffsets', [])
+        columns['entity_index'].append(index)
+        columns['type'].append(entity.get('type'))
+        columns['mention'].append(entity.get('mention'))
+        columns['normalized'].append(entity.get('normalized'))
+        columns['count'].append(entity.get('count'))
+        columns['entity_id'].append(entity.get('entityId'))
+        columns['confidence'].append(entity.get('confidence'))
+        columns['linking_confidence'].append(entity.get('linkingConfidence'))
+        columns['salience'].append(entity.get('salience'))
+        columns['start_offsets'].append([offset['startOffset'] for offset in offsets])
+        columns['end_offsets'].append([offset['endOffset'] for offset in offsets])
+        columns[DOC_ID_COLUMN].append(doc_id)
+
+
+def _flatten_sentiment(doc_id, response, columns):
+    document = response.get('document', {})
+    columns['label'].append(document.get('label'))
+    columns['confidence'].append(document.get('confidence'))
+    columns[DOC_ID_COLUMN].append(doc_id)
+
+
+def _flatten_tokens(doc_id, response, columns):
+    tokens = response.get('tokens', [])
+    columns['token_index'].extend(range(len(tokens)))
+    columns['token'].extend(tokens)
+    columns[DOC_ID_COLUMN].extend([doc_id] * len(tokens))
+
+
+def _flatten_sentences(doc_id, response, columns):
+    sentences = response.get('sentences', [])
+    columns['sentence_index'].extend(range(len(sentences)))
+    columns['sentence'].extend(sentences)
+    columns[DOC_ID_COLUMN].extend([doc_id] * len(sentences))
+
+
+def _flatten_morphology(doc_id, response, columns):
+    tokens = response.get('tokens', [])
+    count = len(tokens)
+    for key, column in (('lemmas', 'lemma'),
+                        ('posTags', 'pos_tag'),
+                        ('compoundComponents', 'compound_components'),
+                        ('hanReadings', 'han_readings')):
+        values = response.get(key)
+        columns[column].extend(values if values is not None else [None] * count)
+    columns['token_index'].extend(range(count))
+    columns['token'].extend(tokens)
+    columns[DOC_ID_COLUMN].extend([doc_id] * count)
+
+
+def _flatten_events(doc_id, response, columns):
+    for index, event in enumerate(response.get('events', [])):
+        mentions = event.get('mentions', [])
+        columns['event_index'].append(index)
+        columns['event_type'].append(event.get('eventType'))
+        columns['confidence'].append(event.get('confidence'))
+        columns['start_offsets'].append([mention['startOffset'] for mention in mentions])
+        columns['end_offsets'].append([mention['endOffset'] for mention in mentions])
+        columns[DOC_ID_COLUMN].append(doc_id)
+
+
+# Keyed by API.endpoints key: the column layout and the function filling it.
+_FLATTENERS = {
+    'ENTITIES': ((('entity_index', 'int32'),
+                  ('type', 'string'),
+                  ('mention', 'string'),
+                  ('normalized', 'string'),
+                  ('count', 'int32'),
+                  ('entity_id', 'string'),
+                  ('confidence', 'float64'),
+                  ('linking_confidence', 'float64'),
+                  ('salience', 'float64'),
+                  ('start_offsets', 'list<int32>'),
+                  ('end_offsets', 'list<int32>')),
+                 _flatten_entities),
+    'SENTIMENT': ((('label', 'string'),
+                   ('confidence', 'float64')),
+                  _flatten_sentiment),
+    'TOKENS': ((('token_index', 'int32'),
+                ('token', 'string')),
+               _flatten_tokens),
+    'SENTENCES': ((('sentence_index', 'int32'),
+                   ('sentence', 'string')),
+                  _flatten_sentences),
+    'MORPHOLOGY': ((('token_index', 'int32'),
+                    ('token', 'string'),
+                    ('lemma', 'string'),
+                    ('pos_tag', 'string'),
+                    ('compound_components', 'list<string>'),
+                    ('han_readings', 'list<string>')),
+                   _flatten_morphology),
+    'EVENTS': ((('event_index', 'int32'),
+                ('event_type', 'string'),
+                ('confidence', 'float64'),
+                ('start_offsets', 'list<int32>'),
+                ('end_offsets', 'list<int32>')),
+               _flatten_events),
+}
+
+
+def _flattener(endpoint):
+    _require_pyarrow()
+    if endpoint not in _FLATTENERS:
+        raise RosetteException(
+            "badArgument",
+            "No columnar layout for endpoint; supported: " + ", ".join(sorted(_FLATTENERS)),
+            repr(endpoint))
+    return _FLATTENERS[endpoint]
+
+
+def schema(endpoint):
+    """Return the Arrow schema used for an endpoint.
+    The first column is always C{doc_id}.
+    @param endpoint: an L{API.endpoints} key, e.g. C{'ENTITIES'}.
+    @return: a C{pyarrow.Schema}.
+    """
+    fields, _ = _flattener(endpoint)
+    return pyarrow.schema([(DOC_ID_COLUMN, pyarrow.string())] +
+                          [(name, _arrow_type(type_name)) for name, type_name in fields])
+
+
+def to_record_batch(endpoint, doc_ids, responses):
+    """Flatten a batch of endpoint results into one Arrow record batch.
+    Each column is accumulated across the whole batch and converted to an
+    Arrow array in one step, rather than building a row object per item.
+    @param endpoint: an L{API.endpoints} key, e.g. C{'ENTITIES'}.
+    @param doc_ids: document identifiers, one per response.
+    @param responses: the dictionaries returned by the matching L{API} method.
+    @return: a C{pyarrow.RecordBatch} with the layout of L{schema}.
+    """
+    _, flatten = _flattener(endpoint)
+    target = schema(endpoint)
+    columns = dict((field.name, []) for field in target)
+    for doc_id, response in zip(doc_ids, responses):
+        flatten(str(doc_id), response, columns)
+    arrays = [pyarrow.array(columns[field.name], type=field.type) for field in target]
+    return pyarrow.RecordBatch.from_arrays(arrays, schema=target)
+
+
+class ParquetSink(object):
+    """Appends batches of endpoint results to one Parquet file.
+    Use as a context manager, or call L{ParquetSink.close} when done::
+
+        with ParquetSink('ENTITIES', 'entities.parquet') as sink:
+            sink.write(ids, results)
+    """
+
+    def __init__(self, endpoint, path, **writer_options):
+        """
+        @param endpoint: an L{API.endpoints} key, e.g. C{'ENTITIES'}.
+        @param path: Parquet file to create.
+        @param writer_options: passed to C{pyarrow.parquet.ParquetWriter}.
+        """
+        target = schema(endpoint)
+        self.endpoint = endpoint
+        self.writer = pyarrow.parquet.ParquetWriter(path, target, **writer_options)
+
+    def write(self, doc_ids, responses):
+        """Flatten and append a batch, see L{to_record_batch}."""
+        self.writer.write_batch(to_record_batch(self.endpoint, doc_ids, responses))
+
+    def close(self):
+        """Finish the file."""
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def write_parquet(endpoint, doc_ids, responses, path, **writer_options):
+    """Flatten a batch of endpoint results and write it as a Parquet file.
+    @param endpoint: an L{API.endpoints} key, e.g. C{'ENTITIES'}.
+    @param doc_ids: document identifiers, one per response.
+    @param responses: the dictionaries returned by the matching L{API} method.
+    @param path: Parquet file to create.
+    """
+    with ParquetSink(endpoint, path, **writer_options) as sink:
+        sink.write(doc_ids, responses)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+
+"""
+Random access to large line-oriented corpora through a memory map and a
+persistent index of line offsets.
+
+Copyright (c) 2014-2024 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import array
+import json
+import mmap
+import os
+import struct
+import tempfile
+
+from rosette.api import DocumentParameters, RosetteException
+
+INDEX_SUFFIX = '.idx'
+_MAGIC = b'RSIX'
+_VERSION = 1
+# Magic, version, corpus size and modification time
+_HEADER = struct.Struct('<4sIQQ')
+_OFFSET_SIZE = 8
+_BLANK = frozenset(b' \t\r\x0b\x0c')
+
+
+def _is_blank(data, start, end):
+    # Most lines start with a visible character; only the others are copied
+    return start == end or (data[start] in _BLANK and not bytes(data[start:end]).strip())
+
+
+class Corpus(object):
+    """A JSON lines or plain text corpus file, one document per line, read
+    through a memory map.
+
+    The byte offset of every non-empty line is kept in an index file next to
+    the corpus, C{<path>.idx}, written on first use and rebuilt when the
+    corpus changes.  Record C{n} is then read without scanning the lines
+    before it, so a resumed job or a shard in another process or machine
+    starts at once.  Records are numbered like L{rosette.batch.read_records}
+    numbers them, and so get the same default IDs.
+
+    Lines stay in the memory map as C{memoryview}s until a record is
+    requested; only then is the line decoded into the C{str} content that
+    L{DocumentParameters} sends.
+    """
+
+    def __init__(self, path, input_format='auto', index_path=None, first_id=0):
+        """
+        @param path: the corpus file.
+        @param input_format: C{jsonl}, C{text} or C{auto}, as for L{rosette.batch.read_records}.
+        @param index_path: (Optional) where to keep the index; defaults to C{path + '.idx'}.
+        @param first_id: ID of the first record, for records without an C{id}.
+        """
+        self.path = path
+        self.input_format = input_format
+        self.index_path = index_path or path + INDEX_SUFFIX
+        self.first_id = first_id
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        # An empty file cannot be mapped
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self._data = memoryview(self._map)
+        self._index_file = None
+        self._index_map = None
+        self._views = [self._data]
+        self._offsets = self.__open_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Release the memory maps."""
+        for view in reversed(self._views):
+            view.release()
+        if self._index_map is not None:
+            self._index_map.close()
+            self._index_file.close()
+        if self._map:
+            self._map.close()
+        self._file.close()
+
+    def __signature(self):
+        status = os.fstat(self._file.fileno())
+        return status.st_size, status.st_mtime_ns
+
+    def __open_index(self):
+        size, mtime = self.__signature()
+        try:
+            with open(self.index_path, 'rb') as index:
+                magic, version, indexed_size, indexed_mtime = _HEADER.unpack(index.read(_HEADER.size))
+            current = (magic, version, indexed_size, indexed_mtime) == (_MAGIC, _VERSION, size, mtime)
+        except (IOError, OSError, struct.error):
+            current = False
+        if not current:
+            self.build_index()
+        self._index_file = open(self.index_path, 'rb')
+        if os.fstat(self._index_file.fileno()).st_size == _HEADER.size:
+            return memoryview(array.array('Q'))
+        self._index_map = mmap.mmap(self._index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        index = memoryview(self._index_map)
+        offsets = index[_HEADER.size:]
+        self._views.extend([index, offsets, offsets.cast('Q')])
+        return self._views[-1]
+
+    def build_index(self):
+        """Scan the corpus and write its index.  Done automatically when the
+        index is missing or older than the corpus.  Several processes may
+        build the same index at once: each writes its own temporary file and
+        moves it into place, and the last one wins."""
+        size, mtime = self.__signature()
+        offsets = array.array('Q')
+        position = 0
+        while position < size:
+            end = self._map.find(b'\n', position)
+            if end < 0:
+                end = size
+            if not _is_blank(self._data, position, end):
+                offsets.append(position)
+            position = end + 1
+        if offsets.itemsize != _OFFSET_SIZE:
+            raise RosetteException("incompatible", "No 64 bit array type", "corpus")
+        directory, name = os.path.split(os.path.abspath(self.index_path))
+        handle, temporary = tempfile.mkstemp(prefix=name + '.', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(handle, 'wb') as index:
+                index.write(_HEADER.pack(_MAGIC, _VERSION, size, mtime))
+                offsets.tofile(index)
+            os.replace(temporary, self.index_path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def line(self, number):
+        """Return line C{number} of the non-empty lines, without its line end,
+        as a C{memoryview} of the memory map."""
+        if not 0 <= number < len(self._offsets):
+            raise IndexError(number)
+        start = self._offsets[number]
+        end = self._map.find(b'\n', start)
+        if end < 0:
+            end = len(self._data)
+        if end > start and self._data[end - 1] == ord('\r'):
+            end -= 1
+        return self._data[start:end]
+
+    def record(self, number):
+        """Return the C{(doc_id, record)} pair of record C{number}."""
+        text = str(self.line(number), 'utf-8')
+        if self.input_format == 'jsonl' or (self.input_format == 'auto' and text.lstrip().startswith('{')):
+            record = json.loads(text)
+            doc_id = record.get('id', self.first_id + number)
+        else:
+            record = {'content': text}
+            doc_id = self.first_id + number
+        return str(doc_id), record
+
+    __getitem__ = record
+
+    def document(self, number):
+        """Return record C{number} as L{DocumentParameters}, with every field of
+        the record except C{id}."""
+        _, record = self.record(number)
+        params = DocumentParameters()
+        for field, value in record.items():
+            if field != 'id':
+                params[field] = value
+        return params
+
+    def records(self, start=0, stop=None):
+        """Yield the C{(doc_id, record)} pairs of records C{start} to C{stop}, excluded."""
+        stop = len(self) if stop is None else min(stop, len(self))
+        for number in range(start, stop):
+            yield self.record(number)
+
+    def __iter__(self):
+        return self.records()
+
+    def shard_range(self, shard, shards):
+        """Return the C{(start, stop)} record numbers of contiguous shard
+        C{shard} of C{shards}, numbered from 0; shard sizes differ by one at most."""
+        if not 0 <= shard < shards:
+            raise RosetteException("badArgument", "The shard must be between 0 and shards - 1",
+                                   '%d/%d' % (shard, shards))
+        return len(self) * shard // shards, len(self) * (shard + 1) // shards
+
+    def shard(self, shard, shards):
+        """Yield the C{(doc_id, record)} pairs of contiguous shard C{shard} of C{shards}."""
+        return self.records(*self.shard_range(shard, shards))
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+"""
+Durable journal of batch job progress.
+
+Copyright (c) 2014-2024 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import sqlite3
+import threading
+import time
+
+SUBMITTED = 'submitted'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+_SCHEMA = '''CREATE TABLE IF NOT EXISTS documents (
+    doc_id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    status TEXT,
+    message TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL
+)'''
+
+
+class Journal(object):
+    """Records, per input document ID, whether it was submitted, succeeded or
+    failed and, for failures, the L{RosetteException} status and message.
+
+    The journal is a sqlite database in write-ahead-log mode; each state change
+    is committed before the caller moves on, so the journal survives the
+    process being killed at any point.  A document whose last recorded state is
+    C{submitted} was in flight when the job stopped.
+    """
+
+    def __init__(self, path):
+        """Open or create the journal at C{path}."""
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(_SCHEMA)
+
+    def state(self, doc_id):
+        """Return the last recorded state of C{doc_id}, or C{None} if never submitted."""
+        with self._lock:
+            row = self._db.execute('SELECT state FROM documents WHERE doc_id = ?', (doc_id,)).fetchone()
+        return row[0] if row else None
+
+    def submitted(self, doc_id):
+        """Record that a request for C{doc_id} is about to be sent."""
+        with self._lock:
+            self._db.execute(
+                'INSERT INTO documents (doc_id, state, attempts, updated) VALUES (?, ?, 1, ?) '
+                'ON CONFLICT(doc_id) DO UPDATE SET state = excluded.state, status = NULL, '
+                'message = NULL, attempts = attempts + 1, updated = excluded.updated',
+                (doc_id, SUBMITTED, time.time()))
+
+    def succeeded(self, doc_id):
+        """Record that the result for C{doc_id} has been written."""
+        self._set(doc_id, SUCCEEDED, None, None)
+
+    def failed(self, doc_id, status, message):
+        """Record that C{doc_id} failed.
+        @param status: the L{RosetteException} status.
+        @param message: the L{RosetteException} message.
+        """
+        self._set(doc_id, FAILED, status, message)
+
+    def failures(self):
+        """Return a list of C{(doc_id, status, message)} for every failed document."""
+        with self._lock:
+            return self._db.execute(
+                'SELECT doc_id, status, message FROM documents WHERE state = ? ORDER BY doc_id',
+                (FAILED,)).fetchall()
+
+    def counts(self):
+        """Return a dictionary of the number of documents in each state."""
+        with self._lock:
+            rows = self._db.execute('SELECT state, COUNT(*) FROM documents GROUP BY state').fetchall()
+        counts = {SUBMITTED: 0, SUCCEEDED: 0, FAILED: 0}
+        counts.update(rows)
+        return counts
+
+    def merge(self, path):
+        """Copy every entry of the journal at C{path}, e.g. of one shard of a
+        job, into this journal, replacing entries for the same documents."""
+        with self._lock:
+            self._db.execute('ATTACH DATABASE ? AS other', (path,))
+            try:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO documents (doc_id, state, status, message, attempts, updated) '
+                    'SELECT doc_id, state, status, message, attempts, updated FROM other.documents')
+            finally:
+                self._db.execute('DETACH DATABASE other')
+
+    def close(self):
+        """Close the journal."""
+        with self._lock:
+            self._db.close()
+
+    def _set(self, doc_id, state, status, message):
+        if status is not None and not isinstance(status, (int, str)):
+            status = repr(status)
+        with self._lock:
+            self._db.execute(
+                'UPDATE documents SET state = ?, status = ?, message = ?, updated = ? WHERE doc_id = ?',
+                (state, None if status is None else str(status), message, time.time(), doc_id))
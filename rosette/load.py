@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+"""
+Open-loop load generation against an Analytics server, and a local stub
+server to run it against.
+
+Copyright (c) 2014-2024 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import itertools
+import json
+import random
+import threading
+import time
+
+from rosette.api import RosetteException, _CONCURRENCY_HEADER, _LEGACY_CONCURRENCY_HEADER
+from rosette.batch import make_parameters
+
+POISSON = 'poisson'
+CONSTANT = 'constant'
+PERCENTILES = (('p50', 50.0), ('p90', 90.0), ('p99', 99.0), ('p999', 99.9))
+
+
+def percentile(ordered, rank):
+    """Nearest-rank percentile of a sorted list, or C{None} if it is empty."""
+    if not ordered:
+        return None
+    index = max(0, min(len(ordered) - 1, int(-(-rank * len(ordered) // 100)) - 1))
+    return ordered[index]
+
+
+class LoadReport(object):
+    """Outcome of L{run_load}."""
+
+    def __init__(self, endpoint, rate, arrivals):
+        self.endpoint = endpoint
+        self.rate = rate
+        self.arrivals = arrivals
+        self.sent = 0
+        self.succeeded = 0
+        self.duration = 0.0
+        self.latencies = []
+        self.errors = collections.Counter()
+        self.concurrency = collections.Counter()
+
+    def to_dict(self):
+        """Return the report as a dictionary: latencies are in seconds and
+        counted from each request's scheduled arrival, C{errors} is keyed by
+        L{RosetteException} status, or by exception name for connection
+        errors, and C{concurrency} by the concurrency header value seen in
+        successful responses."""
+        ordered = sorted(self.latencies)
+        report = {'endpoint': self.endpoint,
+                  'rate': self.rate,
+                  'arrivals': self.arrivals,
+                  'sent': self.sent,
+                  'succeeded': self.succeeded,
+                  'failed': sum(self.errors.values()),
+                  'duration': round(self.duration, 3),
+                  'throughput': round(self.succeeded / self.duration, 3) if self.duration else 0.0,
+                  'latency': dict((name, percentile(ordered, rank)) for name, rank in PERCENTILES),
+                  'errors': dict((str(status), count) for status, count in self.errors.items()),
+                  'concurrency': dict(self.concurrency)}
+        return report
+
+
+def _error_key(status):
+    """Bucket of a L{RosetteException} status in L{LoadReport.errors}: the
+    status itself, or the name of the exception for connection errors."""
+    return status if isinstance(status, (int, str)) else type(status).__name__
+
+
+def _endpoint_method(api, name):
+    key = name.upper().replace('-', '_')
+    if key not in api.endpoints:
+        key = next((candidate for candidate, path in api.endpoints.items() if path == name), key)
+    if key not in api.endpoints:
+        raise RosetteException("badArgument", "Unknown endpoint", repr(name))
+    return key, getattr(api, key.lower())
+
+
+def _arrival_times(rate, duration, arrivals, seed):
+    """Yield request times, in seconds from the start, at C{rate} per second."""
+    generator = random.Random(seed)
+    moment = 0.0
+    for count in itertools.count(1):
+        if arrivals == POISSON:
+            moment += generator.expovariate(rate)
+        else:
+            moment = count / float(rate)
+        if moment >= duration:
+            return
+        yield moment
+
+
+def run_load(api, endpoint, records=None, rate=10.0, duration=10.0, arrivals=POISSON,
+             max_outstanding=256, seed=None):
+    """
+    Send requests to an endpoint at a fixed arrival rate, whether or not
+    earlier requests have completed, and measure their latency.
+    Latency is counted from the time a request was due, so requests delayed
+    because C{max_outstanding} were in progress count their wait too.
+    @param api: the L{API} to call.
+    @param endpoint: a key, method name or path of L{API.endpoints}.
+    @param records: input records, as read by L{rosette.batch.read_records},
+    sent in turn; not needed for C{ping} and C{info}.
+    @param rate: requests per second.
+    @param duration: seconds during which requests are sent.
+    @param arrivals: C{POISSON} for exponentially distributed gaps between
+    requests, C{CONSTANT} for equal gaps.
+    @param max_outstanding: largest number of requests in progress.
+    @param seed: (Optional) seed of the Poisson arrivals, for repeatable runs.
+    @return: a L{LoadReport}.
+    """
+    if arrivals not in (POISSON, CONSTANT):
+        raise RosetteException("badArgument", "Arrivals are poisson or constant", repr(arrivals))
+    if rate <= 0:
+        raise RosetteException("badArgument", "The rate must be positive", repr(rate))
+    key, method = _endpoint_method(api, endpoint)
+    needs_input = key not in ('INFO', 'PING')
+    if needs_input and not records:
+        raise RosetteException("missingParameter", "Input records are required", key)
+    inputs = itertools.cycle([make_parameters(key, record) for record in records]) if needs_input else None
+
+    report = LoadReport(key, rate, arrivals)
+    lock = threading.Lock()
+
+    def call(params, due):
+        try:
+            result = method(params) if needs_input else method()
+        except RosetteException as exception:
+            with lock:
+                report.latencies.append(time.monotonic() - due)
+                report.errors[_error_key(exception.status)] += 1
+            return
+        elapsed = time.monotonic() - due
+        headers = getattr(result, 'headers', None) or result.get('responseHeaders') or {}
+        concurrency = headers.get(_CONCURRENCY_HEADER, headers.get(_LEGACY_CONCURRENCY_HEADER))
+        with lock:
+            report.latencies.append(elapsed)
+            report.succeeded += 1
+            if concurrency is not None:
+                report.concurrency[str(concurrency)] += 1
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max_outstanding) as executor:
+        for moment in _arrival_times(rate, duration, arrivals, seed):
+            due = start + moment
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            report.sent += 1
+            executor.submit(call, next(inputs) if needs_input else None, due)
+    report.duration = time.monotonic() - start
+    return report
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _respond(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        stub = self.server.stub
+        if stub.latency:
+            time.sleep(stub.latency)
+        endpoint = self.path.split('?')[0].rstrip('/').split('/v1/', 1)[-1]
+        body = json.dumps(stub.responses.get(endpoint, {})).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header(_CONCURRENCY_HEADER, str(stub.concurrency))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _respond
+    do_POST = _respond
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(object):
+    """Local HTTP server answering every endpoint at once, or after a fixed
+    latency, with a canned JSON body, to measure the binding's own overhead.
+    Use as a context manager; C{url} is the service URL to give to L{API}."""
+
+    def __init__(self, concurrency=4, latency=0.0, responses=None, port=0):
+        """
+        @param concurrency: value of the concurrency header sent.
+        @param latency: seconds each response is delayed.
+        @param responses: (Optional) dictionary of endpoint path, e.g. C{entities},
+        to response body; other endpoints answer C{{}}.
+        @param port: port to listen on; by default any free port.
+        """
+        self.concurrency = concurrency
+        self.latency = latency
+        self.responses = responses or {}
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), _StubHandler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self.url = 'http://127.0.0.1:%d/rest/v1/' % self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,),
+                                        name='rosette-stub-server')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Stop the server."""
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+"""
+Merge of the outputs of the shards of a batch job.
+
+Copyright (c) 2014-2024 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import logging
+
+from rosette.batch import OutputLine
+
+_logger = logging.getLogger('rosette.merge')
+
+
+def _index_output(path, number, index):
+    """Add the position of every complete line of an output file to C{index}."""
+    with open(path, 'rb') as output:
+        offset = 0
+        for line in output:
+            length = len(line)
+            try:
+                fields = json.loads(line)
+                doc_id = fields['id']
+            except (ValueError, KeyError, TypeError):
+                # A line cut short by a worker that stopped mid-write
+                _logger.warning('%s: skipping unreadable line at byte %d', path, offset)
+            else:
+                index[str(doc_id)] = (number, offset, fields.get('error'))
+            offset += length
+
+
+def merge_outputs(outputs, records, sink, journals=(), journal=None):
+    """Combine the output files of the shards of a batch job, see
+    L{rosette.batch.BatchRunner}'s C{shard} argument, into one result set in
+    input order, and check that every input document has a result.
+
+    Only the position of each output line is kept in memory; lines are read
+    back from the files, which must all be readable from this machine, e.g. on
+    a shared filesystem.  When a document has several lines, as after a
+    resumed run, the last line of the last file wins.
+    @param outputs: paths of the JSON lines outputs of the shards.
+    @param records: the job's input, as C{(doc_id, record)} pairs, see
+    L{rosette.batch.read_inputs}; only the IDs are used.
+    @param sink: callable receiving one output line per input document, in input order.
+    @param journals: (Optional) paths of the shards' journals.
+    @param journal: (Optional) a L{rosette.journal.Journal} into which C{journals}
+    are merged.
+    @return: a dictionary of C{succeeded} and C{failed} counts, the list of
+    C{missing} input IDs without a result and the sorted list of
+    C{unexpected} output IDs that are not in the input.
+    """
+    index = {}
+    for number, path in enumerate(outputs):
+        _index_output(path, number, index)
+
+    serialized = getattr(sink, 'serialized', False)
+    report = {'succeeded': 0, 'failed': 0, 'missing': [], 'unexpected': []}
+    files = [open(path, 'rb') for path in outputs]
+    try:
+        seen = set()
+        for doc_id, _ in records:
+            position = index.get(doc_id)
+            if position is None:
+                report['missing'].append(doc_id)
+                continue
+            seen.add(doc_id)
+            number, offset, error = position
+            files[number].seek(offset)
+            json_text = files[number].readline().decode('utf-8').rstrip('\r\n')
+            if serialized:
+                line = OutputLine(json_text, id=doc_id)
+                if error is not None:
+                    line['error'] = error
+            else:
+                line = OutputLine(json_text, **json.loads(json_text))
+            if error is not None:
+                report['failed'] += 1
+            else:
+                report['succeeded'] += 1
+            sink(line)
+    finally:
+        for output in files:
+            output.close()
+    report['unexpected'] = sorted(set(index) - seen)
+
+    if journal is not None:
+        for path in journals:
+            journal.merge(path)
+    return report
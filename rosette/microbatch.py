@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+"""
+Micro-batching of short texts, e.g. for C{language} or C{transliteration}.
+
+Copyright (c) 2014-2024 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from concurrent.futures import Future, ThreadPoolExecutor
+import threading
+import time
+
+from rosette.api import DocumentParameters, RosetteException, _NON_DOCUMENT_ENDPOINTS, _own_copy
+from rosette.batch import endpoint_key
+
+
+class _Pending(object):
+    __slots__ = ('text', 'language', 'future', 'submitted')
+
+    def __init__(self, text, language):
+        self.text = text
+        self.language = language
+        self.future = Future()
+        self.submitted = time.monotonic()
+
+
+class MicroBatcher(object):
+    """Collects short texts submitted from any number of threads and sends
+    them in batches.
+
+    The endpoints take one document per request, so a batch cannot become a
+    single request.  Instead, identical texts in a batch are sent once, and the
+    distinct texts are sent concurrently over the L{API}'s pooled keep-alive
+    connections.  A batch is sent C{max_delay} seconds after its first text
+    was submitted, or as soon as it holds C{max_bytes} of text, whichever
+    comes first: a longer delay finds more duplicates and keeps the
+    connections busier, a shorter one answers each caller sooner.
+
+    Use as a context manager, or call L{close}, to send what is left.
+    """
+
+    def __init__(self, api, endpoint='language', max_delay=0.005, max_bytes=65536, max_workers=8):
+        """
+        @param api: the L{API} to call.
+        @param endpoint: a document endpoint, e.g. C{language} or C{transliteration}.
+        @param max_delay: longest time, in seconds, a text waits for its batch to be sent.
+        @param max_bytes: UTF-8 size of the texts at which a batch is sent at once.
+        @param max_workers: largest number of requests in progress; best set to
+        the server's concurrency, see L{API.get_pool_size}.
+        """
+        key = endpoint_key(api, endpoint)
+        if key in _NON_DOCUMENT_ENDPOINTS:
+            raise RosetteException("badArgument", "Not a document endpoint", repr(endpoint))
+        self.method = getattr(api, key.lower())
+        self.max_delay = max_delay
+        self.max_bytes = max_bytes
+        self.submitted = 0
+        self.requests = 0
+        self._pending = []
+        self._size = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._collector = threading.Thread(target=self._collect, name='rosette-microbatch')
+        self._collector.daemon = True
+        self._collector.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def submit(self, text, language=None):
+        """Queue C{text} for the endpoint.
+        @param language: (Optional) ISO 639-3 code of the text's language.
+        @return: a C{concurrent.futures.Future} resolved with the endpoint's
+        result for C{text}, or with its L{RosetteException}.
+        """
+        pending = _Pending(text, language)
+        with self._condition:
+            if self._closed:
+                raise RosetteException("badArgument", "The micro-batcher is closed", "submit")
+            self._pending.append(pending)
+            self._size += len(text.encode('utf-8'))
+            self.submitted += 1
+            if len(self._pending) == 1 or self._size >= self.max_bytes:
+                self._condition.notify()
+        return pending.future
+
+    def close(self):
+        """Send the texts still waiting, wait for all results and stop."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._collector.join()
+        self._executor.shutdown(wait=True)
+
+    def _collect(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                deadline = self._pending[0].submitted + self.max_delay
+                while self._size < self.max_bytes and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = self._pending
+                self._pending = []
+                self._size = 0
+            self._dispatch(batch)
+
+    def _dispatch(self, batch):
+        groups = {}
+        for pending in batch:
+            if pending.future.set_running_or_notify_cancel():
+                groups.setdefault((pending.text, pending.language), []).append(pending.future)
+        for (text, language), futures in groups.items():
+            self.requests += 1
+            self._executor.submit(self._call, text, language, futures)
+
+    def _call(self, text, language, futures):
+        params = DocumentParameters()
+        params['content'] = text
+        params['language'] = language
+        try:
+            result = self.method(params)
+        except Exception as exception:  # pylint: disable=broad-except
+            for future in futures:
+                future.set_exception(exception)
+            return
+        # Typed results are shared; dictionaries are copied for each caller
+        for future in futures:
+            future.set_result(_own_copy(result))
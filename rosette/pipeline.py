@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+"""
+Pipeline which identifies a document's language once and passes it on to the
+downstream endpoint calls for the document.
+
+Copyright (c) 2014-2024 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from rosette.api import DocumentParameters, RosetteException
+
+# Unicode blocks of scripts written by essentially one language, with the
+# ISO 639-3 code of that language.  Kana is checked first so that Japanese
+# mixing kana and Han is not mistaken for anything else.
+_SCRIPT_LANGUAGES = (
+    (((0x3040, 0x30FF), (0x31F0, 0x31FF)), 'jpn'),
+    (((0xAC00, 0xD7AF), (0x1100, 0x11FF), (0x3130, 0x318F)), 'kor'),
+    (((0x0E00, 0x0E7F),), 'tha'),
+    (((0x0E80, 0x0EFF),), 'lao'),
+    (((0x1780, 0x17FF),), 'khm'),
+    (((0x0590, 0x05FF),), 'heb'),
+    (((0x0370, 0x03FF), (0x1F00, 0x1FFF)), 'ell'),
+    (((0x0530, 0x058F),), 'hye'),
+    (((0x10A0, 0x10FF),), 'kat'),
+    (((0x0B80, 0x0BFF),), 'tam'),
+    (((0x0C80, 0x0CFF),), 'kan'),
+    (((0x0D00, 0x0D7F),), 'mal'),
+    (((0x0A80, 0x0AFF),), 'guj'),
+    (((0x0C00, 0x0C7F),), 'tel'),
+)
+
+
+def script_language(text, threshold=0.5, sample=2000):
+    """Cheap local language pre-detector based on Unicode script.
+    Recognizes only scripts that are used by a single language, e.g. Hangul or
+    Thai; for everything else, including Latin, Cyrillic, Arabic and Han
+    without kana, it returns C{None} and the server must decide.
+    @param text: the document content.
+    @param threshold: share of the letters that must be in the script.
+    @param sample: number of leading characters examined.
+    @return: an ISO 639-3 language code, or C{None}.
+    """
+    letters = 0
+    counts = [0] * len(_SCRIPT_LANGUAGES)
+    for character in text[:sample]:
+        if not character.isalpha():
+            continue
+        letters += 1
+        code = ord(character)
+        for index, (blocks, _) in enumerate(_SCRIPT_LANGUAGES):
+            if any(low <= code <= high for low, high in blocks):
+                counts[index] += 1
+                break
+    if not letters:
+        return None
+    for index, (_, language) in enumerate(_SCRIPT_LANGUAGES):
+        # Any kana marks Japanese, which is mostly written in Han.
+        if (index == 0 and counts[index]) or counts[index] > letters * threshold:
+            return language
+    return None
+
+
+class LanguagePipeline(object):
+    """Runs several endpoints on a document with its language already known.
+
+    Endpoints such as C{entities}, C{morphology} and C{sentiment} identify the
+    language themselves when C{language} is not given.  This pipeline
+    determines it once, from the document's own C{language} field, from a
+    local pre-detector, or from one L{API.language} call, and sets it on the
+    document sent to every downstream endpoint through L{API.analyze}.
+    Options can differ per language, e.g. to choose models or turn features
+    off for languages where they are unsupported.
+    """
+
+    def __init__(self, api, endpoints=('entities', 'morphology', 'sentiment'),
+                 detector=script_language, options_by_language=None):
+        """
+        @param api: the L{API} to call.
+        @param endpoints: downstream endpoint names, as accepted by L{API.analyze}.
+        @param detector: (Optional) callable returning a language code or C{None}
+        for the document content; C{None} always asks the server.
+        @param options_by_language: (Optional) dictionary of language code to
+        options; they are added to the L{API}'s options for documents in that
+        language.  The key C{None} applies when no language could be determined.
+        """
+        self.api = api
+        self.endpoints = list(endpoints)
+        self.detector = detector
+        self.options_by_language = options_by_language or {}
+
+    def detect(self, parameters):
+        """Return the language of a document, calling L{API.language} only if
+        neither the document nor the local detector provides it.
+        @type parameters: L{DocumentParameters}
+        @return: an ISO 639-3 language code, or C{None} if the server found none.
+        """
+        if parameters['language']:
+            return parameters['language']
+        content = parameters['content']
+        if self.detector is not None and isinstance(content, str):
+            language = self.detector(content)
+            if language:
+                return language
+        detections = self.api.language(parameters).get('languageDetections') or []
+        return detections[0]['language'] if detections else None
+
+    def run(self, parameters):
+        """Detect the language of a document and call the downstream endpoints.
+        @type parameters: L{DocumentParameters} or L{str}
+        @return: a pair of the language used, or C{None}, and the dictionary
+        returned by L{API.analyze}.
+        """
+        if isinstance(parameters, str):
+            text = parameters
+            parameters = DocumentParameters()
+            parameters['content'] = text
+        if not isinstance(parameters, DocumentParameters):
+            raise RosetteException(
+                "incompatible",
+                "The parameters must be string or DocumentParameters",
+                "pipeline")
+
+        language = self.detect(parameters)
+        document = DocumentParameters()
+        for key in ("content", "contentUri", "profileId"):
+            document[key] = parameters[key]
+        document["language"] = language
+
+        options = self.api.options
+        if language in self.options_by_language:
+            options = dict(options)
+            options.update(self.options_by_language[language])
+        return language, self.api.analyze(document, self.endpoints, options=options)
@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+
+"""
+Typed, lazily decoded result objects for Babel Street Analytics responses.
+
+Copyright (c) 2014-2024 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+
+
+class _LazySequence(object):
+    """Read-only sequence which wraps each item of a decoded JSON list in
+    C{item_class} only when that item is accessed."""
+
+    __slots__ = ('_items', '_item_class')
+
+    def __init__(self, items, item_class):
+        self._items = items if items is not None else []
+        self._item_class = item_class
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._item_class(item) for item in self._items[index]]
+        return self._item_class(self._items[index])
+
+    def __iter__(self):
+        item_class = self._item_class
+        for item in self._items:
+            yield item_class(item)
+
+    def __repr__(self):
+        return '<' + self._item_class.__name__ + ' x ' + str(len(self._items)) + '>'
+
+
+class _Item(object):
+    """View over one decoded JSON object; fields are read on access."""
+
+    __slots__ = ('_item',)
+
+    def __init__(self, item):
+        self._item = item
+
+    def __getitem__(self, key):
+        return self._item[key]
+
+    def get(self, key, default=None):
+        """Return a raw field of the underlying JSON object."""
+        return self._item.get(key, default)
+
+    def to_dict(self):
+        """Return the underlying JSON object."""
+        return self._item
+
+    def __repr__(self):
+        return self.__class__.__name__ + '(' + repr(self._item) + ')'
+
+
+class MentionOffset(_Item):
+    """Character span of one mention."""
+
+    __slots__ = ()
+
+    @property
+    def start(self):
+        return self._item['startOffset']
+
+    @property
+    def end(self):
+        return self._item['endOffset']
+
+
+class Entity(_Item):
+    """One item of L{EntitiesResult.entities}."""
+
+    __slots__ = ()
+
+    @property
+    def type(self):
+        return self._item.get('type')
+
+    @property
+    def mention(self):
+        return self._item.get('mention')
+
+    @property
+    def normalized(self):
+        return self._item.get('normalized')
+
+    @property
+    def count(self):
+        return self._item.get('count')
+
+    @property
+    def entity_id(self):
+        return self._item.get('entityId')
+
+    @property
+    def confidence(self):
+        return self._item.get('confidence')
+
+    @property
+    def linking_confidence(self):
+        return self._item.get('linkingConfidence')
+
+    @property
+    def salience(self):
+        return self._item.get('salience')
+
+    @property
+    def mention_offsets(self):
+        return _LazySequence(self._item.get('mentionOffsets'), MentionOffset)
+
+
+class LanguageDetection(_Item):
+    """One item of L{LanguageResult.language_detections}."""
+
+    __slots__ = ()
+
+    @property
+    def language(self):
+        return self._item.get('language')
+
+    @property
+    def confidence(self):
+        return self._item.get('confidence')
+
+
+class Event(_Item):
+    """One item of L{EventsResult.events}."""
+
+    __slots__ = ()
+
+    @property
+    def event_type(self):
+        return self._item.get('eventType')
+
+    @property
+    def confidence(self):
+        return self._item.get('confidence')
+
+    @property
+    def mentions(self):
+        return _LazySequence(self._item.get('mentions'), EventMention)
+
+
+class EventMention(_Item):
+    """One item of L{Event.mentions}."""
+
+    __slots__ = ()
+
+    @property
+    def start(self):
+        return self._item['startOffset']
+
+    @property
+    def end(self):
+        return self._item['endOffset']
+
+    @property
+    def arguments(self):
+        return self._item.get('arguments', [])
+
+
+class Result(object):
+    """Result of an Analytics call, returned when the L{API} is created with
+    C{typed_results=True}.
+
+    The response body is kept as bytes and decoded on first access to a field;
+    nested items are wrapped in typed views only as they are read.  Response
+    headers are kept in L{Result.headers} rather than merged into the body.
+    Subscripting, e.g. C{result["entities"]}, reads the raw decoded body.
+    """
+
+    __slots__ = ('_content', '_body', 'headers')
+
+    def __init__(self, content, headers):
+        """Creation is reserved for internal use by the L{API}.
+        @param content: undecoded UTF-8 response body.
+        @param headers: the HTTP response headers as a dictionary.
+        """
+        self._content = content
+        self._body = None
+        self.headers = headers
+
+    def _json(self):
+        body = self._body
+        if body is None:
+            # Results coalesced by the API are shared between threads
+            content = self._content
+            if content is None:
+                # Decoded by another thread meanwhile; _body is set before _content is cleared
+                return self._body
+            body = json.loads(content.decode("utf-8"))
+            self._body = body
+            self._content = None
+        return body
+
+    def __getitem__(self, key):
+        return self._json()[key]
+
+    def __contains__(self, key):
+        return key in self._json()
+
+    def get(self, key, default=None):
+        """Return a raw top-level field of the response body."""
+        return self._json().get(key, default)
+
+    def keys(self):
+        """Return the top-level keys of the response body."""
+        return self._json().keys()
+
+    def to_dict(self):
+        """Return the decoded response body as a dictionary."""
+        return self._json()
+
+    def __repr__(self):
+        return self.__class__.__name__ + '(' + repr(self._json()) + ')'
+
+
+class EntitiesResult(Result):
+    """Result of L{API.entities}."""
+
+    __slots__ = ()
+
+    @property
+    def entities(self):
+        return _LazySequence(self._json().get('entities'), Entity)
+
+
+class TokensResult(Result):
+    """Result of L{API.tokens}."""
+
+    __slots__ = ()
+
+    @property
+    def tokens(self):
+        return self._json().get('tokens', [])
+
+
+class SentencesResult(Result):
+    """Result of L{API.sentences}."""
+
+    __slots__ = ()
+
+    @property
+    def sentences(self):
+        return self._json().get('sentences', [])
+
+
+class LanguageResult(Result):
+    """Result of L{API.language}."""
+
+    __slots__ = ()
+
+    @property
+    def language_detections(self):
+        return _LazySequence(self._json().get('languageDetections'), LanguageDetection)
+
+
+class SentimentResult(Result):
+    """Result of L{API.sentiment}."""
+
+    __slots__ = ()
+
+    @property
+    def label(self):
+        return self._json().get('document', {}).get('label')
+
+    @property
+    def confidence(self):
+        return self._json().get('document', {}).get('confidence')
+
+    @property
+    def entities(self):
+        return _LazySequence(self._json().get('entities'), Entity)
+
+
+class EventsResult(Result):
+    """Result of L{API.events}."""
+
+    __slots__ = ()
+
+    @property
+    def events(self):
+        return _LazySequence(self._json().get('events'), Event)
+
+
+_RESULT_CLASSES = {
+    'entities': EntitiesResult,
+    'events': EventsResult,
+    'language': LanguageResult,
+    'sentences': SentencesResult,
+    'sentiment': SentimentResult,
+    'tokens': TokensResult,
+}
+
+
+def result_class(suburl):
+    """Return the L{Result} subclass for an endpoint path, e.g. C{'entities'}."""
+    return _RESULT_CLASSES.get(suburl, Result)
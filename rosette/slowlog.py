@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+"""
+Capture of slow or large calls, for L{API}'s C{slow_calls} argument.
+
+Copyright (c) 2014-2024 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import collections
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+
+def _encoded(value):
+    return value.encode('utf-8') if isinstance(value, str) else value or b''
+
+
+class SlowCallLog(object):
+    """Keeps the most recent calls that took longer than C{latency} seconds or
+    sent or received more than C{size} bytes, in a ring buffer of
+    C{capacity} records.  Only a C{sample} share of those calls is recorded,
+    and nothing is computed for the others, so the log can stay enabled in
+    production.
+
+    A record is a dictionary with:
+      - C{time}: when the call ended, in seconds since the epoch;
+      - C{endpoint} and C{url};
+      - C{status}: the HTTP status, or the name of the connection error;
+      - C{content_length} and C{response_length}, in bytes;
+      - C{language} and C{options} of the request, if given;
+      - C{content_hash}: SHA-256 of the document content, to find the
+        document again without logging it;
+      - C{timings}, in seconds: C{wait} for a connection slot, see
+        L{API}'s C{priority_weights}; C{headers} until the response
+        headers arrived; C{body} for the rest of the call, including
+        retries and failover; and C{total}.
+    Each record is also logged at INFO level to the C{rosette.slow} logger.
+    """
+
+    def __init__(self, latency=1.0, size=None, sample=1.0, capacity=100):
+        """
+        @param latency: (Optional) seconds above which a call is recorded; C{None}
+        to ignore latency.
+        @param size: (Optional) request or response bytes above which a call is
+        recorded; C{None} to ignore size.
+        @param sample: share of the calls above the thresholds that are recorded.
+        @param capacity: number of records kept.
+        """
+        self.latency = latency
+        self.size = size
+        self.sample = sample
+        self.logger = logging.getLogger('rosette.slow')
+        self._records = collections.deque(maxlen=capacity)
+        self._lock = threading.Lock()
+
+    def records(self):
+        """Return the records kept, oldest first."""
+        with self._lock:
+            return list(self._records)
+
+    def clear(self):
+        """Forget the records kept."""
+        with self._lock:
+            self._records.clear()
+
+    def observe(self, request, response, timings, error=None):
+        """Record a call if it exceeds a threshold and is sampled.
+        @param request: the C{requests.Request} sent.
+        @param response: the C{requests.Response}, or C{None} after C{error}.
+        @param timings: dictionary of the monotonic C{started}, C{scheduled}
+        and C{finished} times of the call.
+        @param error: the exception raised instead of a response, if any.
+        """
+        total = timings['finished'] - timings['started']
+        slow = self.latency is not None and total > self.latency
+        # Lengths of the data as given, without encoding it: close enough to
+        # bytes for a threshold, and only needed when no latency matched
+        large = not slow and self.size is not None and max(
+            len(request.files['content'][1] if request.files else request.data or ''),
+            len(response.content) if response is not None else 0) > self.size
+        if not (slow or large) or (self.sample < 1 and random.random() >= self.sample):
+            return
+
+        body = _encoded(request.data)
+        content = _encoded(request.files['content'][1]) if request.files else body
+        fields = {}
+        if body:
+            try:
+                fields = json.loads(body)
+            except ValueError:
+                pass
+        if isinstance(fields.get('content'), str):
+            content = fields['content'].encode('utf-8')
+        scheduled = timings.get('scheduled', timings['started'])
+        headers = response.elapsed.total_seconds() if response is not None else None
+        record = {
+            'time': time.time(),
+            'endpoint': urlsplit(request.url).path.rsplit('/v1/', 1)[-1],
+            'url': request.url,
+            'status': response.status_code if response is not None else type(error).__name__,
+            'content_length': len(content),
+            'response_length': len(response.content) if response is not None else 0,
+            'language': fields.get('language'),
+            'options': fields.get('options'),
+            'content_hash': hashlib.sha256(content).hexdigest(),
+            'timings': {'wait': scheduled - timings['started'],
+                        'headers': headers,
+                        'body': max(timings['finished'] - scheduled - (headers or 0), 0.0),
+                        'total': total}}
+        with self._lock:
+            self._records.append(record)
+        self.logger.info('slow call to %s: %.3fs, %d bytes, content %s',
+                         record['endpoint'], total, record['content_length'], record['content_hash'])
@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+
+"""
+Splitting of oversized documents into chunks, with offset-correct merging of
+the chunk results.
+
+Copyright (c) 2014-2024 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import json
+import re
+
+from rosette.api import DocumentParameters, RosetteException
+from rosette.batch import endpoint_key
+from rosette.results import Result, result_class
+
+SPLITTABLE_ENDPOINTS = ('ENTITIES', 'EVENTS', 'RELATIONSHIPS', 'SENTENCES', 'SYNTAX_DEPENDENCIES', 'TOKENS')
+DEFAULT_MAX_BYTES = 100000
+
+_PARAGRAPH_BREAK = re.compile(r'\n[ \t\r\f\v]*\n\s*')
+_SENTENCE_BREAK = re.compile(r'(?<=[.!?。！？])\s+')
+_WHITESPACE = re.compile(r'\s+')
+_TEMPORARY_ID = re.compile(r'^T\d+$')
+_OFFSET_KEYS = ('startOffset', 'endOffset')
+_TOKEN_INDEX_KEYS = ('startTokenIndex', 'endTokenIndex', 'governorTokenIndex', 'dependentTokenIndex')
+_ENTITY_ID_KEYS = ('entityId', 'id', 'arg1Id', 'arg2Id', 'arg3Id')
+
+
+def _utf8_length(text):
+    return len(text.encode('utf-8'))
+
+
+def _utf16_length(text):
+    return len(text.encode('utf-16-le')) // 2
+
+
+def _pieces(text, pattern):
+    """Split C{text} after each match of C{pattern}, keeping every character."""
+    pieces = []
+    start = 0
+    for match in pattern.finditer(text):
+        if match.end() > start:
+            pieces.append(text[start:match.end()])
+            start = match.end()
+    if start < len(text):
+        pieces.append(text[start:])
+    return pieces
+
+
+def _hard_split(text, max_bytes):
+    """Split C{text} into pieces of at most C{max_bytes} UTF-8 bytes, at a
+    whitespace boundary where there is one."""
+    pieces = []
+    while _utf8_length(text) > max_bytes:
+        end = len(text.encode('utf-8')[:max_bytes].decode('utf-8', 'ignore'))
+        cut = None
+        for match in _WHITESPACE.finditer(text, 0, end):
+            cut = match.end()
+        if not cut or cut >= len(text):
+            cut = max(end, 1)
+        pieces.append(text[:cut])
+        text = text[cut:]
+    if text:
+        pieces.append(text)
+    return pieces
+
+
+def split_text(text, max_bytes=DEFAULT_MAX_BYTES):
+    """Split C{text} into contiguous chunks of at most C{max_bytes} UTF-8 bytes.
+    Chunks end at paragraph breaks where possible, then at sentence ends, and
+    only as a last resort inside a sentence.  Concatenating the chunks gives
+    back C{text}.
+    @return: list of chunk strings.
+    """
+    if _utf8_length(text) <= max_bytes:
+        return [text]
+    pieces = []
+    for paragraph in _pieces(text, _PARAGRAPH_BREAK):
+        if _utf8_length(paragraph) <= max_bytes:
+            pieces.append(paragraph)
+            continue
+        for sentence in _pieces(paragraph, _SENTENCE_BREAK):
+            if _utf8_length(sentence) <= max_bytes:
+                pieces.append(sentence)
+            else:
+                pieces.extend(_hard_split(sentence, max_bytes))
+
+    chunks = []
+    current = []
+    size = 0
+    for piece in pieces:
+        piece_size = _utf8_length(piece)
+        if current and size + piece_size > max_bytes:
+            chunks.append(''.join(current))
+            current = []
+            size = 0
+        current.append(piece)
+        size += piece_size
+    if current:
+        chunks.append(''.join(current))
+    return chunks
+
+
+def _shift(value, keys, delta, floor=0):
+    """Add C{delta} to every C{keys} field at or above C{floor}, at any depth."""
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key in keys and isinstance(item, int) and item >= floor:
+                value[key] = item + delta
+            else:
+                _shift(item, keys, delta, floor)
+    elif isinstance(value, list):
+        for item in value:
+            _shift(item, keys, delta, floor)
+
+
+def _rename_ids(value, renames):
+    """Replace chunk-local temporary entity IDs using C{renames}, at any depth."""
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key in _ENTITY_ID_KEYS and isinstance(item, str) and item in renames:
+                value[key] = renames[item]
+            else:
+                _rename_ids(item, renames)
+    elif isinstance(value, list):
+        for item in value:
+            _rename_ids(item, renames)
+
+
+def _entity_key(entity):
+    entity_id = entity.get('entityId')
+    if entity_id and not _TEMPORARY_ID.match(entity_id):
+        return entity_id
+    return (entity.get('type'), entity.get('normalized') or entity.get('mention'))
+
+
+def _merge_entities(results, offsets):
+    merged = {}
+    temporary = 0
+    for result, delta in zip(results, offsets):
+        for entity in result.get('entities', []):
+            _shift(entity, _OFFSET_KEYS, delta)
+            key = _entity_key(entity)
+            if key not in merged:
+                merged[key] = entity
+                if _TEMPORARY_ID.match(entity.get('entityId') or ''):
+                    entity['entityId'] = 'T' + str(temporary)
+                    temporary += 1
+                continue
+            target = merged[key]
+            target['mentionOffsets'] = target.get('mentionOffsets', []) + entity.get('mentionOffsets', [])
+            if 'count' in target:
+                target['count'] += entity.get('count', 0)
+            for score in ('confidence', 'linkingConfidence', 'salience'):
+                if score in entity and (score not in target or entity[score] > target[score]):
+                    target[score] = entity[score]
+    return {'entities': list(merged.values())}
+
+
+def _merge_events(results, offsets):
+    events = []
+    temporary = 0
+    for result, delta in zip(results, offsets):
+        renames = {}
+        for event in result.get('events', []):
+            _shift(event, _OFFSET_KEYS, delta)
+            for mention in event.get('mentions', []):
+                for argument in mention.get('arguments', []):
+                    argument_id = argument.get('id')
+                    if isinstance(argument_id, str) and _TEMPORARY_ID.match(argument_id) \
+                            and argument_id not in renames:
+                        renames[argument_id] = 'T' + str(temporary)
+                        temporary += 1
+            _rename_ids(event, renames)
+            events.append(event)
+    return {'events': events}
+
+
+def _merge_relationships(results):
+    relationships = []
+    seen = set()
+    temporary = 0
+    for result in results:
+        renames = {}
+        for relationship in result.get('relationships', []):
+            for key in ('arg1Id', 'arg2Id', 'arg3Id'):
+                argument_id = relationship.get(key)
+                if isinstance(argument_id, str) and _TEMPORARY_ID.match(argument_id) \
+                        and argument_id not in renames:
+                    renames[argument_id] = 'T' + str(temporary)
+                    temporary += 1
+            _rename_ids(relationship, renames)
+            signature = repr(sorted(relationship.items()))
+            if signature not in seen:
+                seen.add(signature)
+                relationships.append(relationship)
+    return {'relationships': relationships}
+
+
+def _merge_syntax_dependencies(results):
+    sentences = []
+    tokens = []
+    for result in results:
+        chunk_sentences = result.get('sentences', [])
+        _shift(chunk_sentences, _TOKEN_INDEX_KEYS, len(tokens))
+        sentences.extend(chunk_sentences)
+        tokens.extend(result.get('tokens', []))
+    return {'sentences': sentences, 'tokens': tokens}
+
+
+def merge_results(key, chunks, results):
+    """Merge the results of calling endpoint C{key} on each chunk of a document.
+    Character offsets are shifted by the length of the preceding chunks in
+    UTF-16 code units, the unit of the offsets reported by the server.
+    Token indexes are shifted by the number of preceding tokens.
+    @param key: an L{API.endpoints} key in L{SPLITTABLE_ENDPOINTS}.
+    @param chunks: the chunk strings, in document order.
+    @param results: the endpoint result for each chunk, as dictionaries or
+    L{rosette.results.Result} objects.
+    @return: a single result for the whole document, as a dictionary.
+    """
+    headers = results[0].headers if results and isinstance(results[0], Result) else None
+    results = [copy.deepcopy(result.to_dict() if isinstance(result, Result) else result) for result in results]
+    if headers is None and results:
+        headers = results[0].pop('responseHeaders', None)
+    offsets = []
+    position = 0
+    for chunk in chunks:
+        offsets.append(position)
+        position += _utf16_length(chunk)
+
+    if key == 'ENTITIES':
+        merged = _merge_entities(results, offsets)
+    elif key == 'EVENTS':
+        merged = _merge_events(results, offsets)
+    elif key == 'RELATIONSHIPS':
+        merged = _merge_relationships(results)
+    elif key == 'SENTENCES':
+        merged = {'sentences': [sentence for result in results for sentence in result.get('sentences', [])]}
+    elif key == 'SYNTAX_DEPENDENCIES':
+        merged = _merge_syntax_dependencies(results)
+    elif key == 'TOKENS':
+        merged = {'tokens': [token for result in results for token in result.get('tokens', [])]}
+    else:
+        raise RosetteException(
+            "badArgument",
+            "Endpoint results cannot be merged; supported: " + ", ".join(SPLITTABLE_ENDPOINTS),
+            repr(key))
+    if headers is not None:
+        merged['responseHeaders'] = headers
+    return merged
+
+
+def call_split(api, endpoint, parameters, max_bytes=DEFAULT_MAX_BYTES, max_workers=4):
+    """Call a span-producing endpoint on a document of any size.
+    A C{content} larger than C{max_bytes} UTF-8 bytes is split with
+    L{split_text}, the chunks are sent concurrently, and the chunk results are
+    merged with L{merge_results} into one result whose offsets refer to the
+    original document.  Entities found in several chunks are merged into one.
+    @param api: the L{API} to call.
+    @param endpoint: one of L{SPLITTABLE_ENDPOINTS}, or its method name, e.g. C{entities}.
+    @type parameters: L{DocumentParameters} or L{str}
+    @param max_bytes: largest C{content} to send in one request.
+    @param max_workers: largest number of chunks sent at once.
+    @return: a python dictionary shaped like the endpoint's own result, or
+    its L{rosette.results.Result} if the L{API} returns typed results.
+    """
+    key = endpoint_key(api, endpoint)
+    if key not in SPLITTABLE_ENDPOINTS:
+        raise RosetteException(
+            "badArgument",
+            "Endpoint results cannot be merged; supported: " + ", ".join(SPLITTABLE_ENDPOINTS),
+            repr(endpoint))
+    method = getattr(api, key.lower())
+    if isinstance(parameters, str):
+        text = parameters
+        parameters = DocumentParameters()
+        parameters['content'] = text
+    content = parameters['content'] if isinstance(parameters, DocumentParameters) else None
+    if not isinstance(content, str) or parameters.use_multipart:
+        return method(parameters)
+
+    chunks = split_text(content, max_bytes)
+    if len(chunks) == 1:
+        return method(parameters)
+
+    def call_chunk(chunk):
+        chunk_params = DocumentParameters()
+        chunk_params['content'] = chunk
+        chunk_params['language'] = parameters['language']
+        chunk_params['profileId'] = parameters['profileId']
+        return method(chunk_params)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks)))) as executor:
+        results = list(executor.map(call_chunk, chunks))
+    merged = merge_results(key, chunks, results)
+    if api.typed_results:
+        headers = merged.pop('responseHeaders', None) or {}
+        return result_class(api.endpoints[key])(json.dumps(merged).encode('utf-8'), headers)
+    return merged
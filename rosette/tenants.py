@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+
+"""
+Client for many user keys in one process, e.g. in a gateway serving several
+customers.
+
+Copyright (c) 2014-2024 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import collections
+import threading
+import time
+
+from rosette.api import API, RosetteException
+
+
+class _RateLimiter(object):
+    """Token bucket allowing C{rate} calls per second on average and bursts of
+    up to C{burst} calls."""
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, waiting for one if the bucket is empty."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+
+class TenantMetrics(object):
+    """Counters of the calls made for one tenant."""
+
+    def __init__(self):
+        self.calls = 0
+        self.in_flight = 0
+        self.seconds = 0.0
+        self.errors = collections.Counter()
+
+    def to_dict(self):
+        """Return the counters as a dictionary; C{errors} counts by L{RosetteException} status."""
+        return {'calls': self.calls,
+                'in_flight': self.in_flight,
+                'seconds': self.seconds,
+                'errors': dict(self.errors)}
+
+
+class _Tenant(object):
+    __slots__ = ('api', 'limiter', 'metrics')
+
+    def __init__(self, api, limiter):
+        self.api = api
+        self.limiter = limiter
+        self.metrics = TenantMetrics()
+
+
+class MultiTenantAPI(object):
+    """Calls the Analytics API on behalf of many tenants, each with its own
+    user key, over one shared C{requests.Session} and connection pool.
+
+    Each tenant gets an L{API} sharing that session.  Its calls are limited
+    to the tenant's own concurrency, learned from the concurrency header of
+    the responses to its calls, and optionally to a rate.  The state of at
+    most C{max_tenants} tenants is kept; the least recently used tenant is
+    evicted when a new one arrives, and starts afresh if it comes back.
+    """
+
+    def __init__(self, service_url='https://analytics.babelstreet.com/rest/v1/', pool_size=32,
+                 max_tenants=1000, rate=None, burst=None, **api_options):
+        """
+        @param service_url: (Optional) the URL, or list of URLs, of the server.
+        @param pool_size: connections kept per server host, shared by all tenants.
+        @param max_tenants: largest number of tenants whose state is kept.
+        @param rate: (Optional) calls per second allowed to each tenant.
+        @param burst: (Optional) calls a tenant may make at once within its rate;
+        defaults to C{rate}.
+        @param api_options: other keyword arguments of L{API}, e.g. C{retries},
+        C{proxies} or C{typed_results}; they apply to every tenant.
+        """
+        self.service_url = service_url
+        self.max_tenants = max_tenants
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.api_options = api_options
+        # Owns the shared session and sets up its connection pools and retries
+        self.transport = API(service_url=service_url, **api_options)
+        self.transport.set_pool_size(pool_size)
+        self._tenants = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _tenant(self, user_key):
+        evicted = []
+        with self._lock:
+            tenant = self._tenants.get(user_key)
+            if tenant is not None:
+                self._tenants.move_to_end(user_key)
+                return tenant
+            options = dict(self.api_options)
+            options.setdefault('priority_weights', {'normal': 1})
+            api = API(user_key, self.service_url, session=self.transport.session, **options)
+            limiter = _RateLimiter(self.rate, max(self.burst, 1)) if self.rate else None
+            tenant = self._tenants[user_key] = _Tenant(api, limiter)
+            while len(self._tenants) > self.max_tenants:
+                evicted.append(self._tenants.popitem(last=False)[1])
+        # Closing waits for the calls the tenant submitted; other tenants go on meanwhile
+        for old in evicted:
+            old.api.close()
+        return tenant
+
+    def api(self, user_key):
+        """Return the L{API} of a tenant, e.g. to set options; calls made on it
+        directly bypass the rate limit and metrics."""
+        return self._tenant(user_key).api
+
+    def call(self, user_key, name, *args, **kwargs):
+        """Call an endpoint for a tenant.
+        @param user_key: the tenant's user key.
+        @param name: the endpoint method name, e.g. C{entities} or C{name_similarity}.
+        @param args: the arguments of the endpoint method, e.g. its parameters object.
+        @return: the endpoint method's result.
+        """
+        tenant = self._tenant(user_key)
+        method = getattr(tenant.api, name.lower().replace('-', '_'), None)
+        if name.upper().replace('-', '_') not in tenant.api.endpoints or method is None:
+            raise RosetteException("badArgument", "Unknown endpoint", repr(name))
+        if tenant.limiter is not None:
+            tenant.limiter.acquire()
+        metrics = tenant.metrics
+        with self._lock:
+            metrics.calls += 1
+            metrics.in_flight += 1
+        start = time.monotonic()
+        try:
+            return method(*args, **kwargs)
+        except RosetteException as exception:
+            with self._lock:
+                metrics.errors[str(exception.status)] += 1
+            raise
+        finally:
+            with self._lock:
+                metrics.in_flight -= 1
+                metrics.seconds += time.monotonic() - start
+
+    def metrics(self, user_key=None):
+        """Return the metrics of one tenant, or a dictionary of user key to
+        metrics for every tenant kept.  The metrics include the tenant's
+        learned C{concurrency}."""
+        with self._lock:
+            tenants = [(user_key, self._tenants[user_key])] if user_key is not None else \
+                list(self._tenants.items())
+        metrics = {}
+        for key, tenant in tenants:
+            metrics[key] = tenant.metrics.to_dict()
+            metrics[key]['concurrency'] = tenant.api.get_pool_size()
+        return metrics[user_key] if user_key is not None else metrics
+
+    def close(self):
+        """Forget every tenant and close the shared session."""
+        with self._lock:
+            tenants = list(self._tenants.values())
+            self._tenants.clear()
+        for tenant in tenants:
+            tenant.api.close()
+        self.transport.close()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+
+"""
+In-process nearest-neighbour index over Babel Street Analytics semantic vectors.
+
+Copyright (c) 2014-2024 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from collections import OrderedDict
+import json
+import os
+import threading
+
+from rosette.api import DocumentParameters, RosetteException
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+_VECTORS_FILE = 'vectors.npy'
+_IDS_FILE = 'ids.json'
+
+
+def _require_numpy():
+    if numpy is None:
+        raise RosetteException(
+            "missingDependency",
+            "The rosette.vectors module requires numpy",
+            "pip install rosette_api[vectors]")
+
+
+def _normalize(matrix):
+    """Scale the rows of C{matrix} to unit length so that a dot product is a cosine."""
+    norms = numpy.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+class BruteForceSearcher(object):
+    """Exact cosine search by one vectorized matrix product over every row.
+    This is the default searcher of L{VectorIndex}.  Any object with the same
+    C{fit} and C{search} methods, for example a graph or IVF index, may be
+    supplied in its place.
+    """
+
+    def __init__(self):
+        self.matrix = None
+
+    def fit(self, matrix):
+        """Called by the index whenever its rows change.
+        @param matrix: 2-D array of unit-length rows.
+        """
+        self.matrix = matrix
+
+    def search(self, query, k):
+        """Return the row numbers and scores of the C{k} rows closest to C{query}.
+        @param query: 1-D unit-length vector.
+        @param k: number of neighbours wanted.
+        @return: a pair of arrays, row numbers and cosine scores, best first.
+        """
+        if self.matrix is None or len(self.matrix) == 0:
+            return numpy.empty(0, dtype=numpy.int64), numpy.empty(0, dtype=numpy.float32)
+        scores = self.matrix.dot(query)
+        k = min(k, len(scores))
+        if k < len(scores):
+            rows = numpy.argpartition(-scores, k - 1)[:k]
+        else:
+            rows = numpy.arange(len(scores))
+        rows = rows[numpy.argsort(-scores[rows], kind='stable')]
+        return rows, scores[rows]
+
+
+class VectorIndex(object):
+    """An in-process index of document embeddings returned by L{API.semantic_vectors}.
+
+    Documents are added either with a vector, with the result dictionary of a
+    C{semantic_vectors} call, or as content which the index embeds through the
+    L{API}.  Queries accept a vector or text; query text is embedded through
+    the L{API} and the embedding is kept in a bounded LRU cache.
+
+    Rows are stored as unit-length C{float32} vectors so that cosine similarity
+    is a dot product.  L{VectorIndex.save} writes a directory which
+    L{VectorIndex.load} can memory-map instead of reading into memory.
+
+    Requires numpy.
+    """
+
+    def __init__(self, api=None, searcher=None, cache_size=1024):
+        """Create a L{VectorIndex}.
+        @param api: (Optional; required to embed text) the L{API} used by
+        L{VectorIndex.add_document} and text queries.
+        @param searcher: (Optional) the search strategy; defaults to L{BruteForceSearcher}.
+        @param cache_size: number of query embeddings to keep.
+        """
+        _require_numpy()
+        self.api = api
+        self.searcher = searcher if searcher is not None else BruteForceSearcher()
+        self.cache_size = cache_size
+        self.ids = []
+        self._matrix = None
+        self._pending = []
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, doc_id, vector):
+        """Add one embedding.
+        @param doc_id: identifier returned by queries for this vector.
+        @param vector: sequence of floats.
+        """
+        row = numpy.asarray(vector, dtype=numpy.float32)
+        if row.ndim != 1:
+            raise RosetteException("badArgument", "An embedding must be one-dimensional", repr(doc_id))
+        with self._lock:
+            self._check_dimension(row, doc_id)
+            self.ids.append(doc_id)
+            self._pending.append(row)
+
+    def add_result(self, doc_id, result):
+        """Add the C{documentEmbedding} of a L{API.semantic_vectors} result.
+        @param doc_id: identifier returned by queries for this document.
+        @param result: the dictionary returned by L{API.semantic_vectors}.
+        """
+        if 'documentEmbedding' not in result:
+            raise RosetteException(
+                "badArgument",
+                "Result does not contain a documentEmbedding",
+                repr(doc_id))
+        self.add(doc_id, result['documentEmbedding'])
+
+    def add_document(self, doc_id, parameters):
+        """Embed a document through the L{API} and add it.
+        @param doc_id: identifier returned by queries for this document.
+        @type parameters: L{DocumentParameters} or L{str}
+        """
+        self.add_result(doc_id, self._api().semantic_vectors(parameters))
+
+    def embed(self, text):
+        """Return the embedding of C{text}, calling the L{API} only on a cache miss."""
+        with self._lock:
+            if text in self._cache:
+                self._cache.move_to_end(text)
+                return self._cache[text]
+        params = DocumentParameters()
+        params['content'] = text
+        result = self._api().semantic_vectors(params)
+        vector = numpy.asarray(result['documentEmbedding'], dtype=numpy.float32)
+        with self._lock:
+            self._cache[text] = vector
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return vector
+
+    def query(self, query, k=10):
+        """Find the documents most similar to C{query}.
+        @param query: text, which is embedded through the L{API}, or a vector.
+        @param k: number of neighbours wanted.
+        @return: a list of C{(doc_id, score)} pairs, most similar first.
+        """
+        if isinstance(query, str):
+            query = self.embed(query)
+        vector = numpy.asarray(query, dtype=numpy.float32)
+        if vector.ndim != 1:
+            raise RosetteException("badArgument", "A query vector must be one-dimensional", "query")
+        vector = _normalize(vector)
+        with self._lock:
+            self._check_dimension(vector, "query")
+            self._flush()
+            rows, scores = self.searcher.search(vector, k)
+            return [(self.ids[row], float(score)) for row, score in zip(rows, scores)]
+
+    def dimension(self):
+        """Return the number of dimensions of the stored vectors, or C{None} if empty."""
+        if self._matrix is not None:
+            return self._matrix.shape[1]
+        if self._pending:
+            return len(self._pending[0])
+        return None
+
+    def save(self, path):
+        """Write the index to the directory C{path}, creating it if needed."""
+        with self._lock:
+            self._flush()
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            matrix = self._matrix
+            if matrix is None:
+                matrix = numpy.empty((0, 0), dtype=numpy.float32)
+            numpy.save(os.path.join(path, _VECTORS_FILE), matrix)
+            with open(os.path.join(path, _IDS_FILE), 'w') as ids_file:
+                json.dump(self.ids, ids_file)
+
+    @classmethod
+    def load(cls, path, api=None, searcher=None, mmap=True):
+        """Read an index written by L{VectorIndex.save}.
+        @param path: directory given to L{VectorIndex.save}.
+        @param mmap: map the vectors read-only instead of reading them into memory.
+        @return: a L{VectorIndex}.
+        """
+        index = cls(api=api, searcher=searcher)
+        matrix = numpy.load(os.path.join(path, _VECTORS_FILE), mmap_mode='r' if mmap else None)
+        with open(os.path.join(path, _IDS_FILE)) as ids_file:
+            index.ids = json.load(ids_file)
+        if len(index.ids) != len(matrix):
+            raise RosetteException(
+                "badArgument",
+                "Index at " + path + " is inconsistent",
+                str(len(index.ids)) + " ids, " + str(len(matrix)) + " vectors")
+        if len(matrix):
+            index._matrix = matrix
+            index.searcher.fit(matrix)
+        return index
+
+    def _check_dimension(self, row, name):
+        """Raise if C{row} does not have the dimensions of the stored vectors.  Caller holds the lock."""
+        dimension = self.dimension()
+        if dimension is not None and len(row) != dimension:
+            raise RosetteException(
+                "badArgument",
+                "Embedding has " + str(len(row)) + " dimensions, index has " + str(dimension),
+                repr(name))
+
+    def _api(self):
+        if self.api is None:
+            raise RosetteException(
+                "badArgument",
+                "An API is required to embed text",
+                "VectorIndex(api=...)")
+        return self.api
+
+    def _flush(self):
+        """Fold rows added since the last search into the matrix.  Caller holds the lock."""
+        if not self._pending:
+            return
+        rows = _normalize(numpy.vstack(self._pending))
+        if self._matrix is not None:
+            rows = numpy.concatenate((self._matrix, rows))
+        self._matrix = rows
+        self._pending = []
+        self.searcher.fit(self._matrix)
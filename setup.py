@@ -37,7 +37,11 @@ setup(
     long_description=LONG_DESCRIPTION,
     long_description_content_type='text/markdown',
     packages=['rosette'],
-    install_requires=['requests'],
+    install_requires=['requests', 'urllib3>=1.26'],
+    extras_require={
+        'vectors': ['numpy'],
+        'columnar': ['pyarrow'],
+    },
     platforms='any',
     url=HOMEPAGE,
     version=VERSION,
@@ -15,4 +15,18 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
-# blank __init__.py
+
+from rosette.api import DocumentParameters
+
+
+def get_base_url():
+    """Base URL of the default server, as mocked by the tests."""
+    return "https://analytics.babelstreet.com/rest/"
+
+
+def document_params(text, language=None):
+    """Return L{DocumentParameters} for C{text}."""
+    params = DocumentParameters()
+    params['content'] = text
+    params['language'] = language
+    return params
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2014-2024 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import io
+import json
+import threading
+import time
+import pook
+import pytest
+from rosette import batch
+from rosette.__main__ import main
+from rosette.api import API, NameSimilarityParameters, RosetteException
+from rosette.batch import (BatchRunner, BoundedQueue, JsonLinesWriter, OutputLine, _api_settings, _init_process,
+                           _is_retryable, _process_in_worker, endpoint_key, make_parameters, read_records,
+                           shard_of)
+from rosette.journal import Journal
+from rosette.load import StubServer
+from tests import get_base_url
+
+
+@pytest.fixture
+def json_response():
+    """ fixture to return a language body """
+    return json.dumps({'languageDetections': [{'language': 'eng', 'confidence': 0.9}]})
+
+
+@pytest.fixture
+def input_file(tmpdir):
+    """ fixture to return a JSONL input file of three documents """
+    path = tmpdir.join('input.jsonl')
+    path.write('\n'.join(json.dumps({'id': 'doc' + str(i), 'content': 'text ' + str(i)})
+                         for i in range(3)) + '\n')
+    return str(path)
+
+
+def test_endpoint_key():
+    api = API('bogus_key')
+    assert endpoint_key(api, 'entities') == 'ENTITIES'
+    assert endpoint_key(api, 'name-similarity') == 'NAME_SIMILARITY'
+    assert endpoint_key(api, 'syntax/dependencies') == 'SYNTAX_DEPENDENCIES'
+    with pytest.raises(RosetteException) as e_rosette:
+        endpoint_key(api, 'ping')
+    assert e_rosette.value.status == 'badArgument'
+
+
+def test_read_records_and_parameters():
+    stream = io.StringIO('{"id": 7, "name1": {"text": "a"}, "name2": {"text": "b"}}\nplain text\n\n')
+    records = list(read_records(stream))
+    assert [doc_id for doc_id, _ in records] == ['7', '1']
+    params = make_parameters('NAME_SIMILARITY', records[0][1])
+    assert isinstance(params, NameSimilarityParameters)
+    assert params['name2'] == {'text': 'b'}
+    assert records[1][1] == {'content': 'plain text'}
+
+
+@pook.on
+def test_cli_batch(json_response, input_file, tmpdir, capsys):
+    pook.post(url=get_base_url() + "v1/language",
+              response_json=json_response,
+              reply=200,
+              times=3)
+
+    journal = str(tmpdir.join('journal.db'))
+    assert main(['batch', 'language', input_file, '-k', 'bogus_key', '-j', journal]) == 0
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert sorted(line['id'] for line in lines) == ['doc0', 'doc1', 'doc2']
+    assert 'responseHeaders' not in lines[0]['result']
+
+    # Everything is journaled as succeeded; a second run makes no calls.
+    assert main(['batch', 'language', input_file, '-k', 'bogus_key', '-j', journal]) == 0
+    assert capsys.readouterr().out == ''
+
+
+@pook.on
+def test_retry_then_fail(json_response):
+    pook.post(url=get_base_url() + "v1/entities",
+              response_json={'code': 'tooManyRequests', 'message': 'slow down'},
+              reply=429,
+              times=2)
+
+    lines = []
+    runner = BatchRunner(API('bogus_key'), 'entities', retries=1, backoff=0)
+    counts = runner.run([('a', {'content': 'text'})], lines.append)
+    assert counts == {'succeeded': 0, 'failed': 1, 'skipped': 0}
+    assert lines[0]['error']['status'] == 'tooManyRequests'
+
+
+@pook.on
+def test_typed_results(json_response):
+    pook.post(url=get_base_url() + "v1/language",
+              response_json=json_response,
+              reply=200)
+
+    lines = []
+    runner = BatchRunner(API('bogus_key', typed_results=True), 'language')
+    assert runner.run([('a', {'content': 'text'})], lines.append)['succeeded'] == 1
+    assert lines[0]['result'] == json.loads(json_response)
+
+
+def test_one_retry_layer():
+    api = API('bogus_key', service_url='http://127.0.0.1:9/rest/v1/', retries=1, refresh_duration=0)
+    with pytest.raises(RosetteException) as e_rosette:
+        api.ping()
+    # The API retried the connection already
+    assert not _is_retryable(e_rosette.value, api.retry)
+    assert _is_retryable(e_rosette.value, None)
+    assert _is_retryable(RosetteException(503, 'busy', ''), api.retry)
+    api = API('bogus_key', retries=2, retry_statuses=(503,))
+    assert not _is_retryable(RosetteException(503, 'busy', ''), api.retry)
+    assert _is_retryable(RosetteException(429, 'slow down', ''), api.retry)
+
+
+@pook.on
+def test_resume_retries_only_failures(json_response, tmpdir):
+    journal = Journal(str(tmpdir.join('journal.db')))
+    records = [('a', {'content': 'text a'}), ('b', {'content': 'text b'})]
+    pook.post(url=get_base_url() + "v1/entities",
+              response_json=json_response,
+              reply=200)
+    pook.post(url=get_base_url() + "v1/entities",
+              response_json={'code': 'badRequest', 'message': 'bad'},
+              reply=400)
+
+    lines = []
+    runner = BatchRunner(API('bogus_key'), 'entities', max_workers=1, journal=journal)
+    assert runner.run(records, lines.append) == {'succeeded': 1, 'failed': 1, 'skipped': 0}
+    assert journal.failures() == [('b', 'badRequest', 'bad')]
+
+    pook.post(url=get_base_url() + "v1/entities",
+              response_json=json_response,
+              reply=200)
+    runner = BatchRunner(API('bogus_key'), 'entities', journal=journal, failed_only=True)
+    assert runner.run(records, lines.append) == {'succeeded': 1, 'failed': 0, 'skipped': 1}
+    assert journal.counts() == {'submitted': 0, 'succeeded': 2, 'failed': 0}
+    assert sorted(line['id'] for line in lines) == ['a', 'b', 'b']
+
+
+def test_backpressure_bounds_reading(monkeypatch):
+    runner = BatchRunner(API('bogus_key'), 'entities', max_workers=1, queue_items=1)
+    monkeypatch.setattr(runner, 'call', lambda record: {'entities': []})
+    pulled = [0]
+    delivered = []
+
+    def records():
+        for index in range(50):
+            pulled[0] += 1
+            yield str(index), {'content': 'text'}
+
+    def slow_sink(line):
+        # Reader, queues and worker together hold only a handful of documents.
+        assert pulled[0] - len(delivered) <= 6
+        time.sleep(0.001)
+        delivered.append(line['id'])
+
+    assert runner.run(records(), slow_sink)['succeeded'] == 50
+    assert delivered == [str(index) for index in range(50)]
+
+
+def test_bounded_queue_bytes():
+    queue = BoundedQueue(10, max_bytes=100)
+    assert queue.put('a', 80)
+    # Over the byte limit: put would block, so abort releases it.
+    threading.Timer(0.05, queue.abort).start()
+    assert not queue.put('b', 80)
+    assert queue.get() is BoundedQueue.CLOSED
+
+
+def test_sink_failure_stops_the_run(monkeypatch):
+    runner = BatchRunner(API('bogus_key'), 'entities', max_workers=2)
+    monkeypatch.setattr(runner, 'call', lambda record: {'entities': []})
+
+    def failing_sink(line):
+        raise IOError('disk full')
+
+    with pytest.raises(IOError):
+        runner.run(((str(index), {'content': 'text'}) for index in range(1000)), failing_sink)
+
+
+def _entity_types(result):
+    return sorted(entity['type'] for entity in result['entities'])
+
+
+@pook.on
+def test_process_worker(tmpdir):
+    pook.post(url=get_base_url() + "v1/entities",
+              response_json=json.dumps({'entities': [{'type': 'PERSON'}, {'type': 'LOCATION'}]}),
+              reply=200)
+
+    api = API('bogus_key')
+    api.set_option('linkEntities', False)
+    _init_process(_api_settings(api), 'ENTITIES', 0, 0, '', _entity_types)
+    json_text, error = _process_in_worker('a', {'content': 'text'})
+    assert error is None
+    assert json_text == '{"id": "a", "result": ["LOCATION", "PERSON"]}'
+
+
+def test_process_settings():
+    api = API('bogus_key', service_url=['http://a/rest/v1/', 'http://b/rest/v1/'], verify='/etc/ca.pem',
+              proxies={}, pool_block=True, balance='latency', retry_statuses=(429,))
+    api.set_custom_headers('X-BabelStreetAPI-App', 'batch')
+    _init_process(_api_settings(api), 'ENTITIES', 0, 0, '', None)
+    worker = batch._process_runner.api
+    assert worker.service_urls == api.service_urls
+    assert (worker.verify, worker.proxies, worker.pool_block) == ('/etc/ca.pem', {}, True)
+    assert worker._balancer.strategy == 'latency'
+    assert worker.retry_statuses == (429,)
+    assert worker.custom_headers == {'X-BabelStreetAPI-App': 'batch'}
+
+    shared = API('bogus_key', session=api.session)
+    with pytest.raises(RosetteException) as e_rosette:
+        BatchRunner(shared, 'entities', processes=2)
+    assert e_rosette.value.status == 'incompatible'
+
+
+def test_process_pool_run():
+    # An unreachable server: every document fails, in a worker process.
+    api = API('bogus_key', service_url='http://127.0.0.1:9/rest/v1/', retries=1, refresh_duration=0)
+    runner = BatchRunner(api, 'entities',
+                         retries=0, processes=2)
+    lines = []
+    counts = runner.run([(str(index), {'content': 'text'}) for index in range(4)], lines.append)
+    assert counts == {'succeeded': 0, 'failed': 4, 'skipped': 0}
+    assert all('Unable to establish connection' in line['error']['message'] for line in lines)
+
+
+def test_process_pool_results():
+    with StubServer(responses={'entities': {'entities': []}}) as stub:
+        api = API('bogus_key', service_url=stub.url)
+        records = [(str(index), {'content': 'text'}) for index in range(3)]
+        lines = []
+        BatchRunner(api, 'entities', processes=2).run(records, lines.append)
+        assert sorted(lines, key=lambda line: line['id']) == \
+            [{'id': str(index), 'result': {'entities': []}} for index in range(3)]
+
+        output = io.StringIO()
+        BatchRunner(api, 'entities', processes=2).run(records, JsonLinesWriter(output))
+        assert all(json.loads(line)['result'] == {'entities': []} for line in output.getvalue().splitlines())
+
+
+@pook.on
+def test_shards_partition_the_input(json_response):
+    pook.post(url=get_base_url() + "v1/language",
+              response_json=json_response,
+              reply=200,
+              times=20)
+
+    records = [('doc%d' % i, {'content': 'text'}) for i in range(20)]
+    processed = []
+    for shard in range(3):
+        lines = []
+        BatchRunner(API('bogus_key'), 'language', shard=shard, shards=3).run(records, lines.append)
+        assert all(shard_of(line['id'], 3) == shard for line in lines)
+        processed.extend(line['id'] for line in lines)
+    assert sorted(processed) == sorted(doc_id for doc_id, _ in records)
+    assert shard_of('doc1', 3) == shard_of(u'doc1', 3)
+    with pytest.raises(RosetteException):
+        BatchRunner(API('bogus_key'), 'language', shard=3, shards=3)
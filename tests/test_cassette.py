@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2014-2024 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import gzip
+import json
+import time
+import pook
+import pytest
+from rosette.api import API, RosetteException
+from rosette.cassette import Cassette, RECORD, REDACTED
+from tests import document_params, get_base_url
+
+
+@pook.on
+def _record(path):
+    pook.post(url=get_base_url() + "v1/entities", times=3,
+              response_json=json.dumps({'entities': [{'mention': 'Paris'}]}), reply=200)
+    pook.post(url=get_base_url() + "v1/language",
+              response_json=json.dumps({'code': 'badRequest', 'message': 'no'}), reply=400)
+
+    with Cassette(path, RECORD) as cassette:
+        api = API('secret_key', cassette=cassette)
+        api.set_custom_headers('X-BabelStreetAPI-Account', 'private')
+        for _ in range(2):
+            api.entities(document_params('Paris'))
+        api.entities(document_params('Lyon'))
+        with pytest.raises(RosetteException):
+            api.language(document_params('Paris'))
+
+
+def test_record_dedupes_and_redacts(tmpdir):
+    path = str(tmpdir.join('run.jsonl.gz'))
+    _record(path)
+    with gzip.open(path, 'rt') as recording:
+        entries = [json.loads(line) for line in recording]
+    bodies = [entry for entry in entries if 'body' in entry]
+    exchanges = [entry for entry in entries if 'body' not in entry]
+    assert len(exchanges) == 4
+    # Two entity requests, one language request and two distinct responses
+    assert len(bodies) == 4
+    assert 'secret_key' not in json.dumps(entries)
+    assert exchanges[0]['requestHeaders']['X-BabelStreetAPI-Key'] == REDACTED
+    assert exchanges[0]['requestHeaders']['X-BabelStreetAPI-Account'] == REDACTED
+
+
+def test_replay(tmpdir):
+    path = str(tmpdir.join('run.jsonl.gz'))
+    _record(path)
+    api = API('another_key', service_url='http://127.0.0.1:9/rest/v1/', cassette=Cassette(path))
+    assert api.entities(document_params('Lyon'))['entities'][0]['mention'] == 'Paris'
+    with pytest.raises(RosetteException) as e_rosette:
+        api.language(document_params('Paris'))
+    assert e_rosette.value.status == 'badRequest'
+    with pytest.raises(RosetteException) as e_rosette:
+        api.sentiment(document_params('Paris'))
+    assert e_rosette.value.status == 'notRecorded'
+
+
+def test_replay_recorded_latency(tmpdir):
+    path = str(tmpdir.join('run.jsonl.gz'))
+    _record(path)
+    cassette = Cassette(path, recorded_latency=True)
+    for entries, _ in cassette._exchanges.values():
+        for entry in entries:
+            entry['elapsed'] = 0.05
+    api = API('bogus_key', cassette=cassette)
+    start = time.monotonic()
+    api.entities(document_params('Paris'))
+    assert time.monotonic() - start >= 0.05
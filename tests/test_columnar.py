@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2014-2024 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import pytest
+from rosette.api import RosetteException
+
+pyarrow = pytest.importorskip("pyarrow")
+pytest.importorskip("pyarrow.parquet")
+
+from rosette import columnar  # noqa: E402
+
+
+@pytest.fixture
+def entities_responses():
+    """ fixture to return two entities results """
+    return [{'entities': [{'type': 'PERSON',
+                           'mention': 'Bridget Fitzpatrick',
+                           'normalized': 'Bridget Fitzpatrick',
+                           'count': 2,
+                           'mentionOffsets': [{'startOffset': 0, 'endOffset': 19},
+                                              {'startOffset': 40, 'endOffset': 51}],
+                           'entityId': 'T0',
+                           'confidence': 0.9}]},
+            {'entities': [],
+             'responseHeaders': {'content-type': 'application/json'}}]
+
+
+def test_entities_record_batch(entities_responses):
+    batch = columnar.to_record_batch('ENTITIES', ['a', 'b'], entities_responses)
+    assert batch.schema == columnar.schema('ENTITIES')
+    assert batch.num_rows == 1
+    assert batch.column('doc_id').to_pylist() == ['a']
+    assert batch.column('start_offsets').to_pylist() == [[0, 40]]
+    assert batch.column('salience').to_pylist() == [None]
+
+
+def test_morphology_record_batch():
+    response = {'tokens': ['The', 'dogs'],
+                'posTags': ['DET', 'NOUN'],
+                'lemmas': ['the', 'dog'],
+                'compoundComponents': None,
+                'hanReadings': None}
+    batch = columnar.to_record_batch('MORPHOLOGY', [7], [response])
+    assert batch.column('doc_id').to_pylist() == ['7', '7']
+    assert batch.column('lemma').to_pylist() == ['the', 'dog']
+    assert batch.column('han_readings').to_pylist() == [None, None]
+
+
+def test_write_parquet(entities_responses, tmpdir):
+    path = str(tmpdir.join('entities.parquet'))
+    with columnar.ParquetSink('ENTITIES', path) as sink:
+        sink.write(['a', 'b'], entities_responses)
+        sink.write(['c'], entities_responses[:1])
+    table = pyarrow.parquet.read_table(path)
+    assert table.column('doc_id').to_pylist() == ['a', 'c']
+
+
+def test_unsupported_endpoint():
+    with pytest.raises(RosetteException) as e_rosette:
+        columnar.schema('NAME_SIMILARITY')
+    assert e_rosette.value.status == 'badArgument'
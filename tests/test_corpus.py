@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2014-2024 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+import pook
+import pytest
+from rosette.__main__ import main
+from rosette.api import RosetteException
+from rosette.batch import read_records
+from rosette.corpus import Corpus
+from tests import get_base_url
+
+
+@pytest.fixture
+def corpus_file(tmpdir):
+    path = tmpdir.join('corpus.jsonl')
+    path.write_binary(b'{"id": "a", "content": "first", "language": "eng"}\r\n'
+                      b'\n'
+                      b'{"content": "caf\xc3\xa9"}\n'
+                      b'  \n'
+                      b'{"content": "last"}')
+    return str(path)
+
+
+def test_random_access(corpus_file):
+    with Corpus(corpus_file) as corpus:
+        assert len(corpus) == 3
+        assert corpus[2] == ('2', {'content': 'last'})
+        assert corpus.record(1) == ('1', {'content': u'café'})
+        assert bytes(corpus.line(0)).endswith(b'"eng"}')
+        params = corpus.document(0)
+        assert params['content'] == 'first'
+        assert params['language'] == 'eng'
+        with pytest.raises(IndexError):
+            corpus.line(3)
+    with open(corpus_file, encoding='utf-8') as lines:
+        assert list(Corpus(corpus_file)) == list(read_records(lines))
+
+
+def test_index_is_kept_and_rebuilt(corpus_file):
+    Corpus(corpus_file).close()
+    index = corpus_file + '.idx'
+    built = os.stat(index).st_mtime_ns
+    with Corpus(corpus_file) as corpus:
+        assert len(corpus) == 3
+    assert os.stat(index).st_mtime_ns == built
+
+    with open(corpus_file, 'ab') as corpus:
+        corpus.write(b'\n{"content": "more"}\n')
+    with Corpus(corpus_file) as corpus:
+        assert len(corpus) == 4
+        assert corpus[3] == ('3', {'content': 'more'})
+
+
+def test_concurrent_index_builds(tmpdir):
+    path = tmpdir.join('corpus.txt')
+    path.write('\n'.join('line %d' % number for number in range(20000)) + '\n')
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        assert list(executor.map(_count, [str(path)] * 4)) == [20000] * 4
+    assert sorted(name.basename for name in tmpdir.listdir()) == ['corpus.txt', 'corpus.txt.idx']
+
+
+def _count(path):
+    with Corpus(path, 'text') as corpus:
+        return len(corpus)
+
+
+def test_shards(tmpdir):
+    path = tmpdir.join('corpus.txt')
+    path.write('\n'.join('line %d' % number for number in range(10)) + '\n')
+    with Corpus(str(path), 'text') as corpus:
+        assert [corpus.shard_range(shard, 3) for shard in range(3)] == [(0, 3), (3, 6), (6, 10)]
+        ids = [doc_id for shard in range(3) for doc_id, _ in corpus.shard(shard, 3)]
+        assert ids == [str(number) for number in range(10)]
+        with pytest.raises(RosetteException):
+            corpus.shard_range(3, 3)
+
+
+def test_empty_file(tmpdir):
+    path = tmpdir.join('empty.txt')
+    path.write('')
+    with Corpus(str(path)) as corpus:
+        assert len(corpus) == 0
+        assert list(corpus) == []
+
+
+@pook.on
+def test_cli_records(corpus_file, capsys):
+    pook.post(url=get_base_url() + "v1/language",
+              response_json={'languageDetections': []},
+              reply=200,
+              times=2)
+
+    assert main(['batch', 'language', corpus_file, '-k', 'bogus_key', '--records', '1:']) == 0
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert sorted(line['id'] for line in lines) == ['1', '2']
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2014-2024 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import requests
+from rosette.journal import Journal
+
+
+def test_journal_states(tmpdir):
+    path = str(tmpdir.join('journal.db'))
+    journal = Journal(path)
+    assert journal.state('a') is None
+    journal.submitted('a')
+    journal.submitted('b')
+    journal.succeeded('a')
+    journal.failed('b', requests.exceptions.ConnectionError('refused'), 'no connection')
+    journal.close()
+
+    reopened = Journal(path)
+    assert reopened.state('a') == 'succeeded'
+    assert reopened.failures() == [('b', "ConnectionError('refused')", 'no connection')]
+
+    reopened.submitted('b')
+    assert reopened.counts() == {'submitted': 1, 'succeeded': 1, 'failed': 0}
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2014-2024 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import pytest
+from rosette.__main__ import main
+from rosette.api import API, RosetteException
+from rosette.load import CONSTANT, StubServer, _arrival_times, percentile, run_load
+
+
+def test_percentile():
+    latencies = list(range(1, 1001))
+    assert percentile(latencies, 50) == 500
+    assert percentile(latencies, 99.9) == 999
+    assert percentile([], 50) is None
+
+
+def test_arrival_times():
+    assert list(_arrival_times(4, 1, CONSTANT, None)) == [0.25, 0.5, 0.75]
+    poisson = list(_arrival_times(1000, 1, 'poisson', 7))
+    assert 900 < len(poisson) < 1100
+    assert poisson == list(_arrival_times(1000, 1, 'poisson', 7))
+
+
+def test_run_load_against_stub():
+    with StubServer(concurrency=6, responses={'language': {'languageDetections': []}}) as stub:
+        api = API('bogus_key', service_url=stub.url)
+        report = run_load(api, 'language', [{'content': 'hello'}], rate=200, duration=0.25,
+                          arrivals=CONSTANT).to_dict()
+    assert report['sent'] == 49
+    assert report['succeeded'] == 49
+    assert report['concurrency'] == {'6': 49}
+    assert report['latency']['p50'] <= report['latency']['p999']
+
+
+def test_errors_by_status():
+    api = API('bogus_key', service_url='http://127.0.0.1:9/rest/v1/', retries=1, refresh_duration=0)
+    report = run_load(api, 'ping', rate=50, duration=0.1, arrivals=CONSTANT).to_dict()
+    assert report['failed'] == report['sent'] == 4
+    assert report['errors'] == {'ConnectionError': 4}
+
+    with pytest.raises(RosetteException) as e_rosette:
+        run_load(api, 'entities')
+    assert e_rosette.value.status == 'missingParameter'
+
+
+def test_cli_load(capsys):
+    assert main(['load', 'ping', '--stub', '--rate', '100', '--duration', '0.1', '--arrivals', 'constant']) == 0
+    report = json.loads(capsys.readouterr().out)
+    assert report['endpoint'] == 'PING'
+    assert report['succeeded'] == 9
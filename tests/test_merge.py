@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2014-2024 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import pook
+import pytest
+from rosette.__main__ import main
+from rosette.batch import read_records
+from rosette.journal import FAILED, SUCCEEDED, Journal
+from rosette.merge import merge_outputs
+from tests import get_base_url
+
+
+@pytest.fixture
+def input_file(tmpdir):
+    """ fixture to return a JSONL input file of ten documents """
+    path = tmpdir.join('input.jsonl')
+    path.write('\n'.join(json.dumps({'id': 'doc' + str(i), 'content': 'text ' + str(i)})
+                         for i in range(10)) + '\n')
+    return str(path)
+
+
+def _write(path, lines):
+    path.write(''.join(json.dumps(line) + '\n' for line in lines))
+    return str(path)
+
+
+def test_merge_in_input_order(input_file, tmpdir):
+    first = _write(tmpdir.join('0.jsonl'), [{'id': 'doc%d' % i, 'result': {'n': i}} for i in (8, 2, 0)])
+    second = _write(tmpdir.join('1.jsonl'),
+                    [{'id': 'doc1', 'error': {'status': 503, 'message': 'busy'}},
+                     {'id': 'doc1', 'result': {'n': 1}},
+                     {'id': 'doc3', 'error': {'status': 'badRequest', 'message': 'no'}},
+                     {'id': 'other', 'result': {}}])
+    with open(second, 'a') as output:
+        output.write('{"id": "doc4", "res')
+
+    lines = []
+    with open(input_file) as records:
+        report = merge_outputs([first, second], read_records(records), lines.append)
+    assert [line['id'] for line in lines] == ['doc0', 'doc1', 'doc2', 'doc3', 'doc8']
+    assert lines[1]['result'] == {'n': 1}
+    assert lines[3]['error']['status'] == 'badRequest'
+    assert report == {'succeeded': 4, 'failed': 1, 'unexpected': ['other'],
+                      'missing': ['doc4', 'doc5', 'doc6', 'doc7', 'doc9']}
+
+
+def test_merge_journals(input_file, tmpdir):
+    paths = []
+    for shard, (doc_id, state) in enumerate([('doc0', SUCCEEDED), ('doc1', FAILED)]):
+        journal = Journal(str(tmpdir.join('%d.db' % shard)))
+        journal.submitted(doc_id)
+        if state == SUCCEEDED:
+            journal.succeeded(doc_id)
+        else:
+            journal.failed(doc_id, 500, 'oops')
+        journal.close()
+        paths.append(journal.path)
+
+    merged = Journal(str(tmpdir.join('merged.db')))
+    with open(input_file) as records:
+        merge_outputs([], read_records(records), lambda line: None, paths, merged)
+    assert merged.state('doc0') == SUCCEEDED
+    assert merged.failures() == [('doc1', '500', 'oops')]
+    merged.close()
+
+
+@pook.on
+def test_cli_shards_and_merge(input_file, tmpdir, capsys):
+    pook.post(url=get_base_url() + "v1/language",
+              response_json={'languageDetections': []},
+              reply=200,
+              times=10)
+
+    outputs = []
+    for shard in range(2):
+        outputs.append(str(tmpdir.join('out%d.jsonl' % shard)))
+        assert main(['batch', 'language', input_file, '-k', 'bogus_key', '--shard', '%d/2' % shard,
+                     '-o', outputs[-1], '-j', str(tmpdir.join('%d.db' % shard))]) == 0
+    merged = str(tmpdir.join('merged.jsonl'))
+    assert main(['merge'] + outputs + ['-i', input_file, '-o', merged, '-j', str(tmpdir.join('all.db')),
+                                       '--shard-journal', str(tmpdir.join('0.db')),
+                                       '--shard-journal', str(tmpdir.join('1.db'))]) == 0
+    with open(merged) as lines:
+        assert [json.loads(line)['id'] for line in lines] == ['doc%d' % i for i in range(10)]
+    assert Journal(str(tmpdir.join('all.db'))).counts()[SUCCEEDED] == 10
+
+    capsys.readouterr()
+    assert main(['merge', outputs[0], '-i', input_file, '-o', merged]) == 1
+    assert 'missing: ' in capsys.readouterr().err
+    with pytest.raises(SystemExit):
+        main(['batch', 'language', input_file, '-k', 'bogus_key', '--shard', '2/2'])
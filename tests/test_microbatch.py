@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2014-2024 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import pook
+import pytest
+from rosette.api import API, RosetteException
+from rosette.microbatch import MicroBatcher
+from rosette.results import LanguageResult
+from tests import get_base_url
+
+
+def _detection(language):
+    return json.dumps({'languageDetections': [{'language': language, 'confidence': 0.9}]})
+
+
+@pook.on
+def test_identical_texts_sent_once():
+    pook.post(url=get_base_url() + "v1/language", json={'content': 'hello'},
+              response_json=_detection('eng'), reply=200, times=1)
+    pook.post(url=get_base_url() + "v1/language", json={'content': 'bonjour'},
+              response_json=_detection('fra'), reply=200, times=1)
+
+    with MicroBatcher(API('bogus_key'), max_delay=0.2) as batcher:
+        futures = [batcher.submit(text) for text in ('hello', 'bonjour', 'hello', 'hello')]
+    languages = [future.result()['languageDetections'][0]['language'] for future in futures]
+    assert languages == ['eng', 'fra', 'eng', 'eng']
+    assert batcher.submitted == 4
+    assert batcher.requests == 2
+    assert pook.isdone()
+
+
+@pook.on
+def test_identical_texts_same_result_type():
+    pook.post(url=get_base_url() + "v1/language", response_json=_detection('eng'), reply=200, times=2)
+
+    with MicroBatcher(API('bogus_key', typed_results=True), max_delay=0.2) as batcher:
+        futures = [batcher.submit('hello') for _ in range(3)]
+    assert all(isinstance(future.result(), LanguageResult) for future in futures)
+
+    with MicroBatcher(API('bogus_key'), max_delay=0.2) as batcher:
+        futures = [batcher.submit('hello') for _ in range(3)]
+    results = [future.result() for future in futures]
+    assert all(type(result) is dict for result in results)
+    assert len(set(id(result) for result in results)) == 3
+
+
+@pook.on
+def test_batch_sent_at_max_bytes():
+    pook.post(url=get_base_url() + "v1/language",
+              response_json=_detection('eng'), reply=200, times=2)
+
+    batcher = MicroBatcher(API('bogus_key'), max_delay=60, max_bytes=10)
+    futures = [batcher.submit('first text'), batcher.submit('second text')]
+    assert futures[0].result(timeout=5)['languageDetections'][0]['language'] == 'eng'
+    batcher.close()
+    assert futures[1].done()
+
+
+@pook.on
+def test_errors_reach_every_caller():
+    pook.post(url=get_base_url() + "v1/transliteration",
+              response_json=json.dumps({'code': 'unsupportedLanguage', 'message': 'no'}),
+              reply=400)
+
+    with MicroBatcher(API('bogus_key'), endpoint='transliteration', max_delay=0.1) as batcher:
+        futures = [batcher.submit('text', language='xxx') for _ in range(2)]
+    for future in futures:
+        with pytest.raises(RosetteException) as e_rosette:
+            future.result()
+        assert e_rosette.value.status == 'unsupportedLanguage'
+
+    with pytest.raises(RosetteException):
+        batcher.submit('late')
+
+
+def test_rejects_name_endpoints():
+    with pytest.raises(RosetteException) as e_rosette:
+        MicroBatcher(API('bogus_key'), endpoint='name-similarity')
+    assert e_rosette.value.status == 'badArgument'
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2014-2024 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import pook
+from rosette.api import API
+from rosette.pipeline import LanguagePipeline, script_language
+from tests import get_base_url
+
+
+def test_script_language():
+    assert script_language("서울은 한국의 수도입니다") == 'kor'
+    assert script_language("東京は日本の首都です") == 'jpn'
+    assert script_language("北京是中国的首都") is None
+    assert script_language("Paris is the capital of France") is None
+    assert script_language("12345") is None
+
+
+@pook.on
+def test_pipeline_calls_language_once():
+    pook.post(url=get_base_url() + "v1/language",
+              response_json=json.dumps({'languageDetections': [{'language': 'fra', 'confidence': 0.9}]}),
+              reply=200,
+              times=1)
+    pook.post(url=get_base_url() + "v1/entities",
+              json={'content': 'Paris est la capitale', 'language': 'fra',
+                    'options': {'linkEntities': False}},
+              response_json=json.dumps({'entities': []}),
+              reply=200)
+
+    pipeline = LanguagePipeline(API('bogus_key'), endpoints=['entities'],
+                                options_by_language={'fra': {'linkEntities': False}})
+    language, results = pipeline.run("Paris est la capitale")
+    assert language == 'fra'
+    assert results['entities']['entities'] == []
+
+
+@pook.on
+def test_pipeline_uses_local_detector():
+    pook.post(url=get_base_url() + "v1/sentiment",
+              json={'content': '서울은 좋다', 'language': 'kor'},
+              response_json=json.dumps({'document': {'label': 'pos'}}),
+              reply=200)
+
+    language, results = LanguagePipeline(API('bogus_key'), endpoints=['sentiment']).run("서울은 좋다")
+    assert language == 'kor'
+    assert results['sentiment']['document']['label'] == 'pos'
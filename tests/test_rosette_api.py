@@ -18,19 +18,35 @@ limitations under the License.
 
 # To run tests, run `py.test test_rosette_api.py`
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import gc
 import json
+import logging
 import sys
 import platform
+import threading
+import time
 import pook
 import pytest
+import requests
 from rosette.api import (AddressSimilarityParameters,
                          API,
+                         DEFAULT_PRIORITY_WEIGHTS,
                          DocumentParameters,
                          NameTranslationParameters,
                          NameSimilarityParameters,
                          NameDeduplicationParameters,
+                         PRIORITY_HIGH,
+                         PRIORITY_LOW,
+                         PRIORITY_NORMAL,
                          RecordSimilarityParameters,
-                         RosetteException)
+                         RETRY_STATUSES,
+                         RosetteException,
+                         _PoolQueue,
+                         _ReturnObject)
+from rosette.load import StubServer
+from rosette.results import EntitiesResult, Result
 
 _ISPY3 = sys.version_info[0] == 3
 
@@ -706,3 +722,493 @@ def test_for_record_similarity_required_parameters(api, json_response):
 
     result = api.record_similarity(params)
     assert result["name"] == "Babel Street Analytics"
+
+
+@pook.on
+def test_typed_results(doc_params):
+    body = json.dumps({'entities': [{'type': 'PERSON',
+                                     'mention': 'Bridget Fitzpatrick',
+                                     'mentionOffsets': [{'startOffset': 0,
+                                                         'endOffset': 19}]}]})
+    pook.post(url=get_base_url() + "v1/entities",
+              response_json=body,
+              reply=200,
+              response_headers={'x-babelstreetapi-concurrency': 3})
+
+    api = API('bogus_key', typed_results=True)
+    result = api.entities(doc_params)
+    assert isinstance(result, EntitiesResult)
+    assert result.headers['x-babelstreetapi-concurrency'] == '3'
+    assert 'responseHeaders' not in result
+    assert [entity.type for entity in result.entities] == ['PERSON']
+    assert result.entities[0].mention_offsets[0].end == 19
+
+
+@pook.on
+def test_typed_results_generic(json_response):
+    pook.get(url=get_base_url() + "v1/info",
+             response_json=json_response,
+             reply=200)
+
+    api = API('bogus_key', typed_results=True)
+    result = api.info()
+    assert isinstance(result, Result)
+    assert result["name"] == "Babel Street Analytics"
+
+
+@pook.on
+def test_analyze(api, json_response, doc_params):
+    pook.post(url=get_base_url() + "v1/language",
+              response_json=json_response,
+              reply=200)
+    pook.post(url=get_base_url() + "v1/morphology/lemmas",
+              response_json=json_response,
+              reply=200)
+    pook.post(url=get_base_url() + "v1/sentiment",
+              response_json={'code': 'unsupportedLanguage', 'message': 'nope'},
+              reply=400)
+
+    result = api.analyze(doc_params, ['language', 'morphology/lemmas', 'sentiment'])
+    assert result['language']["name"] == "Babel Street Analytics"
+    assert result['morphology/lemmas']["name"] == "Babel Street Analytics"
+    assert isinstance(result['sentiment'], RosetteException)
+    assert result['sentiment'].status == 'unsupportedLanguage'
+
+
+def test_analyze_rejects_name_endpoints(api, doc_params):
+    with pytest.raises(RosetteException) as e_rosette:
+        api.analyze(doc_params, ['entities', 'name-similarity'])
+    assert e_rosette.value.status == 'badArgument'
+
+
+def test_coalesced_requests(doc_params, monkeypatch):
+    api = API('bogus_key', coalesce_requests=True)
+    calls = []
+    release = threading.Event()
+
+    def post_json(url, json_data, headers):
+        calls.append(url)
+        release.wait(5)
+        return _ReturnObject(json.dumps({'tokens': ['a']}).encode('utf-8'), {'responseHeaders': {}}, 200)
+
+    monkeypatch.setattr(api, '_post_json', post_json)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(api.tokens, doc_params) for _ in range(4)]
+        while not calls:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert len(calls) == 1
+    assert all(result['tokens'] == ['a'] for result in results)
+    assert len(set(id(result) for result in results)) == 4
+
+
+def test_coalesced_requests_share_exceptions(doc_params, monkeypatch):
+    api = API('bogus_key', coalesce_requests=True)
+
+    def post_json(url, json_data, headers):
+        raise RosetteException('unknownError', 'boom', url)
+
+    monkeypatch.setattr(api, '_post_json', post_json)
+    with pytest.raises(RosetteException) as e_rosette:
+        api.tokens(doc_params)
+    assert e_rosette.value.message == 'boom'
+
+
+@pook.on
+def test_warm_connections(json_response):
+    pook.get(url=get_base_url() + "v1/ping", times=3,
+             response_json=json_response, reply=200)
+
+    api = API('bogus_key', warm_connections=3)
+    assert api.get_pool_size() == 3
+    assert pook.isdone()
+
+
+@pook.on
+def test_warm_up_keeps_custom_headers(api, json_response):
+    pook.get(url=get_base_url() + "v1/ping", response_json=json_response, reply=200)
+
+    api.set_custom_headers('X-BabelStreetAPI-Test', 'next call')
+    assert api.warm_up(1) == 1
+    assert api.get_custom_headers() == {'X-BabelStreetAPI-Test': 'next call'}
+
+
+@pook.on
+def test_warm_up_swallows_errors(api):
+    pook.get(url=get_base_url() + "v1/ping", times=2, reply=503,
+             response_json={'code': 'unavailable', 'message': 'down'})
+
+    assert api.warm_up(2) == 0
+
+
+def test_keepalive_reaper():
+    api = API('bogus_key', keepalive_policy='reap', keepalive_interval=0.05)
+    reaped = threading.Event()
+    api._close_idle_connections = reaped.set
+    assert reaped.wait(2)
+    api.close()
+    api._keeper.join(2)
+    assert not api._keeper.is_alive()
+
+
+def test_failed_constructor_closes_cleanly(monkeypatch):
+    unraisable = []
+    monkeypatch.setattr(sys, 'unraisablehook', unraisable.append)
+    with pytest.raises(RosetteException):
+        API('bogus_key', service_url=['http://a/rest/v1/', 'http://b/rest/v1/'], balance='nope')
+    gc.collect()
+    assert unraisable == []
+
+
+def test_keepalive_policy_checked():
+    with pytest.raises(RosetteException) as e_rosette:
+        API('bogus_key', keepalive_policy='sometimes')
+    assert e_rosette.value.status == 'badArgument'
+
+
+@pook.on
+def test_environment_settings_resolved_once(api, json_response, monkeypatch):
+    pook.get(url=get_base_url() + "v1/ping", times=3,
+             response_json=json_response, reply=200)
+    merges = []
+    merge = api.session.merge_environment_settings
+
+    def counting_merge(*args):
+        merges.append(args[0])
+        return merge(*args)
+
+    monkeypatch.setattr(api.session, 'merge_environment_settings', counting_merge)
+    api.ping()
+    api.ping()
+    assert len(merges) == 1
+
+    api.clear_settings_cache()
+    api.ping()
+    assert len(merges) == 2
+
+
+def test_pinned_proxies(monkeypatch):
+    monkeypatch.setenv('HTTPS_PROXY', 'http://environment-proxy:3128')
+    api = API('bogus_key', proxies={}, verify=False)
+    _, settings = api._host_settings(get_base_url() + "v1/ping")
+    assert settings['proxies'] == {}
+    assert settings['verify'] is False
+
+    api = API('bogus_key')
+    _, settings = api._host_settings(get_base_url() + "v1/ping")
+    assert settings['proxies']['https'] == 'http://environment-proxy:3128'
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    statuses = []
+    hits = []
+
+    def do_GET(self):
+        self.hits.append(self.path)
+        status = self.statuses.pop(0) if self.statuses else 200
+        body = json.dumps({'name': 'Babel Street Analytics', 'status': status}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('x-babelstreetapi-concurrency', '3')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _start_stub(handler):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,))
+    thread.daemon = True
+    thread.start()
+    return server, 'http://127.0.0.1:%d/rest/v1/' % server.server_address[1]
+
+
+@pytest.fixture
+def stub_server():
+    server, url = _start_stub(_StubHandler)
+    yield url
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def stub_nodes():
+    """Two stub servers, each with its own list of statuses and of requests."""
+    handlers = [type('Handler', (_StubHandler,), {'statuses': [], 'hits': []}) for _ in range(2)]
+    servers = [_start_stub(handler) for handler in handlers]
+    yield [url for _, url in servers], handlers
+    for server, _ in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_pool_resize_keeps_connections(stub_server):
+    api = API('bogus_key', service_url=stub_server)
+    api.ping()
+    assert api.get_pool_size() == 3
+    api.ping()
+    pools = api._adapter.poolmanager.pools
+    pool = pools[list(pools.keys())[0]]
+    assert pool.pool.maxsize == 3
+    api.set_pool_size(1)
+    assert pool.pool.maxsize == 1
+    api.ping()
+    assert len(pools) == 1
+    assert pool.num_connections == 1
+
+
+def test_pool_queue_shrinks_while_in_use():
+    class Connection(object):
+        closed = False
+
+        def close(self):
+            self.closed = True
+
+    pool = _PoolQueue(2)
+    pool.put(None)
+    pool.put(None)
+    first = pool.get()
+    second = pool.get()
+    pool.resize(1)
+    assert pool.qsize() == 0
+    connections = [Connection(), Connection()]
+    pool.put(connections[0])
+    pool.put(connections[1])
+    assert connections[0].closed and not connections[1].closed
+    assert pool.get() is connections[1]
+    pool.resize(3)
+    assert pool.qsize() == 2
+    assert first is None and second is None
+
+
+def test_transient_statuses_retried(stub_server):
+    _StubHandler.statuses = [503, 429]
+    api = API('bogus_key', service_url=stub_server, retries=2, refresh_duration=0,
+              retry_statuses=RETRY_STATUSES)
+    assert api.ping()['status'] == 200
+
+    _StubHandler.statuses = [503, 503]
+    api = API('bogus_key', service_url=stub_server, retries=1, refresh_duration=0,
+              retry_statuses=RETRY_STATUSES)
+    with pytest.raises(RosetteException) as e_rosette:
+        api.ping()
+    assert e_rosette.value.status == 503
+
+
+def test_connections_not_retried_by_default():
+    api = API('bogus_key', service_url='http://127.0.0.1:9/rest/v1/')
+    start = time.monotonic()
+    with pytest.raises(RosetteException):
+        api.ping()
+    assert time.monotonic() - start < 0.5
+    assert api.retry.connect == 0
+
+
+def test_statuses_not_retried_by_default(stub_server):
+    _StubHandler.statuses = [503]
+    del _StubHandler.hits[:]
+    api = API('bogus_key', service_url=stub_server)
+    with pytest.raises(RosetteException) as e_rosette:
+        api.ping()
+    assert e_rosette.value.status == 503
+    assert len(_StubHandler.hits) == 1
+
+
+def test_health_check_keeps_custom_headers(stub_nodes):
+    urls, _ = stub_nodes
+    api = API('bogus_key', service_url=urls)
+    api.set_custom_headers('X-BabelStreetAPI-Test', 'next call')
+    assert api.check_health('INFO') == {urls[0]: True, urls[1]: True}
+    assert api.get_custom_headers() == {'X-BabelStreetAPI-Test': 'next call'}
+
+
+def test_balanced_nodes(stub_nodes):
+    urls, handlers = stub_nodes
+    api = API('bogus_key', service_url=urls)
+    assert api.service_url == urls[0]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda _: api.ping(), range(12)))
+    assert handlers[0].hits and handlers[1].hits
+    # Each node advertises a concurrency of 3
+    assert api.get_pool_size() == 6
+
+
+def test_failover_on_connection_error(stub_nodes):
+    urls, handlers = stub_nodes
+    api = API('bogus_key', service_url=['http://127.0.0.1:9/rest/v1/', urls[0]],
+              retries=1, refresh_duration=0)
+    for _ in range(3):
+        assert api.ping()['status'] == 200
+    assert len(handlers[0].hits) == 3
+    assert api.check_health() == {'http://127.0.0.1:9/rest/v1/': False, urls[0]: True}
+
+
+def test_failover_on_unavailable(stub_nodes):
+    urls, handlers = stub_nodes
+    handlers[0].statuses = [503]
+    handlers[1].statuses = [200]
+    api = API('bogus_key', service_url=urls, retries=1, refresh_duration=0,
+              balance='latency')
+    api._balancer.turn = -1
+    assert api.ping()['status'] == 200
+    assert len(handlers[0].hits) == 1 and len(handlers[1].hits) == 1
+    assert api._balancer.nodes[0].down_until > 0
+
+
+def test_pool_per_node():
+    urls = ['http://node%d/rest/v1/' % number for number in range(12)]
+    api = API('bogus_key', service_url=urls)
+    assert api._adapter.poolmanager.pools._maxsize == 12
+
+
+def test_failover_statuses(stub_nodes):
+    urls, handlers = stub_nodes
+    handlers[0].statuses = [502, 502]
+    api = API('bogus_key', service_url=urls)
+    api._balancer.turn = -1
+    with pytest.raises(RosetteException) as e_rosette:
+        api.ping()
+    assert e_rosette.value.status == 502
+    assert len(handlers[0].hits) == 1 and not handlers[1].hits
+    assert api._balancer.nodes[0].down_until > 0
+
+    api = API('bogus_key', service_url=urls, failover_statuses=(502, 503))
+    api._balancer.turn = -1
+    assert api.ping()['status'] == 200
+    assert len(handlers[0].hits) == 2 and len(handlers[1].hits) == 1
+
+
+def test_failover_does_not_retry_nodes(stub_nodes):
+    urls, handlers = stub_nodes
+    handlers[0].statuses = [503] * 3
+    handlers[1].statuses = [503] * 3
+    api = API('bogus_key', service_url=urls, retry_statuses=(503,))
+    start = time.monotonic()
+    with pytest.raises(RosetteException) as e_rosette:
+        api.ping()
+    assert e_rosette.value.status == 503
+    assert len(handlers[0].hits) == 1 and len(handlers[1].hits) == 1
+    assert time.monotonic() - start < 1
+
+
+@pook.on
+def test_submit(api, json_response, doc_params):
+    pook.post(url=get_base_url() + "v1/entities", times=4,
+              response_json=json_response, reply=200,
+              response_headers={'x-babelstreetapi-concurrency': '2'})
+    pook.post(url=get_base_url() + "v1/morphology/lemmas",
+              response_json=json_response, reply=200)
+
+    futures = [api.submit('entities', doc_params) for _ in range(3)]
+    futures.append(api.submit('MORPHOLOGY', doc_params, facet='lemmas'))
+    assert all(future.result()['name'] == 'Babel Street Analytics' for future in futures)
+    api.close()
+
+
+def test_submitted_calls_overlap():
+    with StubServer(concurrency=8, latency=0.2) as stub:
+        api = API('bogus_key', service_url=stub.url)
+        start = time.monotonic()
+        futures = [api.submit('ping') for _ in range(8)]
+        assert all(future.result()['responseHeaders'] for future in as_completed(futures))
+        assert time.monotonic() - start < 0.8
+        api.close()
+
+
+def test_submit_unknown_endpoint(api):
+    with pytest.raises(RosetteException) as e_rosette:
+        api.submit('nothing', None)
+    assert e_rosette.value.status == 'badArgument'
+
+
+def _scheduled_api(monkeypatch, pool_size, **kwargs):
+    """An API whose requests record their priority and wait for C{release}."""
+    api = API('bogus_key', **kwargs)
+    api.set_pool_size(pool_size)
+    api.order = []
+    api.release = threading.Event()
+
+    def send_to_host(request):
+        api.order.append(api._scheduler.current())
+        api.release.wait(5)
+        response = requests.models.Response()
+        response.status_code = 200
+        response._content = b'{}'
+        return response
+
+    monkeypatch.setattr(api, '_API__send_to_host', send_to_host)
+    return api
+
+
+def _wait_for(condition):
+    for _ in range(500):
+        if condition():
+            return
+        time.sleep(0.01)
+    raise AssertionError('timed out')
+
+
+def test_weighted_fair_scheduling(monkeypatch):
+    api = _scheduled_api(monkeypatch, 1, priority_weights=DEFAULT_PRIORITY_WEIGHTS)
+
+    def ping(priority):
+        with api.priority(priority):
+            api.ping()
+
+    with ThreadPoolExecutor(max_workers=9) as executor:
+        executor.submit(ping, PRIORITY_NORMAL)
+        _wait_for(lambda: api.order)
+        for priority in [PRIORITY_LOW, PRIORITY_HIGH] * 4:
+            executor.submit(ping, priority)
+        _wait_for(lambda: sum(len(waiting) for waiting in api._scheduler.waiting.values()) == 8)
+        api.release.set()
+    assert api.order == [PRIORITY_NORMAL] + [PRIORITY_HIGH] * 4 + [PRIORITY_LOW] * 4
+
+
+def test_reserved_share(monkeypatch):
+    api = _scheduled_api(monkeypatch, 4, reserved_share=0.25)
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        for _ in range(4):
+            executor.submit(api.ping)
+        _wait_for(lambda: len(api.order) == 3 and api._scheduler.waiting[PRIORITY_NORMAL])
+        with api.priority(PRIORITY_HIGH):
+            future = api.submit('ping')
+        _wait_for(lambda: len(api.order) == 4)
+        assert api.order[-1] == PRIORITY_HIGH
+        api.release.set()
+        future.result()
+    assert len(api.order) == 5
+
+    with pytest.raises(RosetteException):
+        with api.priority('urgent'):
+            pass
+
+
+@pook.on
+def test_request_events(json_response, doc_params, caplog):
+    pook.post(url=get_base_url() + "v1/entities", times=2,
+              response_json=json_response, reply=200)
+    pook.post(url=get_base_url() + "v1/tokens",
+              response_json=json_response, reply=200)
+
+    api = API('bogus_key', log_sampling={'tokens': 0})
+    with caplog.at_level(logging.INFO, logger='rosette.api.requests'):
+        api.entities(doc_params)
+        api.tokens(doc_params)
+    events = [record for record in caplog.records if record.name == 'rosette.api.requests']
+    assert len(events) == 1
+    assert events[0].endpoint == 'entities'
+    assert events[0].status == 200
+    assert events[0].bytes_received == len(json_response)
+    assert events[0].getMessage().startswith('request endpoint=entities status=200')
+
+    caplog.clear()
+    with caplog.at_level(logging.WARNING, logger='rosette.api.requests'):
+        api.entities(doc_params)
+    assert not caplog.records
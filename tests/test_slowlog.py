@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2014-2024 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import hashlib
+import json
+import pook
+import pytest
+import requests
+from rosette.api import API, RosetteException
+from rosette.slowlog import SlowCallLog
+from tests import document_params, get_base_url
+
+
+@pook.on
+def test_slow_calls_recorded():
+    pook.post(url=get_base_url() + "v1/entities", times=3,
+              response_json=json.dumps({'entities': []}), reply=200)
+
+    log = SlowCallLog(latency=0, capacity=2)
+    api = API('bogus_key', slow_calls=log)
+    api.set_option('linkEntities', False)
+    for text in ('first', 'second', 'third'):
+        api.entities(document_params(text, 'eng'))
+    records = log.records()
+    assert len(records) == 2
+    record = records[-1]
+    assert record['endpoint'] == 'entities'
+    assert record['status'] == 200
+    assert record['language'] == 'eng'
+    assert record['options'] == {'linkEntities': False}
+    assert record['content_length'] == len('third')
+    assert record['content_hash'] == hashlib.sha256(b'third').hexdigest()
+    assert record['timings']['total'] >= record['timings']['headers'] >= 0
+
+
+@pook.on
+def test_thresholds_and_sampling():
+    pook.post(url=get_base_url() + "v1/entities", times=3,
+              response_json=json.dumps({'entities': []}), reply=200)
+
+    # The request bodies are 39 and 51 bytes long
+    by_size = SlowCallLog(latency=None, size=45)
+    api = API('bogus_key', slow_calls=by_size)
+    api.entities(document_params('short', 'eng'))
+    api.entities(document_params('a longer document', 'eng'))
+    assert [record['content_length'] for record in by_size.records()] == [17]
+
+    unsampled = SlowCallLog(latency=0, sample=0)
+    API('bogus_key', slow_calls=unsampled).entities(document_params('short', 'eng'))
+    assert unsampled.records() == []
+
+
+def test_connection_errors_recorded():
+    log = SlowCallLog(latency=0)
+    api = API('bogus_key', service_url='http://127.0.0.1:9/rest/v1/', retries=1, refresh_duration=0,
+              slow_calls=log)
+    with pytest.raises(RosetteException):
+        api.ping()
+    assert log.records()[0]['status'] == 'ConnectionError'
+
+
+def test_fast_calls_not_inspected():
+    # The body cannot even be encoded: a call under the thresholds must not look at it
+    request = requests.Request('POST', get_base_url() + 'v1/entities', data='{"content": "\ud800"}')
+    log = SlowCallLog(latency=1.0)
+    log.observe(request, None, {'started': 0.0, 'finished': 0.5}, ConnectionError())
+    assert log.records() == []
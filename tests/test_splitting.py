@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2014-2024 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import pook
+import pytest
+from rosette.api import API, RosetteException
+from rosette.results import TokensResult
+from rosette.splitting import call_split, merge_results, split_text
+from tests import get_base_url
+
+
+def test_split_text_boundaries():
+    text = "First sentence here. Second one.\n\nA new paragraph. " + "x" * 30
+    chunks = split_text(text, 40)
+    assert ''.join(chunks) == text
+    assert chunks[0] == "First sentence here. Second one.\n\n"
+    assert all(len(chunk.encode('utf-8')) <= 40 for chunk in chunks)
+
+
+def test_split_text_small_document():
+    assert split_text("short", 40) == ["short"]
+
+
+def test_merge_entities_across_chunks():
+    chunks = ["Bob met Q. ", "Bob left."]
+    results = [
+        {'entities': [{'type': 'PERSON', 'mention': 'Bob', 'normalized': 'Bob', 'count': 1,
+                       'entityId': 'T0', 'mentionOffsets': [{'startOffset': 0, 'endOffset': 3}]},
+                      {'type': 'LOCATION', 'mention': 'Q', 'normalized': 'Q', 'count': 1,
+                       'entityId': 'Q42', 'mentionOffsets': [{'startOffset': 8, 'endOffset': 9}]}],
+         'responseHeaders': {}},
+        {'entities': [{'type': 'PERSON', 'mention': 'Bob', 'normalized': 'Bob', 'count': 1,
+                       'entityId': 'T0', 'mentionOffsets': [{'startOffset': 0, 'endOffset': 3}]}]}]
+
+    merged = merge_results('ENTITIES', chunks, results)
+    assert len(merged['entities']) == 2
+    bob = merged['entities'][0]
+    assert bob['count'] == 2
+    assert bob['mentionOffsets'] == [{'startOffset': 0, 'endOffset': 3},
+                                     {'startOffset': 11, 'endOffset': 14}]
+    # The inputs are not modified.
+    assert results[1]['entities'][0]['mentionOffsets'][0]['startOffset'] == 0
+
+
+def test_merge_syntax_dependencies():
+    results = [{'sentences': [{'startTokenIndex': 0, 'endTokenIndex': 1,
+                               'dependencies': [{'governorTokenIndex': -1, 'dependentTokenIndex': 0}]}],
+                'tokens': ['a', 'b']},
+               {'sentences': [{'startTokenIndex': 0, 'endTokenIndex': 0,
+                               'dependencies': [{'governorTokenIndex': -1, 'dependentTokenIndex': 0}]}],
+                'tokens': ['c']}]
+    merged = merge_results('SYNTAX_DEPENDENCIES', ['a b. ', 'c'], results)
+    assert merged['tokens'] == ['a', 'b', 'c']
+    assert merged['sentences'][1]['startTokenIndex'] == 2
+    assert merged['sentences'][1]['dependencies'][0] == {'governorTokenIndex': -1, 'dependentTokenIndex': 2}
+
+
+@pook.on
+def test_call_split_tokens():
+    pook.post(url=get_base_url() + "v1/tokens",
+              response_json=json.dumps({'tokens': ['One', '.']}),
+              reply=200,
+              times=2)
+
+    result = call_split(API('bogus_key'), 'tokens', "One.\n\nOne.", max_bytes=6)
+    assert result['tokens'] == ['One', '.', 'One', '.']
+
+    pook.post(url=get_base_url() + "v1/tokens",
+              response_json=json.dumps({'tokens': ['One', '.']}),
+              reply=200,
+              times=2)
+    result = call_split(API('bogus_key', typed_results=True), 'tokens', "One.\n\nOne.", max_bytes=6)
+    assert isinstance(result, TokensResult)
+    assert result.tokens == ['One', '.', 'One', '.']
+
+
+def test_call_split_unsupported():
+    with pytest.raises(RosetteException) as e_rosette:
+        call_split(API('bogus_key'), 'sentiment', "text")
+    assert e_rosette.value.status == 'badArgument'
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2014-2024 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import threading
+import time
+import pook
+import pytest
+from rosette.api import RosetteException
+from rosette.tenants import MultiTenantAPI, _RateLimiter
+from tests import get_base_url
+
+
+@pook.on
+def test_tenants_share_the_session():
+    pook.get(url=get_base_url() + "v1/ping", headers={'X-BabelStreetAPI-Key': 'first'},
+             response_json=json.dumps({'message': 'first'}), reply=200,
+             response_headers={'x-babelstreetapi-concurrency': '3'})
+    pook.get(url=get_base_url() + "v1/ping", headers={'X-BabelStreetAPI-Key': 'second'},
+             response_json=json.dumps({'code': 'unauthorized', 'message': 'bad key'}), reply=401)
+
+    with MultiTenantAPI() as client:
+        assert client.call('first', 'ping')['message'] == 'first'
+        with pytest.raises(RosetteException):
+            client.call('second', 'ping')
+        assert client.api('first').session is client.api('second').session
+        metrics = client.metrics()
+        assert metrics['first']['calls'] == 1 and metrics['first']['concurrency'] == 3
+        assert metrics['second']['errors'] == {'unauthorized': 1}
+        assert metrics['second']['concurrency'] == 1
+        assert client.transport.get_pool_size() == 32
+
+
+def test_least_recently_used_tenant_evicted():
+    client = MultiTenantAPI(max_tenants=2)
+    first = client.api('first')
+    client.api('second')
+    client.api('first')
+    client.api('third')
+    assert sorted(client.metrics()) == ['first', 'third']
+    assert client.api('first') is first
+    client.close()
+
+
+def test_eviction_does_not_block_other_tenants():
+    client = MultiTenantAPI(max_tenants=1)
+    closing = threading.Event()
+    release = threading.Event()
+
+    def slow_close():
+        closing.set()
+        release.wait(5)
+    client.api('first').close = slow_close
+    evicting = threading.Thread(target=client.api, args=('second',))
+    evicting.start()
+    assert closing.wait(2)
+    # The evicted tenant is still closing
+    assert sorted(client.metrics()) == ['second']
+    release.set()
+    evicting.join()
+    client.close()
+
+
+def test_rate_limiter():
+    limiter = _RateLimiter(rate=50, burst=2)
+    start = time.monotonic()
+    for _ in range(5):
+        limiter.acquire()
+    # Two calls in the burst, three at 50 per second
+    assert time.monotonic() - start >= 0.05
+
+
+def test_unknown_endpoint():
+    client = MultiTenantAPI()
+    with pytest.raises(RosetteException) as e_rosette:
+        client.call('first', 'nothing')
+    assert e_rosette.value.status == 'badArgument'
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+"""
+Copyright (c) 2014-2024 Basis Technology Corporation.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import pook
+import pytest
+from rosette.api import API, RosetteException
+from tests import get_base_url
+
+numpy = pytest.importorskip("numpy")
+
+from rosette.vectors import VectorIndex  # noqa: E402
+
+
+@pytest.fixture
+def index():
+    """ fixture to return a small index """
+    tmp_index = VectorIndex(api=API('bogus_key'))
+    tmp_index.add('east', [1.0, 0.0, 0.0])
+    tmp_index.add('north', [0.0, 1.0, 0.0])
+    tmp_index.add_result('north-east', {'documentEmbedding': [1.0, 1.0, 0.0]})
+    return tmp_index
+
+
+def test_query_by_vector(index):
+    result = index.query([2.0, 0.1, 0.0], k=2)
+    assert [doc_id for doc_id, _ in result] == ['east', 'north-east']
+    assert result[0][1] > result[1][1]
+
+
+def test_dimension_mismatch(index):
+    with pytest.raises(RosetteException) as e_rosette:
+        index.add('bad', [1.0, 0.0])
+    assert e_rosette.value.status == 'badArgument'
+    with pytest.raises(RosetteException) as e_rosette:
+        index.query([1.0, 0.0])
+    assert e_rosette.value.status == 'badArgument'
+
+
+def test_save_and_load_mmap(index, tmpdir):
+    path = str(tmpdir.join('index'))
+    index.save(path)
+    loaded = VectorIndex.load(path)
+    assert isinstance(loaded._matrix, numpy.memmap)
+    assert len(loaded) == 3
+    assert loaded.query([0.0, 1.0, 0.0], k=1)[0][0] == 'north'
+
+    loaded.add('up', [0.0, 0.0, 1.0])
+    assert loaded.query([0.0, 0.0, 1.0], k=1)[0][0] == 'up'
+
+
+@pook.on
+def test_query_by_text_is_cached(index):
+    pook.post(url=get_base_url() + "v1/semantics/vector",
+              response_json=json.dumps({'documentEmbedding': [0.0, 3.0, 0.0]}),
+              reply=200,
+              times=1)
+
+    assert index.query('northward', k=1)[0][0] == 'north'
+    # A second call would fail, the mock only answers once.
+    assert index.query('northward', k=1)[0][0] == 'north'